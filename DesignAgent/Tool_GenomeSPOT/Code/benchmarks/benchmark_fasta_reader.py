@@ -0,0 +1,108 @@
+"""Benchmark `genome_spot.fasta` against `helpers.iterate_fasta`.
+
+By default ~10 MB of proteome and ~10 MB of contigs are built by repeating
+the test genome, and each is read plain and gzipped. "iterate_fasta" is the
+text reader used before (gzip through `io.TextIOWrapper`); the others are the
+bytes reader with one or two threads and the code-array reader.
+
+```shell
+python -m benchmarks.benchmark_fasta_reader [-p proteins.faa] [-c contigs.fna] [--size-mb 10]
+```
+"""
+
+import argparse
+import gzip
+import io
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from genome_spot.bioinformatics.dna import NUCLEOTIDE_CODES
+from genome_spot.fasta import (
+    iterate_fasta_bytes,
+    iterate_fasta_codes,
+    iterate_fasta_records,
+)
+from genome_spot.helpers import iterate_fasta
+
+
+TEST_DATA = Path(__file__).resolve().parents[1] / "tests/test_data"
+TEST_PROTEINS = TEST_DATA / "GCA_000172155.1_ASM17215v1_protein.faa.gz"
+TEST_CONTIGS = TEST_DATA / "GCA_000172155.1_ASM17215v1_genomic.fna.gz"
+
+
+def make_fasta(source: Path, target: Path, size_mb: float):
+    """Writes `target` (plain) and `target.gz` by repeating `source` up to `size_mb`"""
+    with gzip.open(source, "rb") as fh:
+        text = fh.read()
+    n_repeats = max(1, int(size_mb * 1e6 // len(text)))
+    with open(target, "wb") as fh:
+        for _ in range(n_repeats):
+            fh.write(text)
+    with open(target, "rb") as fh_in, gzip.open(f"{target}.gz", "wb", compresslevel=6) as fh_out:
+        shutil.copyfileobj(fh_in, fh_out)
+
+
+def read_with_iterate_fasta(path: str) -> int:
+    if path.endswith(".gz"):
+        fh = io.TextIOWrapper(io.BufferedReader(gzip.open(path, "r")))
+    else:
+        fh = open(path, "r")
+    n_residues = sum(len(sequence) for _, sequence in iterate_fasta(fh))
+    fh.close()
+    return n_residues
+
+
+READERS = {
+    "iterate_fasta": read_with_iterate_fasta,
+    "records (str)": lambda path: sum(len(sequence) for _, sequence in iterate_fasta_records(path)),
+    "bytes": lambda path: sum(len(sequence) for _, sequence in iterate_fasta_bytes(path)),
+    "bytes, threads=2": lambda path: sum(len(sequence) for _, sequence in iterate_fasta_bytes(path, threads=2)),
+    "codes": lambda path: sum(len(codes) for _, codes in iterate_fasta_codes(path, NUCLEOTIDE_CODES)),
+}
+
+
+def time_reader(reader, path: str, repeats: int = 3) -> float:
+    """Returns the best of `repeats` timings in seconds"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        reader(path)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-p", "--proteins", default=None, help="Protein FASTA to read instead of the test proteome")
+    parser.add_argument("-c", "--contigs", default=None, help="Contig FASTA to read instead of the test contigs")
+    parser.add_argument("--size-mb", type=float, default=10, help="Size of generated files")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = {}
+        for name, custom_path, source in [
+            ("proteome", args.proteins, TEST_PROTEINS),
+            ("contigs", args.contigs, TEST_CONTIGS),
+        ]:
+            if custom_path is not None:
+                files[name] = [custom_path]
+            else:
+                target = Path(tmp_dir) / f"{name}.fa"
+                make_fasta(source, target, args.size_mb)
+                files[name] = [str(target), f"{target}.gz"]
+
+        for name, paths in files.items():
+            for path in paths:
+                size_mb = Path(path).stat().st_size / 1e6
+                print(f"{name} {Path(path).name} ({size_mb:.1f} MB on disk)")
+                baseline = None
+                for reader_name, reader in READERS.items():
+                    seconds = time_reader(reader, path)
+                    baseline = baseline or seconds
+                    print(f"  {reader_name:<18} {seconds:7.3f} s  {baseline / seconds:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Benchmark `join_outputs` on many prediction TSVs.
+
+For each size, that many <accession>.predictions.tsv files are written from the
+test genome's predictions with jittered values. "pandas" is the joiner used
+before (`pd.read_csv` and `pd.melt` per file, then `pd.concat` of one-row
+frames); "threads=N" is the text reader with N threads filling one table.
+
+```shell
+python -m benchmarks.benchmark_join_outputs [--sizes 1000 10000 50000] [--threads 1 8] [--max-pandas 10000]
+```
+"""
+
+import argparse
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from genome_spot.genome_spot import GenomeSPOT
+from genome_spot.join_outputs import (
+    convert_outputs_to_nested_dict,
+    convert_outputs_to_single_tsv,
+    get_output_filepaths,
+    load_output_tsv,
+)
+
+
+TEST_PREDICTIONS = Path(__file__).resolve().parents[1] / "tests/test_data/GCA_000172155.predictions.json"
+
+
+def write_outputs(outdir: Path, n_files: int, seed: int = 0):
+    """Writes `n_files` prediction TSVs with jittered values"""
+    with open(TEST_PREDICTIONS, "r", encoding="utf-8") as fh:
+        predictions = json.load(fh)
+    rng = random.Random(seed)
+    for i in range(n_files):
+        jittered = {
+            target: {**values, "value": values["value"] * rng.uniform(0.9, 1.1)}
+            if isinstance(values["value"], float)
+            else values
+            for target, values in predictions.items()
+        }
+        with open(outdir / f"GCA_{i:09d}.predictions.tsv", "w", encoding="utf-8") as fh:
+            fh.write(GenomeSPOT().format_to_tsv(jittered))
+
+
+def pandas_single_tsv(output_files: list) -> pd.DataFrame:
+    """The previous joiner"""
+    dfs = []
+    for tsv in output_files:
+        accession, predictions_df = load_output_tsv(tsv)
+        melted_df = pd.melt(
+            predictions_df.reset_index().rename(columns={"value": "prediction"}),
+            id_vars=["target"],
+            value_vars=["prediction", "error", "units", "is_novel", "warning"],
+        )
+        melted_df = melted_df.set_index(["target", "variable"]).rename(columns={"value": accession}).T
+        dfs.append(melted_df)
+    return pd.concat(dfs, axis=0)
+
+
+def pandas_nested_dict(output_files: list) -> dict:
+    """The previous nested-dict builder, without nesting"""
+    return {accession: df.T.to_dict() for accession, df in map(load_output_tsv, output_files)}
+
+
+def time_call(function, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000], help="Numbers of files")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8], help="Reader thread counts")
+    parser.add_argument(
+        "--max-pandas", type=int, default=10000, help="Skip the previous joiner above this many files"
+    )
+    args = parser.parse_args()
+
+    for n_files in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            write_outputs(Path(tmp_dir), n_files)
+            output_files = get_output_filepaths(tmp_dir)
+            print(f"{n_files} files")
+            for name, previous, current in [
+                ("single TSV", pandas_single_tsv, convert_outputs_to_single_tsv),
+                ("nested dict", pandas_nested_dict, convert_outputs_to_nested_dict),
+            ]:
+                baseline = None
+                if n_files <= args.max_pandas:
+                    baseline = time_call(previous, output_files)
+                    print(f"  {name:<12} {'pandas':<10} {baseline:8.2f} s")
+                for threads in args.threads:
+                    seconds = time_call(current, output_files, threads=threads)
+                    speedup = f"{baseline / seconds:5.1f}x" if baseline else ""
+                    print(f"  {name:<12} {f'threads={threads}':<10} {seconds:8.2f} s  {speedup}".rstrip())
+
+
+if __name__ == "__main__":
+    main()
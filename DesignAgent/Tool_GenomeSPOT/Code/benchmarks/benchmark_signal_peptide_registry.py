@@ -0,0 +1,66 @@
+"""Benchmark per-genome protein measurement with and without the shared signal peptide HMM.
+
+"Before" reproduces the old behavior of deserializing the HMM for every protein by
+clearing the model registry ahead of each `Protein`. "After" uses the registry.
+
+```shell
+python -m benchmarks.benchmark_signal_peptide_registry [-p proteins.faa.gz]
+```
+"""
+
+import argparse
+import gzip
+import io
+import time
+from pathlib import Path
+
+from genome_spot.bioinformatics.protein import Protein
+from genome_spot.bioinformatics.signal_peptide import (
+    SignalPeptideHMM,
+    clear_model_registry,
+)
+from genome_spot.helpers import iterate_fasta
+
+
+TEST_PROTEINS = Path(__file__).resolve().parents[1] / "tests/test_data/GCA_000172155.1_ASM17215v1_protein.faa.gz"
+
+
+def load_sequences(faa_path: str) -> list:
+    """Loads protein sequences from a (gzipped) FASTA file"""
+    if str(faa_path).endswith(".gz"):
+        fh = io.TextIOWrapper(io.BufferedReader(gzip.open(faa_path, "r")))
+    else:
+        fh = open(faa_path, "r")
+    sequences = [sequence for _, sequence in iterate_fasta(fh)]
+    fh.close()
+    return sequences
+
+
+def time_proteome(sequences: list, reload_each_protein: bool) -> float:
+    """Returns seconds to compute protein metrics for every sequence"""
+    start = time.perf_counter()
+    for sequence in sequences:
+        if reload_each_protein is True:
+            clear_model_registry()
+            Protein(sequence, signal_peptide_model=SignalPeptideHMM()).protein_metrics()
+        else:
+            Protein(sequence).protein_metrics()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-p", "--proteins", default=str(TEST_PROTEINS), help="Protein FASTA (.gz allowed)")
+    args = parser.parse_args()
+
+    sequences = load_sequences(args.proteins)
+    before = time_proteome(sequences, reload_each_protein=True)
+    after = time_proteome(sequences, reload_each_protein=False)
+    print(f"proteins: {len(sequences)}")
+    print(f"before (HMM loaded per protein): {before:.2f} s per genome")
+    print(f"after (shared HMM):              {after:.2f} s per genome")
+    print(f"speedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,51 @@ from collections import defaultdict
 from itertools import product
 from typing import Dict
 
+import numpy as np
+
 from ..helpers import count_kmers
 
 
+NUCLEOTIDES = ["A", "C", "G", "T"]
+OTHER_CODE = len(NUCLEOTIDES)
+# Byte -> nucleotide index, with OTHER_CODE for N, lowercase and anything else
+NUCLEOTIDE_CODES = np.full(256, OTHER_CODE, dtype=np.uint8)
+NUCLEOTIDE_CODES[np.frombuffer("".join(NUCLEOTIDES).encode("ascii"), dtype=np.uint8)] = np.arange(len(NUCLEOTIDES))
+# Contigs are counted in chunks to bound the size of temporary arrays
+CHUNK_SIZE = 1 << 22
+
+
+def encode_dna(sequence: str) -> np.ndarray:
+    """Maps a DNA sequence to uint8 codes indexing NUCLEOTIDES (OTHER_CODE otherwise)"""
+    return NUCLEOTIDE_CODES[np.frombuffer(sequence.encode("ascii", errors="replace"), dtype=np.uint8)]
+
+
+def count_nucleotide_kmers(codes: np.ndarray, k: int) -> np.ndarray:
+    """Counts 1-mers or 2-mers of A/C/G/T only, indexed like NUCLEOTIDES (2-mers: 4 * first + second)"""
+    n_codes = OTHER_CODE + 1
+    counts = np.zeros(n_codes**k, dtype=np.int64)
+    for start in range(0, len(codes), CHUNK_SIZE):
+        chunk = codes[start : start + CHUNK_SIZE + k - 1]
+        if len(chunk) < k:
+            continue
+        if k == 1:
+            kmer_codes = chunk
+        elif k == 2:
+            kmer_codes = chunk[:-1].astype(np.intp) * n_codes + chunk[1:]
+        else:
+            raise ValueError("Only 1-mers and 2-mers can be counted from codes")
+        counts += np.bincount(kmer_codes, minlength=n_codes**k)
+    is_nucleotide_kmer = np.ones(n_codes**k, dtype=bool)
+    for position in range(k):
+        is_nucleotide_kmer &= (np.arange(n_codes**k) // n_codes**position) % n_codes != OTHER_CODE
+    return counts[is_nucleotide_kmer]
+
+
+def nucleotide_kmers(k: int) -> list:
+    """K-mers in the order returned by `count_nucleotide_kmers`"""
+    return ["".join(kmer) for kmer in product(NUCLEOTIDES, repeat=k)]
+
+
 class DNA:
     """Calculations on a DNA sequence.
 
@@ -53,7 +95,7 @@ class DNA:
         counts for both 'AA' and its reverse complement 'TT'. Canonical
         is determined by lexicographic order.
         """
-        kmers_count = count_kmers(self.sequence, k)
+        kmers_count = self._count_kmers(k)
 
         canonical_kmers_dict = self.make_canonical_kmers_dict(k)
         canonical_kmers_count = defaultdict(int)
@@ -63,6 +105,14 @@ class DNA:
                 canonical_kmers_count[canonical_kmer] += count
         return dict(canonical_kmers_count)
 
+    def _count_kmers(self, k: int) -> Dict[str, int]:
+        """Returns counts of observed k-mers; 1-mers and 2-mers only
+        include A/C/G/T, which is all that canonical counting uses."""
+        if k <= 2:
+            counts = count_nucleotide_kmers(encode_dna(self.sequence), k)
+            return {kmer: int(count) for kmer, count in zip(nucleotide_kmers(k), counts) if count > 0}
+        return count_kmers(self.sequence, k)
+
     def nt_1mer_frequencies(self) -> Dict[str, float]:
         """Count frequencies of canonical 1-mers"""
         if self._nt_1mer_frequencies is None:
@@ -103,3 +153,48 @@ class DNA:
             sequence_metrics["nt_{}".format(nt)] = float(count)
 
         return sequence_metrics
+
+
+class StreamingDNA(DNA):
+    """Accumulates DNA statistics over many sequences, e.g. the contigs
+    of a genome, without joining them into one string.
+
+    Only 1-mer and 2-mer counts are kept, so memory is proportional to
+    the longest sequence added rather than to the whole genome. Metrics
+    match `DNA` computed on the sequences joined by `separator`.
+
+    Typical usage:
+    ```
+    dna_calc = StreamingDNA(separator="NN")
+    for header, contig in iterate_fasta(fh):
+        dna_calc.add_sequence(contig)
+    dna_metrics = dna_calc.nucleotide_metrics()
+    ```
+    """
+
+    def __init__(self, separator: str = ""):
+        """
+        Args:
+            separator: Non-nucleotide string that would join sequences, counted
+                in the length once before each sequence
+        """
+        super().__init__("")
+        self.separator = separator
+        self._kmer_counts = {k: np.zeros(len(NUCLEOTIDES) ** k, dtype=np.int64) for k in (1, 2)}
+
+    def add_sequence(self, sequence: str):
+        """Adds the k-mer counts and length of one sequence"""
+        self.add_codes(encode_dna(sequence))
+
+    def add_codes(self, codes: np.ndarray):
+        """Adds the k-mer counts and length of one sequence encoded with NUCLEOTIDE_CODES"""
+        for k, counts in self._kmer_counts.items():
+            counts += count_nucleotide_kmers(codes, k)
+        self.length += len(self.separator) + len(codes)
+        self._nt_1mer_frequencies = None
+        self._nt_2mer_frequencies = None
+
+    def _count_kmers(self, k: int) -> Dict[str, int]:
+        if k not in self._kmer_counts:
+            raise ValueError("StreamingDNA only counts 1-mers and 2-mers")
+        return {kmer: int(count) for kmer, count in zip(nucleotide_kmers(k), self._kmer_counts[k]) if count > 0}
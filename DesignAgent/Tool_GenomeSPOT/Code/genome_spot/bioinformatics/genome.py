@@ -2,22 +2,36 @@
 Measures properties of a genome (fasta + protein-fasta).
 """
 
-import gzip
-import io
 import json
 import logging
 from collections import defaultdict
 from pathlib import Path
-from typing import Dict
+from typing import (
+    Dict,
+    Optional,
+    Union,
+)
 
 import numpy as np
+import pandas as pd
 
-from ..helpers import iterate_fasta
-from .dna import DNA
+from ..fasta import (
+    iterate_fasta_codes,
+    iterate_fasta_records,
+)
+from .dna import (
+    NUCLEOTIDE_CODES,
+    StreamingDNA,
+)
 from .protein import (
     DIFF_HYDROPHOBICITY_MEMBRANE,
     Protein,
+    proteome_isoelectric_points,
 )
+from .signal_peptide import SignalPeptideHMM
+
+
+LOCALIZATIONS = ["extra_soluble", "intra_soluble", "membrane"]
 
 
 class Genome:
@@ -51,103 +65,134 @@ class Genome:
         if Path(self.faa_filepath).exists() is False:
             raise FileNotFoundError(f"Input file {self.faa_filepath} does not exist")
         self.prefix = self.fna_filepath.split("/")[-1]
-        self._protein_data = None
-        self._protein_data_keys = None
+        self._protein_table = None
         self._protein_localization = None
 
-    def protein_data(self):
+    def protein_table(self) -> pd.DataFrame:
         """
-        Returns a dictionary of properties for each protein.
+        Returns a columnar table of properties for each protein, indexed by protein id.
 
         Association of properties to every protein allows statistics
         to be computed jointly with multiple values, such as weighting
-        a statistic by protein length.
+        a statistic by protein length. Columns are the keys of
+        `Protein.protein_metrics`; amino acid frequencies and other
+        per-protein scales are stored as float32 to keep the table compact.
         """
-        if self._protein_data is None:
-            self._protein_data = {}
-            if self.faa_filepath.endswith(".gz"):
-                fh = io.TextIOWrapper(io.BufferedReader(gzip.open(self.faa_filepath, "r")))
-            else:
-                fh = open(self.faa_filepath, "r")
-            fh.seek(0)
-            for header, sequence in iterate_fasta(fh):
+        if self._protein_table is None:
+            signal_peptide_model = SignalPeptideHMM()
+            proteins = {}
+            for header, sequence in iterate_fasta_records(self.faa_filepath):
                 protein_id = header.split(" ")[0]
-                self._protein_data[protein_id] = Protein(
+                proteins[protein_id] = Protein(
                     protein_sequence=sequence,
                     remove_signal_peptide=True,
-                ).protein_metrics()
-            fh.close()
+                    signal_peptide_model=signal_peptide_model,
+                )
 
-            self._protein_data_keys = set([key for _dict in self._protein_data.values() for key in _dict.keys()])
+            # localize the whole proteome in one batch
+            signal_peptides = signal_peptide_model.predict_signal_peptides_batch(
+                [protein.sequence for protein in proteins.values()]
+            )
+            columns = defaultdict(list)
+            for protein, signal_peptide in zip(proteins.values(), signal_peptides):
+                metrics = protein.protein_metrics(signal_peptide=signal_peptide, compute_pi=False)
+                for key, value in metrics.items():
+                    columns[key].append(value)
+            columns["pi"] = proteome_isoelectric_points(list(proteins.values()))
+            self._protein_table = pd.DataFrame(
+                {key: np.asarray(values, dtype=self._column_dtype(key)) for key, values in sorted(columns.items())},
+                index=pd.Index(list(proteins.keys()), name="protein_id"),
+            )
 
-            # randomly subsample dictionary
+            # randomly subsample proteins
             if self.subsample < 1.0:
-                subsample_size = int(self.subsample * len(self._protein_data))
-                random_proteins = np.random.choice(list(self._protein_data.keys()), size=subsample_size, replace=False)
-                self._protein_data = {k: self._protein_data[k] for k in random_proteins}
+                subsample_size = int(self.subsample * len(self._protein_table))
+                random_proteins = np.random.choice(
+                    self._protein_table.index.tolist(), size=subsample_size, replace=False
+                )
+                self._protein_table = self._protein_table.loc[random_proteins]
+
+        return self._protein_table
+
+    def _column_dtype(self, key: str):
+        """pI and GRAVY are compared to thresholds so they are kept at full precision"""
+        if key == "is_exported":
+            return bool
+        elif key == "length":
+            return np.int32
+        elif key in ["pi", "gravy"]:
+            return np.float64
+        else:
+            return np.float32
 
-        return self._protein_data
+    def protein_data(self) -> Dict[str, dict]:
+        """
+        Returns a dictionary of properties for each protein.
 
-    def compute_protein_statistics(self, subset_proteins: set = None) -> Dict[str, float]:
+        This is a row-wise view of `protein_table`, kept for convenience;
+        statistics are computed from the table directly.
+        """
+        return self.protein_table().drop(columns="localization", errors="ignore").to_dict(orient="index")
+
+    def compute_protein_statistics(self, subset_proteins: Optional[Union[set, np.ndarray]] = None) -> Dict[str, float]:
         """
         Returns a dictionary of genome-wide statistics, based on
         measurements, to be used for downstream analyses
+
+        Args:
+            subset_proteins: Optional proteins to compute statistics over, either
+                a set of protein ids or a boolean mask over `protein_table` rows
         """
         protein_statistics = {}
 
-        if subset_proteins:
-            values_by_protein = {k: self.protein_data()[k] for k in sorted(subset_proteins)}
+        table = self.protein_table()
+        if subset_proteins is None or len(subset_proteins) == 0:
+            mask = np.ones(len(table), dtype=bool)
+        elif isinstance(subset_proteins, np.ndarray) and subset_proteins.dtype == bool:
+            mask = subset_proteins
         else:
-            values_by_protein = self.protein_data()
-
-        # Record values across proteins in lists
-        values_dict = defaultdict(list)
-        for protein, stats in values_by_protein.items():
-            if stats.get("length", np.nan) > 0:
-                for key in sorted(self._protein_data_keys):
-                    values_dict[key].append(stats.get(key, np.nan))
+            mask = table.index.isin(subset_proteins)
+        mask = mask & (table["length"].values > 0)
+        lengths = table["length"].values[mask].astype(np.float64)
 
         # Overall statistics
-        protein_statistics["total_proteins"] = len(values_dict["length"])
-        protein_statistics["total_protein_length"] = int(np.sum(values_dict["length"]))
+        protein_statistics["total_proteins"] = int(mask.sum())
+        protein_statistics["total_protein_length"] = int(np.sum(lengths))
 
         # Distributions
-        pis = np.array(values_dict["pi"])
+        pis = table["pi"].values[mask]
         protein_statistics["pis_acidic"] = float(np.sum((pis < 5.5)) / len(pis))
         protein_statistics["pis_neutral"] = float(np.sum(((pis >= 5.5) & (pis < 8.5))) / len(pis))
         protein_statistics["pis_basic"] = float(np.sum((pis >= 8.5)) / len(pis))
         step = 1
         for i in range(3, 12, step):
-            protein_statistics["pis_{}_{}".format(i, i + step)] = len(
-                [pi for pi in pis if pi >= i and pi < (i + 1)]
-            ) / len(pis)
+            protein_statistics["pis_{}_{}".format(i, i + step)] = float(np.sum((pis >= i) & (pis < (i + 1))) / len(pis))
 
         # means
         protein_statistics["mean_pi"] = float(np.mean(pis))
-        protein_statistics["mean_gravy"] = float(np.mean(values_dict["gravy"]))
-        protein_statistics["mean_zc"] = float(np.mean(values_dict["zc"]))
-        protein_statistics["mean_nh2o"] = float(np.mean(values_dict["nh2o"]))
-        protein_statistics["mean_protein_length"] = float(np.mean(values_dict["length"]))
+        protein_statistics["mean_gravy"] = float(np.mean(table["gravy"].values[mask], dtype=np.float64))
+        protein_statistics["mean_zc"] = float(np.mean(table["zc"].values[mask], dtype=np.float64))
+        protein_statistics["mean_nh2o"] = float(np.mean(table["nh2o"].values[mask], dtype=np.float64))
+        protein_statistics["mean_protein_length"] = float(np.mean(lengths))
         protein_statistics["mean_thermostable_freq"] = self._length_weighted_average(
-            values_dict["thermostable_freq"], values_dict["length"]
+            table["thermostable_freq"].values[mask], lengths
         )
 
         # ratios and proportion
-        zeros_list = [0] * len(values_dict["length"])
-        arg = self._length_weighted_average(values_dict.get("aa_R", zeros_list), values_dict["length"])
-        lys = self._length_weighted_average(values_dict.get("aa_K", zeros_list), values_dict["length"])
+        arg = self._length_weighted_average(table["aa_R"].values[mask], lengths)
+        lys = self._length_weighted_average(table["aa_K"].values[mask], lengths)
         if arg + lys > 0:
             protein_statistics["proportion_R_RK"] = float(arg / (arg + lys))
 
         # amino acid k-mer frequencies
-        for variable, values in sorted(values_dict.items()):
+        for variable in sorted(table.columns):
             if variable.startswith("aa_"):
-                protein_statistics[variable] = self._length_weighted_average(values, values_dict["length"])
+                protein_statistics[variable] = self._length_weighted_average(table[variable].values[mask], lengths)
 
         return protein_statistics
 
     def _length_weighted_average(self, values, lengths):
-        return float(np.sum([length * val for length, val in zip(lengths, values)]) / np.sum(lengths))
+        return float(np.sum(np.asarray(lengths, dtype=np.float64) * values) / np.sum(lengths))
 
     def assign_localization(self):
         """Localizes proteins to inside/outside/within the cell membrane.
@@ -157,28 +202,26 @@ class Genome:
         hydrophobicity of GRAVY > 0 and must have a signal peptide. Other proteins
         are intracellular soluble proteins.
 
+        The localization is also stored as a categorical `localization` column
+        of `protein_table`.
+
         Returns:
             localization: dictionary of protein key with values either
                 'membrane', 'extra_soluble', or 'intra_soluble'
         """
 
         if self._protein_localization is None:
-            mean_hydrophobicity = np.mean(
-                [v["gravy"] for k, v in self.protein_data().items() if v["gravy"] is not None]
+            table = self.protein_table()
+            hydrophobicity = table["gravy"].values
+            mean_hydrophobicity = np.mean(hydrophobicity)
+            is_membrane = (hydrophobicity - mean_hydrophobicity) >= DIFF_HYDROPHOBICITY_MEMBRANE
+            localization = np.where(
+                is_membrane,
+                "membrane",
+                np.where(table["is_exported"].values, "extra_soluble", "intra_soluble"),
             )
-
-            self._protein_localization = {}
-            for protein in self.protein_data().keys():
-                hydrophobicity = self.protein_data()[protein]["gravy"]
-                if (hydrophobicity - mean_hydrophobicity) >= DIFF_HYDROPHOBICITY_MEMBRANE:
-                    self._protein_localization[protein] = "membrane"
-                else:
-                    # Get localization
-                    is_exported = self.protein_data()[protein]["is_exported"]
-                    if is_exported is True:
-                        self._protein_localization[protein] = "extra_soluble"
-                    else:
-                        self._protein_localization[protein] = "intra_soluble"
+            table["localization"] = pd.Categorical(localization, categories=LOCALIZATIONS)
+            self._protein_localization = dict(zip(table.index, localization.tolist()))
 
         return self._protein_localization
 
@@ -187,22 +230,16 @@ class Genome:
         content, currently only k-mer counts
         """
         genome_statistics = {}
-        if self.fna_filepath.endswith(".gz"):
-            fh = io.TextIOWrapper(io.BufferedReader(gzip.open(self.fna_filepath, "r")))
-        else:
-            fh = open(self.fna_filepath, "r")
-        fh.seek(0)
-        genome = ""
-        for header, sequence in iterate_fasta(fh):
-            # sample random slice of string
+        # contigs are counted one at a time as if joined by "NN"
+        nucleotide_calc = StreamingDNA(separator="NN")
+        for header, codes in iterate_fasta_codes(self.fna_filepath, NUCLEOTIDE_CODES):
+            # sample random slice of contig
             if self.subsample < 1.0:
-                len_sample = int(self.subsample * len(sequence))
-                left_index = np.random.randint(0, len(sequence) - len_sample, size=1)[0]
-                sequence = sequence[left_index : (len_sample + left_index)]
+                len_sample = int(self.subsample * len(codes))
+                left_index = np.random.randint(0, len(codes) - len_sample, size=1)[0]
+                codes = codes[left_index : (len_sample + left_index)]
 
-            genome += "NN" + sequence
-        fh.close()
-        nucleotide_calc = DNA(genome)
+            nucleotide_calc.add_codes(codes)
         genome_statistics.update(nucleotide_calc.nucleotide_metrics())
         return genome_statistics
 
@@ -216,10 +253,11 @@ class Genome:
         self.genomic_statistics = {}
 
         logging.info("{}: Identifying protein localization".format(self.prefix))
-        localization = self.assign_localization()
-        extracellular_soluble = {protein for protein, locale in localization.items() if locale == "extra_soluble"}
-        intracellular_soluble = {protein for protein, locale in localization.items() if locale == "intra_soluble"}
-        membrane = {protein for protein, locale in localization.items() if locale == "membrane"}
+        self.assign_localization()
+        localization = self.protein_table()["localization"].values
+        extracellular_soluble = np.asarray(localization == "extra_soluble")
+        intracellular_soluble = np.asarray(localization == "intra_soluble")
+        membrane = np.asarray(localization == "membrane")
 
         logging.info("{}: Collecting genome statistics".format(self.prefix))
         self.genomic_statistics["all"] = self.compute_dna_statistics()
@@ -229,15 +267,15 @@ class Genome:
         self.genomic_statistics["all"]["protein_coding_density"] = (
             3 * self.genomic_statistics["all"]["total_protein_length"] / self.genomic_statistics["all"]["nt_length"]
         )
-        if extracellular_soluble:
+        if extracellular_soluble.any():
             self.genomic_statistics["extracellular_soluble"] = self.compute_protein_statistics(
                 subset_proteins=extracellular_soluble
             )
-        if intracellular_soluble:
+        if intracellular_soluble.any():
             self.genomic_statistics["intracellular_soluble"] = self.compute_protein_statistics(
                 subset_proteins=intracellular_soluble
             )
-        if membrane:
+        if membrane.any():
             self.genomic_statistics["membrane"] = self.compute_protein_statistics(subset_proteins=membrane)
 
         self.genomic_statistics["diff_extra_intra"] = {}
@@ -6,10 +6,14 @@ tertiary structure, for example the proportion of residues that are
 acidic.
 """
 
-from typing import Dict
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
 
 import numpy as np
-from Bio.SeqUtils.IsoelectricPoint import IsoelectricPoint
 
 from ..helpers import count_kmers
 from .signal_peptide import SignalPeptideHMM
@@ -143,6 +147,103 @@ DIFF_HYDROPHOBICITY_MEMBRANE = 0.5
 
 THERMOSTABLE_RESIDUES = {"I", "V", "Y", "W", "R", "E", "L"}
 
+# Vectorized lookups: every sequence is mapped once to uint8 codes indexing AMINO_ACIDS,
+# with NON_STANDARD_CODE for any other byte. Scales become weight vectors in the same order.
+AMINO_ACIDS = sorted(STANDARD_AMINO_ACIDS)
+NON_STANDARD_CODE = len(AMINO_ACIDS)
+AA_CODES = np.full(256, NON_STANDARD_CODE, dtype=np.uint8)
+AA_CODES[np.frombuffer("".join(AMINO_ACIDS).encode("ascii"), dtype=np.uint8)] = np.arange(len(AMINO_ACIDS))
+
+
+def scale_to_weights(scale: Dict[str, float]) -> np.ndarray:
+    """Converts a per-residue scale to a weight vector ordered by AMINO_ACIDS"""
+    return np.array([scale[aa] for aa in AMINO_ACIDS], dtype=float)
+
+
+HYDROPHOBICITY_WEIGHTS = scale_to_weights(HYDROPHOBICITY)
+WEIGHTED_ZC_WEIGHTS = scale_to_weights(WEIGHTED_ZC)
+CARBON_NUMBER_WEIGHTS = scale_to_weights(CARBON_NUMBER)
+NH2O_QEC_WEIGHTS = scale_to_weights(NH2O_QEC)
+THERMOSTABLE_WEIGHTS = scale_to_weights({aa: float(aa in THERMOSTABLE_RESIDUES) for aa in AMINO_ACIDS})
+
+
+def encode_protein_sequence(protein_sequence: str) -> np.ndarray:
+    """Maps a sequence to uint8 codes indexing AMINO_ACIDS (NON_STANDARD_CODE otherwise)"""
+    return AA_CODES[np.frombuffer(protein_sequence.encode("ascii", errors="ignore"), dtype=np.uint8)]
+
+
+def count_amino_acids(codes: np.ndarray) -> np.ndarray:
+    """Returns counts of each standard amino acid, ordered by AMINO_ACIDS"""
+    return np.bincount(codes, minlength=NON_STANDARD_CODE + 1)[:NON_STANDARD_CODE]
+
+
+# Bjellqvist et al. (1993, 1994) pK values, as used by Bio.SeqUtils.IsoelectricPoint
+POSITIVE_PKS = {"K": 10.0, "R": 12.0, "H": 5.98}
+NEGATIVE_PKS = {"D": 4.05, "E": 4.45, "C": 9.0, "Y": 10.0}
+PK_NTERMINUS = 7.5
+PK_CTERMINUS = 3.55
+PK_NTERMINAL_RESIDUE = {"A": 7.59, "M": 7.0, "S": 6.93, "P": 8.36, "T": 6.82, "V": 7.44, "E": 7.7}
+PK_CTERMINAL_RESIDUE = {"D": 4.55, "E": 4.75}
+NTERMINUS_PKS = np.array([PK_NTERMINAL_RESIDUE.get(aa, PK_NTERMINUS) for aa in AMINO_ACIDS])
+CTERMINUS_PKS = np.array([PK_CTERMINAL_RESIDUE.get(aa, PK_CTERMINUS) for aa in AMINO_ACIDS])
+# Bisection stops once the bracketing interval is this narrow
+PI_INTERVAL_TOLERANCE = 0.0001
+
+
+def charge_at_ph(
+    compositions: np.ndarray, nterminus_pks: np.ndarray, cterminus_pks: np.ndarray, ph: np.ndarray
+) -> np.ndarray:
+    """Net charge of each protein at a pH (Henderson-Hasselbalch).
+
+    Args:
+        compositions: (n_proteins, 20) amino acid counts ordered by AMINO_ACIDS
+        nterminus_pks: pK of each protein's N-terminus
+        cterminus_pks: pK of each protein's C-terminus
+        ph: pH for each protein
+    """
+    positive_charge = 1.0 / (10 ** (ph - nterminus_pks) + 1.0)
+    for aa, pk in POSITIVE_PKS.items():
+        positive_charge = positive_charge + compositions[:, AMINO_ACIDS.index(aa)] * (1.0 / (10 ** (ph - pk) + 1.0))
+    negative_charge = 1.0 / (10 ** (cterminus_pks - ph) + 1.0)
+    for aa, pk in NEGATIVE_PKS.items():
+        negative_charge = negative_charge + compositions[:, AMINO_ACIDS.index(aa)] * (1.0 / (10 ** (pk - ph) + 1.0))
+    return positive_charge - negative_charge
+
+
+def isoelectric_points(
+    compositions: np.ndarray, nterminus_codes: np.ndarray, cterminus_codes: np.ndarray
+) -> np.ndarray:
+    """Computes the isoelectric point of many proteins at once.
+
+    Runs the bisection of Bio.SeqUtils.IsoelectricPoint (start at pH 7.775 within
+    4.05-12, stop when the interval is narrower than PI_INTERVAL_TOLERANCE) over an
+    array of proteins. Each protein takes the same steps as in Biopython, so values
+    agree with Biopython to floating-point precision, and with the exact root of the
+    charge curve to within PI_INTERVAL_TOLERANCE.
+
+    Args:
+        compositions: (n_proteins, 20) amino acid counts ordered by AMINO_ACIDS
+        nterminus_codes: code of the first residue of each protein
+        cterminus_codes: code of the last residue of each protein
+    Returns:
+        pis: isoelectric point of each protein
+    """
+    compositions = np.asarray(compositions, dtype=float)
+    nterminus_pks = NTERMINUS_PKS[nterminus_codes]
+    cterminus_pks = CTERMINUS_PKS[cterminus_codes]
+    n_proteins = compositions.shape[0]
+    ph = np.full(n_proteins, 7.775)
+    min_ph = np.full(n_proteins, 4.05)
+    max_ph = np.full(n_proteins, 12.0)
+    active = (max_ph - min_ph) > PI_INTERVAL_TOLERANCE
+    while active.any():
+        is_positive = charge_at_ph(compositions, nterminus_pks, cterminus_pks, ph) > 0.0
+        min_ph = np.where(active & is_positive, ph, min_ph)
+        max_ph = np.where(active & ~is_positive, ph, max_ph)
+        ph = np.where(active, (min_ph + max_ph) / 2, ph)
+        active = (max_ph - min_ph) > PI_INTERVAL_TOLERANCE
+    return ph
+
 
 class Protein:
     """Calculations on a protein sequence.
@@ -165,30 +266,48 @@ class Protein:
         self,
         protein_sequence: str,
         remove_signal_peptide: bool = True,
+        signal_peptide_model: Optional[SignalPeptideHMM] = None,
     ):
         """
         Args:
             protein_sequence: Amino acid sequence of one protein
+            remove_signal_peptide: Exclude the predicted signal peptide from metrics
+            signal_peptide_model: Optional SignalPeptideHMM to reuse across proteins
         """
-        self.sequence = self._format_protein_sequence(protein_sequence)
+        self.sequence, self._codes = self._format_protein_sequence(protein_sequence)
         self.length = len(self.sequence)
         self.start_pos = 1  # remove n-terminal Met
+        self._composition = None
+        self._composition_start_pos = None
         self._aa_1mer_frequencies = None
         self._aa_2mer_frequencies = None
-        self.signal_peptide_model = SignalPeptideHMM()
+        if signal_peptide_model is None:
+            signal_peptide_model = SignalPeptideHMM()
+        self.signal_peptide_model = signal_peptide_model
         self.remove_signal_peptide = remove_signal_peptide
 
-    def _format_protein_sequence(self, protein_sequence: str) -> str:
-        """Returns a formatted amino acid sequence"""
-        return "".join([aa for aa in protein_sequence.strip().upper() if aa in STANDARD_AMINO_ACIDS])
+    def _format_protein_sequence(self, protein_sequence: str) -> Tuple[str, np.ndarray]:
+        """Returns a formatted amino acid sequence and its codes"""
+        raw_bytes = np.frombuffer(protein_sequence.strip().upper().encode("ascii", errors="ignore"), dtype=np.uint8)
+        codes = AA_CODES[raw_bytes]
+        is_standard = codes != NON_STANDARD_CODE
+        return raw_bytes[is_standard].tobytes().decode("ascii"), codes[is_standard]
+
+    def composition(self) -> np.ndarray:
+        """Returns counts of each amino acid (ordered by AMINO_ACIDS) from `start_pos` on"""
+        if self._composition is None or self._composition_start_pos != self.start_pos:
+            self._composition = count_amino_acids(self._codes[self.start_pos :])
+            self._composition_start_pos = self.start_pos
+        return self._composition
 
     def aa_1mer_frequencies(self) -> Dict[str, float]:
         """Returns count of every amino acid ignoring start methionine"""
         if self._aa_1mer_frequencies is None:
-            trimmed_sequence = self.sequence[self.start_pos :]
-            if len(trimmed_sequence) >= 1:
+            composition = self.composition()
+            n_residues = composition.sum()
+            if n_residues >= 1:
                 self._aa_1mer_frequencies = {
-                    k: float(v / len(trimmed_sequence)) for k, v in count_kmers(trimmed_sequence, k=1).items()
+                    aa: float(count / n_residues) for aa, count in zip(AMINO_ACIDS, composition) if count > 0
                 }
             else:
                 self._aa_1mer_frequencies = {}
@@ -209,8 +328,8 @@ class Protein:
     def pi(self) -> float:
         """Compute the isoelectric point (pI) of the protein"""
         if self.length > 0:
-            # to-do: remove unnecessary Biopython dependency
-            return IsoelectricPoint(self.sequence[self.start_pos :]).pi()
+            codes = self._codes[self.start_pos :]
+            return float(isoelectric_points(self.composition()[np.newaxis, :], codes[:1], codes[-1:])[0])
         else:
             return np.nan
 
@@ -219,7 +338,8 @@ class Protein:
         Grand Average of Hydropathy (GRAVY)
         """
         if self.length > 0:
-            return np.mean([HYDROPHOBICITY[aa] for aa in self.sequence[self.start_pos :]])
+            composition = self.composition()
+            return float(composition @ HYDROPHOBICITY_WEIGHTS / composition.sum())
         else:
             return np.nan
 
@@ -228,8 +348,8 @@ class Protein:
         protein based on a dictionary of amino acids.
         """
         if self.length > 0:
-            seq = self.sequence[self.start_pos :]
-            return sum([WEIGHTED_ZC[s] for s in seq]) / sum([CARBON_NUMBER[s] for s in seq])
+            composition = self.composition()
+            return float((composition @ WEIGHTED_ZC_WEIGHTS) / (composition @ CARBON_NUMBER_WEIGHTS))
         else:
             return np.nan
 
@@ -238,7 +358,7 @@ class Protein:
         protein based on a dictionary of amino acids.
         """
         if self.length > 0:
-            return sum([NH2O_QEC[s] for s in self.sequence[self.start_pos :]]) / self.length
+            return float(self.composition() @ NH2O_QEC_WEIGHTS / self.length)
         else:
             return np.nan
 
@@ -247,17 +367,23 @@ class Protein:
         https://journals.plos.org/ploscompbiol/article?id=10.1371/journal.pcbi.0030005
         """
         if self.length > 0:
-            return sum([v for k, v in self.aa_1mer_frequencies().items() if k in THERMOSTABLE_RESIDUES])
+            composition = self.composition()
+            return float(composition @ THERMOSTABLE_WEIGHTS / composition.sum())
         else:
             return np.nan
 
-    def protein_metrics(self) -> dict:
-        """Computes a dictionary with all metrics for a protein"""
+    def protein_metrics(self, signal_peptide: Optional[Tuple[bool, int]] = None, compute_pi: bool = True) -> dict:
+        """Computes a dictionary with all metrics for a protein
 
-        (
-            is_exported,
-            signal_end_index,
-        ) = self.signal_peptide_model.predict_signal_peptide(self.sequence)
+        Args:
+            signal_peptide: Optional precomputed (is_exported, signal_end_index) for
+                this protein, e.g. from `SignalPeptideHMM.predict_signal_peptides_batch`
+            compute_pi: If False, "pi" is left as NaN so it can be filled for many
+                proteins at once with `proteome_isoelectric_points`
+        """
+        if signal_peptide is None:
+            signal_peptide = self.signal_peptide_model.predict_signal_peptide(self.sequence)
+        is_exported, signal_end_index = signal_peptide
         if self.remove_signal_peptide is True:
             self.start_pos = signal_end_index + 1
             # signal peptide should not be entire length
@@ -266,7 +392,7 @@ class Protein:
         self.length = len(self.sequence[self.start_pos :])
 
         sequence_metrics = {
-            "pi": self.pi(),
+            "pi": self.pi() if compute_pi is True else np.nan,
             "zc": self.zc(),
             "nh2o": self.nh2o(),
             "gravy": self.gravy(),
@@ -276,8 +402,26 @@ class Protein:
         }
 
         # Must prepend with "aa_" because code overlaps with nts
+        aa_1mer_frequencies = self.aa_1mer_frequencies()
         for aa in STANDARD_AMINO_ACIDS:
-            freq = self.aa_1mer_frequencies().get(aa, 0)
-            sequence_metrics["aa_{}".format(aa)] = freq
+            sequence_metrics["aa_{}".format(aa)] = aa_1mer_frequencies.get(aa, 0)
 
         return sequence_metrics
+
+
+def proteome_isoelectric_points(proteins: List[Protein]) -> np.ndarray:
+    """Computes the pI of every protein in one vectorized pass.
+
+    Uses each protein's current `start_pos`, so call after `protein_metrics`
+    when signal peptides are removed. Proteins without residues get NaN.
+    """
+    pis = np.full(len(proteins), np.nan)
+    indices = [i for i, protein in enumerate(proteins) if protein.length > 0]
+    if indices:
+        trimmed_codes = [proteins[i]._codes[proteins[i].start_pos :] for i in indices]
+        pis[indices] = isoelectric_points(
+            np.array([proteins[i].composition() for i in indices]),
+            np.array([codes[0] for codes in trimmed_codes]),
+            np.array([codes[-1] for codes in trimmed_codes]),
+        )
+    return pis
@@ -1,6 +1,13 @@
 """Class to perform prediction of signal peptide presence in proteins"""
 
 import os
+import threading
+from typing import (
+    Dict,
+    List,
+    Sequence,
+    Tuple,
+)
 
 import joblib
 import numpy as np
@@ -35,6 +42,51 @@ N_TERMINUS_LENGTH = 50
 SIGNAL_PEPTIDE_END_STATE = "C1"
 THRESHOLD_LOG_PROB = -134.0
 
+# Byte -> symbol index; weird codes map to 'neutral' glycine as in `_format_protein_sequence`
+SYMBOL_CODES = np.full(256, SYMBOLS.index("G"), dtype=np.uint8)
+SYMBOL_CODES[np.frombuffer("".join(SYMBOLS).encode("ascii"), dtype=np.uint8)] = np.arange(len(SYMBOLS))
+
+# Process-wide registry of deserialized HMMs keyed by absolute model path.
+# Models are only read after loading, so one copy is shared by every
+# SignalPeptideHMM in the process (and inherited copy-on-write by forked workers).
+_MODEL_REGISTRY: Dict[str, object] = {}
+_MODEL_REGISTRY_LOCK = threading.Lock()
+
+
+def _reset_registry_lock():
+    """A lock held by another thread at fork time would never be released in the child"""
+    global _MODEL_REGISTRY_LOCK  # pylint: disable=global-statement
+    _MODEL_REGISTRY_LOCK = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_registry_lock)
+
+
+def load_trained_model(model_file: str = TRAINED_MODEL):
+    """Returns the HMM stored in `model_file`, deserializing it at most once per process.
+
+    The returned model is shared and must be treated as read-only.
+
+    Args:
+        model_file: filename of pretrained HMM file, default: model provided in package
+    """
+    key = os.path.abspath(model_file)
+    model = _MODEL_REGISTRY.get(key)
+    if model is None:
+        with _MODEL_REGISTRY_LOCK:
+            model = _MODEL_REGISTRY.get(key)
+            if model is None:
+                model = joblib.load(key)
+                _MODEL_REGISTRY[key] = model
+    return model
+
+
+def clear_model_registry():
+    """Drops all cached models, e.g. after a model file is replaced on disk"""
+    with _MODEL_REGISTRY_LOCK:
+        _MODEL_REGISTRY.clear()
+
 
 class SignalPeptideHMM:
     """
@@ -51,12 +103,15 @@ class SignalPeptideHMM:
     - For comparing accuracy to SignalP versions: Almagro Armenteros et al.
       SignalP 5.0 improves signal peptide predictions using deep neural networks. Nat Biotechnol (2019)
 
+    The HMM is loaded through `load_trained_model`, so constructing many
+    instances does not deserialize the model file more than once.
+
     Args:
         model_file: filename of pretrained HMM file, default: model provided in package
     """
 
     def __init__(self, model_file: str = TRAINED_MODEL):
-        self.model = joblib.load(model_file)
+        self.model = load_trained_model(model_file)
         self.symbols = SYMBOLS
         self.states = STATES
         self.threshold_log_prob = THRESHOLD_LOG_PROB
@@ -65,6 +120,7 @@ class SignalPeptideHMM:
         self.symbol_to_idx = dict(zip(self.symbols, range(len(self.symbols))))
         self.state_to_index = dict(zip(self.states, range(len(self.states))))
         self.idx_to_state = dict(zip(range(len(self.states)), self.states))
+        self._log_params = None
 
     def _format_protein_sequence(self, protein_sequence) -> np.array:
         default_symbol = self.symbol_to_idx.get("G")  # hack: replace weird codes with 'neutral' glycine
@@ -78,6 +134,78 @@ class SignalPeptideHMM:
         pred_states = [self.idx_to_state[idx] for idx in pred_state_indices]
         return pred_states, log_prob
 
+    def _log_model_params(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Log start, transition and emission probabilities, as used by hmmlearn's Viterbi"""
+        if self._log_params is None:
+            with np.errstate(divide="ignore"):
+                self._log_params = (
+                    np.log(self.model.startprob_),
+                    np.log(self.model.transmat_),
+                    np.log(self.model.emissionprob_),
+                )
+        return self._log_params
+
+    def _encode_nterminii(self, protein_sequences: Sequence[str]) -> np.ndarray:
+        """Encodes N-termini of full-length sequences into a (n_sequences, nterminus_length) matrix"""
+        nterminii = "".join([sequence[0 : self.nterminus_length] for sequence in protein_sequences])
+        codes = np.frombuffer(nterminii.encode("ascii", errors="replace"), dtype=np.uint8)
+        return SYMBOL_CODES[codes].reshape(-1, self.nterminus_length)
+
+    def _viterbi_batch(self, encoded_sequences: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized Viterbi decoding of equal-length sequences.
+
+        Performs the same operations in the same order as `hmmlearn`'s Viterbi,
+        so log probabilities and paths (including tie-breaking) are identical
+        to calling `self.model.decode` on each sequence.
+
+        Returns:
+            log_probs: log probability of the best path for each sequence
+            state_indices: (n_sequences, length) array of decoded state indices
+        """
+        log_startprob, log_transmat, log_emissionprob = self._log_model_params()
+        n_sequences, length = encoded_sequences.shape
+        n_states = log_startprob.shape[0]
+        log_frameprob = log_emissionprob.T[encoded_sequences]  # (n_sequences, length, n_states)
+
+        lattice = np.empty((n_sequences, length, n_states))
+        lattice[:, 0] = log_startprob + log_frameprob[:, 0]
+        for t in range(1, length):
+            lattice[:, t] = (lattice[:, t - 1, :, np.newaxis] + log_transmat).max(axis=1) + log_frameprob[:, t]
+
+        rows = np.arange(n_sequences)
+        state_indices = np.empty((n_sequences, length), dtype=int)
+        state_indices[:, -1] = lattice[:, -1].argmax(axis=1)
+        log_probs = lattice[rows, -1, state_indices[:, -1]]
+        for t in range(length - 2, -1, -1):
+            state_indices[:, t] = (lattice[:, t] + log_transmat[:, state_indices[:, t + 1]].T).argmax(axis=1)
+        return log_probs, state_indices
+
+    def predict_signal_peptides_batch(self, protein_sequences: Sequence[str]) -> List[Tuple[bool, int]]:
+        """Predicts signal peptides for many proteins at once, e.g. a whole proteome.
+
+        Equivalent to calling `predict_signal_peptide` on each sequence, but the
+        N-termini are decoded together with a vectorized Viterbi.
+
+        Args:
+            protein_sequences: amino acid sequences
+        Returns:
+            List of (is_exported, signal_end_index) in the order of `protein_sequences`
+        """
+        predictions = [(False, -1)] * len(protein_sequences)
+        long_indices = [i for i, sequence in enumerate(protein_sequences) if len(sequence) >= self.nterminus_length]
+        if len(long_indices) == 0:
+            return predictions
+
+        encoded_sequences = self._encode_nterminii([protein_sequences[i] for i in long_indices])
+        log_probs, state_indices = self._viterbi_batch(encoded_sequences)
+        is_end_state = state_indices == self.state_to_index[self.signal_end_state]
+        has_cut_site = is_end_state.any(axis=1)
+        is_exported = (log_probs > self.threshold_log_prob) & has_cut_site
+        signal_end_indices = np.where(is_exported, is_end_state.argmax(axis=1), -1)
+        for i, exported, signal_end_index in zip(long_indices, is_exported.tolist(), signal_end_indices.tolist()):
+            predictions[i] = (exported, signal_end_index)
+        return predictions
+
     def predict_signal_peptide(self, protein_sequence) -> tuple:
         """Uses an HMM model to predict signal peptides in bacteria and archaea"""
         # Score sequence against model
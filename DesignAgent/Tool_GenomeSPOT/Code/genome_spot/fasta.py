@@ -0,0 +1,192 @@
+"""
+Fast FASTA reading shared by the GenomeSPOT tools.
+
+Files are read as bytes in large chunks (or memory-mapped when not
+compressed) and split into records at line starts with `>`, instead
+of grouping text lines one at a time as `helpers.iterate_fasta` does.
+Gzipped files can be decompressed on a background thread so that
+decompression overlaps with parsing.
+
+Records are available as bytes, as text (a drop-in for `iterate_fasta`)
+or as NumPy code arrays mapped through a 256-entry lookup table such as
+`dna.NUCLEOTIDE_CODES` or `protein.AA_CODES`.
+"""
+
+import gzip
+import mmap
+import queue
+import threading
+from pathlib import Path
+from typing import (
+    Iterator,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+
+
+CHUNK_SIZE = 1 << 22
+# Characters removed from sequence lines; headers are only stripped at the ends
+WHITESPACE = b" \t\r\n\x0b\x0c"
+# Decompressed chunks held in memory at once when decompressing on a thread
+MAX_QUEUED_CHUNKS = 4
+
+
+def _read_chunks(fh, chunk_size: int) -> Iterator[bytes]:
+    """Yields chunks of bytes from a binary file object"""
+    while True:
+        chunk = fh.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _read_chunks_threaded(fh, chunk_size: int) -> Iterator[bytes]:
+    """Yields chunks of bytes read (and decompressed) on a background thread.
+
+    zlib releases the GIL, so gzip decompression of the next chunks runs
+    while the caller parses the current one.
+    """
+    chunks = queue.Queue(maxsize=MAX_QUEUED_CHUNKS)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for chunk in _read_chunks(fh, chunk_size):
+                while not stop.is_set():
+                    try:
+                        chunks.put(chunk, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            chunks.put(None)
+        except BaseException as error:  # re-raised on the reading thread
+            chunks.put(error)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, BaseException):
+                raise chunk
+            yield chunk
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _parse_record(record: bytes) -> Tuple[bytes, bytes]:
+    """Splits a record (without the leading `>`) into header and sequence"""
+    header, _, sequence = record.partition(b"\n")
+    return header.strip(), sequence.translate(None, WHITESPACE)
+
+
+def _parse_block(block: bytes) -> Iterator[Tuple[bytes, bytes]]:
+    """Parses complete records from a block that starts at a record"""
+    start = block.find(b">")
+    if start == -1:
+        return
+    if start > 0 and block[start - 1 : start] != b"\n":
+        start = block.find(b"\n>", start)
+        if start == -1:
+            return
+        start += 1
+    for record in block[start + 1 :].split(b"\n>"):
+        yield _parse_record(record)
+
+
+def _iterate_chunked_records(chunks: Iterator[bytes]) -> Iterator[Tuple[bytes, bytes]]:
+    """Splits a stream of chunks into records, holding at most one record plus one chunk"""
+    pieces = []
+    for chunk in chunks:
+        # prefix the last byte seen so a "\n>" split across chunks is found
+        previous = pieces[-1][-1:] if pieces else b"\n"
+        boundary = (previous + chunk).rfind(b"\n>")
+        if boundary == -1:
+            pieces.append(chunk)
+            continue
+        pieces.append(chunk[:boundary])
+        yield from _parse_block(b"".join(pieces))
+        pieces = [chunk[boundary:]]
+    yield from _parse_block(b"".join(pieces))
+
+
+def _iterate_mapped_records(mapped: mmap.mmap) -> Iterator[Tuple[bytes, bytes]]:
+    """Yields records from a memory-mapped file, copying one record at a time"""
+    start = 0 if mapped[:1] == b">" else mapped.find(b"\n>")
+    if start > 0:
+        start += 1
+    while start != -1:
+        end = mapped.find(b"\n>", start)
+        if end == -1:
+            yield _parse_record(mapped[start + 1 :])
+            break
+        yield _parse_record(mapped[start + 1 : end])
+        start = end + 1
+
+
+def iterate_fasta_bytes(
+    fasta_path: Union[str, Path],
+    threads: int = 1,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[Tuple[bytes, bytes]]:
+    """Iterable yielding FASTA header and sequence as bytes
+
+    Args:
+        fasta_path: Path to a FASTA file, gzipped if it ends with `.gz`
+        threads: If above 1, gzipped files are decompressed on a background thread
+        chunk_size: Bytes read at a time from compressed files
+
+    Yields:
+        header: Header without `>`, stripped
+        sequence: Sequence with line breaks and whitespace removed
+    """
+    fasta_path = str(fasta_path)
+    if fasta_path.endswith(".gz"):
+        with gzip.open(fasta_path, "rb") as fh:
+            if threads > 1:
+                chunks = _read_chunks_threaded(fh, chunk_size)
+            else:
+                chunks = _read_chunks(fh, chunk_size)
+            yield from _iterate_chunked_records(chunks)
+    else:
+        with open(fasta_path, "rb") as fh:
+            if Path(fasta_path).stat().st_size == 0:
+                return
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield from _iterate_mapped_records(mapped)
+
+
+def iterate_fasta_records(fasta_path: Union[str, Path], threads: int = 1) -> Iterator[Tuple[str, str]]:
+    """Iterable yielding FASTA header and sequence as text, like `helpers.iterate_fasta`
+
+    Bytes are decoded as Latin-1 so that every byte maps to one character.
+    """
+    for header, sequence in iterate_fasta_bytes(fasta_path, threads=threads):
+        yield header.decode("latin-1"), sequence.decode("latin-1")
+
+
+def iterate_fasta_codes(
+    fasta_path: Union[str, Path],
+    code_table: np.ndarray,
+    threads: int = 1,
+) -> Iterator[Tuple[str, np.ndarray]]:
+    """Iterable yielding FASTA header and sequence encoded as a code array
+
+    Args:
+        fasta_path: Path to a FASTA file, gzipped if it ends with `.gz`
+        code_table: Array of 256 codes indexed by byte value, e.g. `dna.NUCLEOTIDE_CODES`
+        threads: If above 1, gzipped files are decompressed on a background thread
+
+    Yields:
+        header: Header without `>`
+        codes: Array of `code_table` values, one per residue
+    """
+    for header, sequence in iterate_fasta_bytes(fasta_path, threads=threads):
+        yield header.decode("latin-1"), code_table[np.frombuffer(sequence, dtype=np.uint8)]
@@ -0,0 +1,231 @@
+"""
+Content-addressed cache of genome features.
+
+Features measured from a genome are stored under a key that hashes the
+contents of its protein and contig files together with the package
+version, so re-running GenomeSPOT on the same files (under any name)
+reuses the features, while a new release measures them again.
+
+Entries are a compact binary encoding of the nested feature dict and live
+either in a directory (one file per genome) or in a single SQLite file,
+chosen by the location's suffix. When the cache grows beyond `max_size`
+bytes, the least recently used entries are evicted.
+
+Example usage:
+
+```python
+cache = FeatureCache(DEFAULT_CACHE_LOCATION)
+key = cache.key(faa_path, fna_path)
+genome_features = cache.get(key)
+if genome_features is None:
+    genome_features = measure_genome_features(faa_path, fna_path)
+    cache.put(key, genome_features)
+```
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import struct
+import tempfile
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import (
+    Dict,
+    Iterator,
+    Optional,
+)
+
+import numpy as np
+
+from ._version import __version__
+
+
+DEFAULT_CACHE_LOCATION = os.environ.get(
+    "GENOME_SPOT_FEATURE_CACHE", str(Path.home() / ".cache" / "genome_spot" / "features")
+)
+DEFAULT_MAX_SIZE = 1 << 30
+SQLITE_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+HASH_CHUNK_SIZE = 1 << 20
+# Format marker and version of the binary encoding
+MAGIC = b"GSF1"
+
+
+def encode_genome_features(genome_features: Dict[str, dict]) -> bytes:
+    """Encodes nested genome features as compressed names, float64 values and int flags
+
+    Raises:
+        TypeError: If a feature value is not a number
+    """
+    names = []
+    values = []
+    is_int = []
+    for localization, feat_dict in genome_features.items():
+        for feat, value in feat_dict.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float, np.integer, np.floating)):
+                raise TypeError(f"Feature {localization} {feat} is not a number: {value!r}")
+            names.append(f"{localization}\t{feat}")
+            values.append(float(value))
+            is_int.append(isinstance(value, (int, np.integer)))
+    names_bytes = "\n".join(names).encode("utf-8")
+    payload = (
+        struct.pack("<II", len(values), len(names_bytes))
+        + names_bytes
+        + np.asarray(values, dtype="<f8").tobytes()
+        + np.packbits(np.asarray(is_int, dtype=bool)).tobytes()
+    )
+    return MAGIC + zlib.compress(payload)
+
+
+def decode_genome_features(data: bytes) -> Dict[str, dict]:
+    """Decodes bytes written by `encode_genome_features`"""
+    if data[: len(MAGIC)] != MAGIC:
+        raise ValueError("Not an encoded genome features entry")
+    payload = zlib.decompress(data[len(MAGIC) :])
+    n_values, n_name_bytes = struct.unpack_from("<II", payload)
+    offset = struct.calcsize("<II")
+    names = payload[offset : offset + n_name_bytes].decode("utf-8").split("\n") if n_values else []
+    offset += n_name_bytes
+    values = np.frombuffer(payload, dtype="<f8", count=n_values, offset=offset)
+    offset += 8 * n_values
+    is_int = np.unpackbits(np.frombuffer(payload, dtype=np.uint8, offset=offset))[:n_values].astype(bool)
+
+    genome_features = {}
+    for name, value, value_is_int in zip(names, values.tolist(), is_int.tolist()):
+        localization, feat = name.split("\t")
+        genome_features.setdefault(localization, {})[feat] = int(value) if value_is_int else value
+    return genome_features
+
+
+class FeatureCache:
+    """Content-addressed, size-bounded LRU cache of genome features
+
+    Args:
+        location: Directory for one file per entry, or a path ending in .sqlite/.db
+            for a single SQLite file
+        max_size: Bytes of entries to keep before evicting the least recently used
+    """
+
+    def __init__(self, location: str = DEFAULT_CACHE_LOCATION, max_size: int = DEFAULT_MAX_SIZE):
+        self.location = str(location)
+        self.max_size = max_size
+        self.use_sqlite = self.location.endswith(SQLITE_SUFFIXES)
+        if self.use_sqlite:
+            Path(self.location).parent.mkdir(parents=True, exist_ok=True)
+            with self._connect() as connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS features "
+                    "(key TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+                )
+                connection.execute("CREATE INDEX IF NOT EXISTS features_last_used ON features (last_used)")
+        else:
+            Path(self.location).mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(faa_path: str, fna_path: str) -> str:
+        """Returns a hash of both files' contents and the package version"""
+        digest = hashlib.sha256(f"genome_spot {__version__}\n".encode("utf-8"))
+        for path in [faa_path, fna_path]:
+            file_digest = hashlib.sha256()
+            with open(path, "rb") as fh:
+                for chunk in iter(lambda: fh.read(HASH_CHUNK_SIZE), b""):
+                    file_digest.update(chunk)
+            digest.update(file_digest.digest())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, dict]]:
+        """Returns cached genome features, or None if not cached"""
+        if self.use_sqlite:
+            with self._connect() as connection:
+                row = connection.execute("SELECT data FROM features WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                connection.execute("UPDATE features SET last_used = ? WHERE key = ?", (time.time(), key))
+            data = row[0]
+        else:
+            path = self._entry_path(key)
+            try:
+                data = path.read_bytes()
+                os.utime(path)
+            except FileNotFoundError:
+                return None
+        try:
+            return decode_genome_features(data)
+        except (ValueError, zlib.error, struct.error):
+            logging.warning("Ignoring unreadable feature cache entry %s", key)
+            return None
+
+    def put(self, key: str, genome_features: Dict[str, dict]):
+        """Stores genome features and evicts old entries if the cache is full"""
+        try:
+            data = encode_genome_features(genome_features)
+        except TypeError as error:
+            logging.warning("Not caching genome features: %s", error)
+            return
+        if self.use_sqlite:
+            with self._connect() as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO features (key, data, size, last_used) VALUES (?, ?, ?, ?)",
+                    (key, data, len(data), time.time()),
+                )
+        else:
+            # write then rename so concurrent readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.location, suffix=".tmp")
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(data)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self._entry_path(key))
+        self.evict()
+
+    def size(self) -> int:
+        """Returns the total bytes of cached entries"""
+        if self.use_sqlite:
+            with self._connect() as connection:
+                return connection.execute("SELECT COALESCE(SUM(size), 0) FROM features").fetchone()[0]
+        return sum(path.stat().st_size for path in Path(self.location).glob("*.features.bin"))
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in `max_size`"""
+        if self.use_sqlite:
+            with self._connect() as connection:
+                total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM features").fetchone()[0]
+                if total_size <= self.max_size:
+                    return
+                evicted = []
+                for key, size in connection.execute("SELECT key, size FROM features ORDER BY last_used"):
+                    if total_size <= self.max_size:
+                        break
+                    evicted.append((key,))
+                    total_size -= size
+                connection.executemany("DELETE FROM features WHERE key = ?", evicted)
+        else:
+            entries = []
+            for path in Path(self.location).glob("*.features.bin"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+                path.unlink(missing_ok=True)
+                total_size -= size
+
+    def _entry_path(self, key: str) -> Path:
+        return Path(self.location) / f"{key}.features.bin"
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Yields a connection that commits on success and is always closed"""
+        connection = sqlite3.connect(self.location, timeout=60)
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            with connection:
+                yield connection
+        finally:
+            connection.close()
@@ -2,13 +2,16 @@
 
 import json
 import logging
+import os
 from argparse import (
     ArgumentParser,
     Namespace,
 )
 from collections import defaultdict
+from pathlib import Path
 from typing import (
     Dict,
+    List,
     Optional,
     Tuple,
     Union,
@@ -22,10 +25,174 @@ from .bioinformatics.genome import (
     load_genome_features,
     measure_genome_features,
 )
+from .feature_cache import (
+    DEFAULT_CACHE_LOCATION,
+    FeatureCache,
+)
+from .prediction_store import PredictionStoreWriter
 
 
 logging.basicConfig(level=logging.INFO, datefmt="%Y-%m-%d %H:%M:%S", format="%(asctime)s %(levelname)s %(message)s")
 
+# Model bundles keyed by absolute path to the models directory
+_MODEL_BUNDLES = {}
+
+
+class ErrorModel:
+    """Error model sorted by predicted value for lookups with `np.searchsorted`
+
+    Error models are arrays where col 1 is a predicted value and col 2 is the
+    RMSE of values predicted to be y +/- interval. Looking up the row closest
+    to each of n predictions is O(log m) per query instead of a scan of all
+    m rows. Ties resolve as in `np.argmin` on the unsorted array: to the row
+    that comes first.
+
+    Args:
+        error_arr: Error model array with predicted values and RMSE as columns
+    """
+
+    def __init__(self, error_arr: np.ndarray):
+        error_arr = np.asarray(error_arr)
+        order = np.argsort(error_arr[:, 0], kind="stable")
+        sorted_values = error_arr[order, 0]
+        # keep the first row of repeated predicted values
+        is_first = np.ones(len(sorted_values), dtype=bool)
+        is_first[1:] = sorted_values[1:] != sorted_values[:-1]
+        self.values = sorted_values[is_first]
+        self.errors = error_arr[order[is_first], 1]
+        self.rows = order[is_first]
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def lookup(self, y: np.ndarray) -> np.ndarray:
+        """Returns the error of the reference value closest to each value of y"""
+        y = np.asarray(y, dtype=float)
+        right = np.clip(np.searchsorted(self.values, y), 1, len(self.values) - 1)
+        left = right - 1
+        if len(self.values) == 1:
+            right = left = np.zeros_like(right)
+        distance_left = np.abs(self.values[left] - y)
+        distance_right = np.abs(self.values[right] - y)
+        use_right = (distance_right < distance_left) | (
+            (distance_right == distance_left) & (self.rows[right] < self.rows[left])
+        )
+        return self.errors[np.where(use_right, right, left)]
+
+
+class GenomeSPOTModelBundle:
+    """Instructions and every model from a models directory, loaded once and reused
+
+    Loading validates that each condition in `instructions.json` has all of its
+    model files. A consolidated bundle can be written with `save_bundle` to
+    `<models>/genome_spot_models.joblib`; when present and newer than the
+    individual files it is loaded instead, with arrays memory-mapped, which
+    is faster on a cold start than ~20 separate `joblib.load` calls.
+
+    Example usage:
+
+    ```python
+    bundle = GenomeSPOTModelBundle.from_directory(path_to_models)
+    bundle.save_bundle()  # optional, once per models directory
+    predictions = GenomeSPOT().predict_from_genome(genome_features, bundle)
+    ```
+
+    Error model arrays are wrapped in `ErrorModel`, sorted once at load.
+
+    Args:
+        instructions: Instructions with the features of each condition
+        models: Models keyed by file stem, e.g. "novelty_ph" or "error_ph_optimum"
+        path_to_models: Directory the models were loaded from
+    """
+
+    BUNDLE_FILENAME = "genome_spot_models.joblib"
+
+    def __init__(self, instructions: dict, models: dict, path_to_models: Optional[str] = None):
+        self.instructions = instructions
+        self.models = {
+            model_name: ErrorModel(model) if isinstance(model, np.ndarray) else model
+            for model_name, model in models.items()
+        }
+        self.path_to_models = path_to_models
+
+    def __getitem__(self, model_name: str):
+        return self.models[model_name]
+
+    @staticmethod
+    def model_names(condition: str) -> List[str]:
+        """Names (file stems) of the models needed to predict a condition"""
+        model_names = [f"novelty_{condition}"]
+        if condition in ["ph", "temperature", "salinity"]:
+            for attribute in ["optimum", "max", "min"]:
+                model_names += [f"{condition}_{attribute}", f"error_{condition}_{attribute}"]
+        elif condition == "oxygen":
+            model_names.append(condition)
+        return model_names
+
+    @classmethod
+    def validate(cls, path_to_models: str) -> dict:
+        """Returns the instructions if every condition has its features and model files
+
+        Raises:
+            FileNotFoundError: If instructions.json or any model file is missing
+            ValueError: If a condition in instructions.json lacks features
+        """
+        instructions_filename = f"{path_to_models}/instructions.json"
+        if not os.path.exists(instructions_filename):
+            raise FileNotFoundError(f"Instructions file {instructions_filename} does not exist")
+        with open(instructions_filename, "r") as fh:
+            instructions = json.loads(fh.read())
+        missing_files = []
+        for condition in instructions.keys():
+            if "features" not in instructions[condition]:
+                raise ValueError(f"Condition {condition} in {instructions_filename} has no features")
+            for model_name in cls.model_names(condition):
+                if not os.path.exists(f"{path_to_models}/{model_name}.joblib"):
+                    missing_files.append(f"{model_name}.joblib")
+        if missing_files:
+            raise FileNotFoundError(f"Models missing from {path_to_models}: {', '.join(missing_files)}")
+        return instructions
+
+    @classmethod
+    def from_directory(cls, path_to_models: str, use_bundle: bool = True) -> "GenomeSPOTModelBundle":
+        """Loads models from a directory, from its consolidated bundle if up to date"""
+        instructions = cls.validate(path_to_models)
+        bundle_filename = f"{path_to_models}/{cls.BUNDLE_FILENAME}"
+        if use_bundle is True and os.path.exists(bundle_filename):
+            source_files = [f"{path_to_models}/instructions.json"] + [
+                f"{path_to_models}/{model_name}.joblib"
+                for condition in instructions.keys()
+                for model_name in cls.model_names(condition)
+            ]
+            if os.path.getmtime(bundle_filename) >= max(os.path.getmtime(filename) for filename in source_files):
+                logging.info("Loading model bundle %s", bundle_filename)
+                contents = joblib.load(bundle_filename, mmap_mode="r")
+                return cls(contents["instructions"], contents["models"], path_to_models)
+            logging.warning("Ignoring model bundle %s, which is older than the models", bundle_filename)
+
+        logging.info("Loading models from %s", path_to_models)
+        models = {}
+        for condition in instructions.keys():
+            for model_name in cls.model_names(condition):
+                models[model_name] = joblib.load(f"{path_to_models}/{model_name}.joblib")
+        return cls(instructions, models, path_to_models)
+
+    def save_bundle(self, bundle_filename: Optional[str] = None) -> str:
+        """Writes instructions and models to one uncompressed (memory-mappable) joblib file"""
+        if bundle_filename is None:
+            bundle_filename = f"{self.path_to_models}/{self.BUNDLE_FILENAME}"
+        logging.info("Saving model bundle to %s", bundle_filename)
+        joblib.dump({"instructions": self.instructions, "models": self.models}, bundle_filename)
+        return bundle_filename
+
+
+def load_model_bundle(path_to_models: str) -> GenomeSPOTModelBundle:
+    """Returns the model bundle for a models directory, loading it once per process"""
+    key = os.path.abspath(path_to_models)
+    if key not in _MODEL_BUNDLES:
+        _MODEL_BUNDLES[key] = GenomeSPOTModelBundle.from_directory(path_to_models)
+    return _MODEL_BUNDLES[key]
+
 
 class GenomeSPOT:
     """Main class for predicting growth conditions from genome features
@@ -72,7 +239,7 @@ class GenomeSPOT:
     def predict_from_genome(
         self,
         genome_features: Dict[str, dict],
-        path_to_models: str,
+        path_to_models: Union[str, GenomeSPOTModelBundle],
     ) -> Dict[str, dict]:
         """
         Predicts growth conditions from genome features for all models specified
@@ -80,43 +247,94 @@ class GenomeSPOT:
         and optimum are computed. For classification of oxygen, a genome is classified
         as a tolerant (aerobe or facultative anaerobe) or intolerant (obligate anaerobe).
 
+        Models are loaded on first use and reused for later genomes (see `load_model_bundle`).
+
         Args:
             genome_features: nested dict of all genome features computed by Genome
-            path_to_models: path to directory with models
+            path_to_models: path to directory with models, or a loaded GenomeSPOTModelBundle
         Returns:
             predictions: nested dict of each target's predicted value, error, novelty, warning, and units
         """
-        predictions = defaultdict(dict)
-        instructions = self.load_instructions(f"{path_to_models}/instructions.json")
+        return self.predict_from_genomes([genome_features], path_to_models)[0]
+
+    def predict_from_genomes(
+        self,
+        genome_features_list: List[Dict[str, dict]],
+        path_to_models: Union[str, GenomeSPOTModelBundle],
+        genome_ids: Optional[List[str]] = None,
+        as_dataframe: bool = False,
+    ) -> Union[List[Dict[str, dict]], pd.DataFrame]:
+        """
+        Predicts growth conditions for many genomes at once. One feature matrix
+        is built per condition and each model is applied once to all genomes,
+        which avoids the per-call overhead of scikit-learn for large batches.
+
+        Args:
+            genome_features_list: nested dicts of genome features, one per genome
+            path_to_models: path to directory with models, or a loaded GenomeSPOTModelBundle
+            genome_ids: Optional names of genomes, used as the `genome` column of the table
+            as_dataframe: If True, returns a tidy table instead of a list of dicts
+        Returns:
+            predictions: for each genome, the nested dict returned by `predict_from_genome`,
+                or a table with columns genome, target, value, error, units, is_novel, warning
+        """
+        if isinstance(path_to_models, GenomeSPOTModelBundle):
+            models = path_to_models
+        else:
+            models = load_model_bundle(path_to_models)
+        instructions = models.instructions
+        flat_genome_features_list = [self.flatten_genome_features(features) for features in genome_features_list]
+
+        predictions = [defaultdict(dict) for _ in genome_features_list]
         for condition in instructions.keys():
-            novelty_model = joblib.load(f"{path_to_models}/novelty_{condition}.joblib")
-            if condition in ["ph", "temperature", "salinity"]:
-                features = instructions[condition]["features"]
-                for attribute in [
-                    "optimum",
-                    "max",
-                    "min",
-                ]:
-                    X = self.genome_features_to_input_arr(features, genome_features)
-                    target = f"{condition}_{attribute}"
-                    model = joblib.load(f"{path_to_models}/{target}.joblib")
-                    error_model = joblib.load(f"{path_to_models}/error_{target}.joblib")
-                    predictions[target] = self.predict_target_value(
-                        target=target, X=X, model=model, error_model=error_model, novelty_model=novelty_model
-                    )
-            elif condition == "oxygen":
-                target = condition
-                features = instructions[condition]["features"]
-                model = joblib.load(f"{path_to_models}/{target}.joblib")
-                X = self.genome_features_to_input_arr(features, genome_features)
-                predictions[target] = self.predict_target_value(
+            if condition not in ["ph", "temperature", "salinity", "oxygen"]:
+                continue
+            features = instructions[condition]["features"]
+            X = np.array(
+                [[flat_features.get(x, np.nan) for x in features] for flat_features in flat_genome_features_list],
+                dtype=float,
+            ).reshape(len(flat_genome_features_list), len(features))
+            is_complete = ~np.isnan(X).any(axis=1)
+            X_complete = X[is_complete]
+            novelties = self.predict_novelties(X_complete, models[f"novelty_{condition}"])
+
+            if condition == "oxygen":
+                targets = [condition]
+            else:
+                targets = [f"{condition}_{attribute}" for attribute in ["optimum", "max", "min"]]
+            for target in targets:
+                target_predictions = self.predict_target_values(
+                    X=X_complete,
+                    model=models[target],
                     target=target,
-                    X=X,
-                    model=model,
-                    method="predict_proba",
-                    error_model=None,
-                    novelty_model=novelty_model,
+                    method="predict_proba" if condition == "oxygen" else "predict",
+                    error_model=models.models.get(f"error_{target}"),
+                    novelties=novelties,
                 )
+                complete_predictions = iter(target_predictions)
+                for genome_predictions, complete in zip(predictions, is_complete):
+                    if complete:
+                        genome_predictions[target] = next(complete_predictions)
+                    else:
+                        # cannot predict
+                        genome_predictions[target] = {
+                            "value": None,
+                            "error": None,
+                            "is_novel": None,
+                            "warning": "genome missing features",
+                            "units": self.UNITS[condition],
+                        }
+
+        if as_dataframe is True:
+            if genome_ids is None:
+                genome_ids = list(range(len(predictions)))
+            rows = [
+                {"genome": genome_id, "target": target, **values}
+                for genome_id, genome_predictions in zip(genome_ids, predictions)
+                for target, values in genome_predictions.items()
+            ]
+            columns = ["genome", "target", "value", "error", "units", "is_novel", "warning"]
+            return pd.DataFrame(rows, columns=columns)
         return predictions
 
     def load_instructions(self, instructions_filename: str) -> dict:
@@ -146,13 +364,17 @@ class GenomeSPOT:
         Returns:
             X: An array of feature values for one genome
         """
-        flat_genome_features = {
+        flat_genome_features = self.flatten_genome_features(genome_features)
+        X = np.array([flat_genome_features.get(x, np.nan) for x in features]).reshape(1, -1)
+        return X
+
+    def flatten_genome_features(self, genome_features: dict) -> Dict[str, float]:
+        """Makes a non-nested dictionary where localization prepends each feature"""
+        return {
             f"{localization}_{feat}": value
             for localization, feat_dict in sorted(genome_features.items())
             for feat, value in sorted(feat_dict.items())
         }
-        X = np.array([flat_genome_features.get(x, np.nan) for x in features]).reshape(1, -1)
-        return X
 
     def predict_target_value(
         self, X: np.ndarray, model, target: str, method: str = "predict", error_model=None, novelty_model=None
@@ -201,13 +423,96 @@ class GenomeSPOT:
 
         return prediction_dict
 
-    def predict_error(self, y: float, error_arr: np.ndarray):
+    def predict_target_values(
+        self, X: np.ndarray, model, target: str, method: str = "predict", error_model=None, novelties=None
+    ) -> List[Dict[str, float]]:
+        """Predicts values for many genomes, as `predict_target_value` does for one.
+
+        Args:
+            X: An array of feature values, one row per genome, without missing values
+            target: Name of the target variable
+            method: `predict` for regressions and `predict_proba` for classifiers
+            error_model: Optional array used to look up the error of regressions
+            novelties: Optional novelty of each genome from `predict_novelties`
+        Returns:
+            prediction_dicts: One dict per row of X, as returned by `predict_target_value`
+        """
+        condition = target.replace("_optimum", "").replace("_min", "").replace("_max", "")
+        units = self.UNITS[condition]
+        if novelties is None:
+            novelties = [None] * len(X)
+        if len(X) == 0:
+            return []
+
+        prediction_dicts = []
+        if method == "predict":
+            y_preds = model.predict(X)
+            checked = [self.check_prediction_range(y_pred, target) for y_pred in y_preds]
+            if error_model is not None:
+                errors = self.predict_errors(np.array([y_pred for y_pred, _ in checked], dtype=float), error_model)
+            else:
+                errors = [None] * len(X)
+            for (y_pred, warning), error, novelty in zip(checked, errors, novelties):
+                prediction_dicts.append(
+                    {"value": y_pred, "error": error, "is_novel": novelty, "warning": warning, "units": units}
+                )
+        elif method == "predict_proba":
+            for y_pred_prob, novelty in zip(model.predict_proba(X)[:, 1], novelties):
+                y_pred, error = self.reformat_oxygen_prediction(y_pred_prob)
+                prediction_dicts.append(
+                    {"value": y_pred, "error": error, "is_novel": novelty, "warning": None, "units": units}
+                )
+        return prediction_dicts
+
+    def predict_error(self, y: float, error_arr: Union[np.ndarray, ErrorModel]):
         """References an array where col 1 is a predicted value
         and col 2 is the RMSE of values predicted to be y +/- interval"""
+        if isinstance(error_arr, ErrorModel):
+            return error_arr.lookup([y])[0]
         closest_reference = np.argmin(np.abs(error_arr[:, 0] - y))
         ref_y, ref_err = error_arr[closest_reference]
         return ref_err
 
+    def predict_errors(self, y: np.ndarray, error_arr: Union[np.ndarray, ErrorModel]) -> np.ndarray:
+        """Looks up the error of many predicted values at once (see `predict_error`)"""
+        if not isinstance(error_arr, ErrorModel):
+            error_arr = ErrorModel(error_arr)
+        return error_arr.lookup(y)
+
+    def predict_errors_for_table(
+        self,
+        table: pd.DataFrame,
+        path_to_models: Union[str, GenomeSPOTModelBundle],
+        target_columns: Optional[Dict[str, str]] = None,
+    ) -> pd.DataFrame:
+        """Re-scores the errors of a whole table of predictions, one lookup per target.
+
+        Args:
+            table: Predicted values with one row per genome, e.g. summary_predictions.csv
+            path_to_models: path to directory with models, or a loaded GenomeSPOTModelBundle
+            target_columns: Column of `table` holding each target, by default the target name
+        Returns:
+            errors: Table with the same index and an `<column>_error` column per target found;
+                rows without a numeric value have a missing error
+        """
+        if isinstance(path_to_models, GenomeSPOTModelBundle):
+            models = path_to_models
+        else:
+            models = load_model_bundle(path_to_models)
+        if target_columns is None:
+            target_columns = {model_name[len("error_") :]: model_name[len("error_") :] for model_name in models.models}
+        errors = pd.DataFrame(index=table.index)
+        for target, column in target_columns.items():
+            error_model = models.models.get(f"error_{target}")
+            if error_model is None or column not in table.columns:
+                continue
+            y = pd.to_numeric(table[column], errors="coerce").values.astype(float)
+            is_predicted = ~np.isnan(y)
+            column_errors = np.full(len(y), np.nan)
+            column_errors[is_predicted] = self.predict_errors(y[is_predicted], error_model)
+            errors[f"{column}_error"] = column_errors
+        return errors
+
     def predict_novelty(self, X: np.ndarray, novelty_model):
         """Predicts novelty using novelty detection model.
 
@@ -220,6 +525,12 @@ class GenomeSPOT:
         is_novel = False if novelty_model.predict(X) == 1 else True
         return is_novel
 
+    def predict_novelties(self, X: np.ndarray, novelty_model) -> List[bool]:
+        """Predicts novelty for each row of X in one call (see `predict_novelty`)"""
+        if len(X) == 0:
+            return []
+        return [bool(is_novel) for is_novel in novelty_model.predict(X) != 1]
+
     def check_prediction_range(self, y_pred: float, target: str) -> Tuple[float, Union[str, None]]:
         """If the prediction is above or below the bounds set in this
         script, a warning flag is added to the output and the value is
@@ -271,6 +582,7 @@ def run_genome_spot(
     path_to_models: str,
     features_json: Optional[str] = None,
     skip_prediction: bool = False,
+    feature_cache: Optional[FeatureCache] = None,
 ) -> Tuple[dict, dict]:
     """Main function for predicting traits from genome sequences (DNA and protein).
 
@@ -280,6 +592,7 @@ def run_genome_spot(
         path_to_models: Path to directory containing models
         features_json: Optional: Path to a precomputed intermediate genome features JSON file
         skip_prediction: If flag used, skips the prediction step. Useful if only genome features are desired
+        feature_cache: Optional: Cache to reuse features measured before from the same files
 
     Peturns:
         predictions: nested dict of target and predicted value and upper and lower confidence intervals
@@ -288,6 +601,14 @@ def run_genome_spot(
     # Load or measure genome features
     if features_json is not None:
         genome_features = load_genome_features(features_json)
+    elif feature_cache is not None:
+        cache_key = feature_cache.key(faa_path, fna_path)
+        genome_features = feature_cache.get(cache_key)
+        if genome_features is None:
+            genome_features = measure_genome_features(faa_path, fna_path)
+            feature_cache.put(cache_key, genome_features)
+        else:
+            logging.info("Loaded genome features from cache %s", feature_cache.location)
     else:
         genome_features = measure_genome_features(faa_path, fna_path)
 
@@ -307,9 +628,31 @@ def save_results(
     genome_features: Optional[dict] = None,
     output_prefix: Optional[str] = None,
     save_genome_features: bool = True,
+    prediction_store: Optional[str] = None,
+    store_only: bool = False,
 ):
-    """Saves results to file if output_prefix is provided""" ""
-    if output_prefix is not None:
+    """Saves results to file if output_prefix is provided, and to a
+    columnar store of all genomes if prediction_store is provided.
+
+    Each call adds one part file to the store, so stores filled one genome
+    at a time should be compacted afterwards with `compact_store`. With
+    store_only, output_prefix only names the genome in the store and no
+    per-genome files are written.
+    """
+    if store_only and prediction_store is None:
+        raise ValueError("A prediction store is needed to save results only to the store")
+    if prediction_store is not None:
+        genome_id = Path(str(output_prefix)).name if output_prefix is not None else None
+        if not genome_id:
+            raise ValueError("An output prefix is needed to name the genome in the prediction store")
+        logging.info("Saving results to prediction store %s", prediction_store)
+        with PredictionStoreWriter(prediction_store) as store:
+            store.add(
+                genome_id,
+                predictions=predictions,
+                genome_features=genome_features if save_genome_features is True else None,
+            )
+    if output_prefix is not None and not store_only:
         if save_genome_features is True:
             intermediate_output = str(output_prefix) + ".features.json"
             logging.info("Saving genome features to %s", intermediate_output)
@@ -362,6 +705,32 @@ def parse_args():
         default=False,
         help="If flag used, save genome features to <output_prefix>.features.json",
     )
+    parser.add_argument(
+        "--prediction-store",
+        default=None,
+        help=(
+            "Optional: Directory of a columnar (Parquet) store to append this genome's results to, named by the "
+            "output prefix. Each run adds one part file: compact the store afterwards with "
+            "genome_spot.prediction_store.compact_store, or use run_genomespot_batch.py for many genomes"
+        ),
+    )
+    parser.add_argument(
+        "--store-only",
+        action="store_true",
+        default=False,
+        help="If flag used, save results only to the prediction store, not to <output_prefix>.* files",
+    )
+    parser.add_argument(
+        "--feature-cache",
+        default=DEFAULT_CACHE_LOCATION,
+        help="Directory (or .sqlite file) caching genome features by file contents (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-feature-cache",
+        action="store_true",
+        default=False,
+        help="If flag used, always measure genome features and do not cache them",
+    )
     parser.add_argument(
         "--skip-prediction",
         action="store_true",
@@ -381,6 +750,8 @@ def validate_args(args: Namespace):
             """User must provide either files for contigs and 
             proteins or a precomputed genome features file"""
         )
+    if args.store_only and (args.prediction_store is None or args.output_prefix is None):
+        raise ValueError("--store-only requires --prediction-store and an --output-prefix naming the genome")
 
 
 def main(args: Namespace):
@@ -390,6 +761,7 @@ def main(args: Namespace):
         features_json=args.genome_features,
         skip_prediction=args.skip_prediction,
         path_to_models=args.models,
+        feature_cache=None if args.no_feature_cache else FeatureCache(args.feature_cache),
     )
 
     save_results(
@@ -397,6 +769,8 @@ def main(args: Namespace):
         genome_features=genome_features,
         output_prefix=args.output_prefix,
         save_genome_features=args.save_genome_features,
+        prediction_store=args.prediction_store,
+        store_only=args.store_only,
     )
     print(pd.DataFrame(predictions).T)
 
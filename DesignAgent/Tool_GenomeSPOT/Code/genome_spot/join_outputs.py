@@ -1,26 +1,62 @@
 """Simple helper to join outputs of individual genome predictions into a single TSV and/or JSON."""
 
 import argparse
+import csv
 import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 from typing import (
+    Dict,
     List,
+    Optional,
     Tuple,
+    Union,
 )
 
+import numpy as np
 import pandas as pd
 
+from .prediction_store import (
+    predictions_by_target,
+    read_predictions,
+)
+
+
+VARIABLES = ["value", "error", "units", "is_novel", "warning"]
+# Fields written for missing values, e.g. a warning of None
+NULL_VALUES = {"", "None", "NaN", "nan"}
+THREADS = min(32, (os.cpu_count() or 1) + 4)
+
+
+def join_outputs(
+    outdir: Optional[str] = None,
+    write_to_tsv: bool = True,
+    write_to_dict: bool = False,
+    store: Optional[str] = None,
+    threads: int = THREADS,
+) -> None:
+    """Join outputs of individual genome predictions into a single TSV and/or JSON.
 
-def join_outputs(outdir: str, write_to_tsv: bool = True, write_to_dict: bool = False) -> None:
-    """Join outputs of individual genome predictions into a single TSV and/or JSON."""
-    output_files = get_output_filepaths(outdir)
+    Predictions are read from a columnar prediction store if provided, otherwise
+    from the *.predictions.tsv files in outdir, using `threads` reader threads.
+    """
+    if store is None:
+        output_files = get_output_filepaths(outdir)
 
     if write_to_tsv is True:
-        single_tsv = convert_outputs_to_single_tsv(output_files)
+        if store is not None:
+            single_tsv = convert_store_to_single_tsv(store)
+        else:
+            single_tsv = convert_outputs_to_single_tsv(output_files, threads=threads)
         single_tsv.to_csv("all.predictions.tsv", sep="\t")
 
     if write_to_dict is True:
-        output_dict = convert_outputs_to_nested_dict(output_files)
+        if store is not None:
+            output_dict = convert_store_to_nested_dict(store)
+        else:
+            output_dict = convert_outputs_to_nested_dict(output_files, threads=threads)
         with open("all.predictions.json", "w") as f:
             json.dump(output_dict, f, indent=4)
 
@@ -38,50 +74,192 @@ def load_output_tsv(tsv: str) -> Tuple[str, pd.DataFrame]:
     return accession, predictions_df
 
 
-def convert_outputs_to_single_tsv(output_files: List[str]) -> pd.DataFrame:
-    """Convert multiple prediction.tsv files into a single DataFrame."""
-    dfs = []
-    for tsv in output_files:
+def read_output_tsv(tsv: str) -> Tuple[str, Dict[str, List[Optional[str]]]]:
+    """Read a single prediction.tsv file as text, without pandas.
+
+    Returns:
+        The accession and, for each target, the fields in the order of VARIABLES,
+        with missing values as None.
+
+    Raises:
+        ValueError: If the file is not a predictions table
+    """
+    accession = tsv.split("/")[-1].split(".")[0]
+    with open(tsv, "r", newline="") as fh:
+        reader = csv.reader(fh, delimiter="\t")
+        header = next(reader, None)
+        if header is None:
+            raise ValueError("empty file")
+        if header[0] != "target":
+            raise ValueError(f"first column is {header[0]!r}, expected 'target'")
+        missing = [variable for variable in VARIABLES if variable not in header]
+        if missing:
+            raise ValueError(f"missing columns {missing}")
+        indices = [header.index(variable) for variable in VARIABLES]
+        table = {}
+        for line_number, fields in enumerate(reader, start=2):
+            if not fields:
+                continue
+            if len(fields) != len(header):
+                raise ValueError(f"line {line_number} has {len(fields)} fields, expected {len(header)}")
+            if fields[0] in table:
+                raise ValueError(f"target {fields[0]} is repeated on line {line_number}")
+            table[fields[0]] = [None if fields[i] in NULL_VALUES else fields[i] for i in indices]
+    if not table:
+        raise ValueError("no predictions")
+    return accession, table
+
+
+def read_output_tsvs(
+    output_files: List[str], threads: int = THREADS
+) -> Tuple[List[Tuple[str, Dict[str, List[Optional[str]]]]], List[Tuple[str, str]]]:
+    """Read prediction.tsv files in a thread pool.
+
+    Returns:
+        (accession, table) of readable files in input order, and
+        (filepath, reason) of files that could not be read.
+    """
+
+    def read(tsv):
         try:
-            accession, predictions_df = load_output_tsv(tsv)
-            melted_df = pd.melt(
-                predictions_df.reset_index().rename(columns={"value": "prediction"}),
-                id_vars=["target"],
-                value_vars=["prediction", "error", "units", "is_novel", "warning"],
-            )
-            melted_df = melted_df.set_index(["target", "variable"]).rename(columns={"value": accession}).T
-            dfs.append(melted_df)
-        except:
-            pass
-    single_tsv = pd.concat(dfs, axis=0)
+            return read_output_tsv(tsv), None
+        except (OSError, UnicodeDecodeError, ValueError, csv.Error) as error:
+            return None, str(error)
+
+    tables = []
+    malformed = []
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        for tsv, (result, error) in zip(output_files, executor.map(read, output_files)):
+            if error is not None:
+                malformed.append((tsv, error))
+            else:
+                tables.append(result)
+    return tables, malformed
+
+
+def report_malformed(malformed: List[Tuple[str, str]]) -> None:
+    """Log files that were skipped because they could not be read."""
+    for tsv, reason in malformed:
+        logging.warning("Skipped malformed predictions file %s: %s", tsv, reason)
+    if malformed:
+        logging.warning("Skipped %d malformed predictions file(s)", len(malformed))
+
+
+def convert_outputs_to_single_tsv(output_files: List[str], threads: int = THREADS) -> pd.DataFrame:
+    """Convert multiple prediction.tsv files into a single DataFrame.
+
+    There is one row per genome and (target, variable) columns. As in
+    `convert_store_to_single_tsv`, numeric predictions and errors are floats
+    and novelty flags are booleans; other fields are kept as written.
+    Files that cannot be read are logged and skipped.
+    """
+    tables, malformed = read_output_tsvs(output_files, threads=threads)
+    report_malformed(malformed)
+
+    targets = list(dict.fromkeys(target for _, table in tables for target in table))
+    target_index = {target: i for i, target in enumerate(targets)}
+    # variable-major columns, as from melting each table
+    data = np.full((len(tables), len(VARIABLES), len(targets)), None, dtype=object)
+    for row, (_, table) in enumerate(tables):
+        for target, fields in table.items():
+            data[row, :, target_index[target]] = fields
+    columns = pd.MultiIndex.from_product(
+        [["prediction" if variable == "value" else variable for variable in VARIABLES], targets],
+        names=["variable", "target"],
+    ).swaplevel()
+    data = data.reshape(len(tables), len(VARIABLES) * len(targets))
+    single_tsv = pd.DataFrame(data, index=[accession for accession, _ in tables], columns=columns)
+    for i, column in enumerate(single_tsv.columns):
+        variable = column[1]
+        if variable in ["prediction", "error"]:
+            fields = data[:, i]
+            try:
+                # parsed with float() as in parse_field, which pd.to_numeric can differ from in the last digit
+                single_tsv[column] = np.where(pd.isna(fields), "nan", fields).astype(float)
+            except ValueError:
+                # classifications such as oxygen tolerance are labels
+                pass
+        elif variable == "is_novel":
+            single_tsv[column] = single_tsv[column].map(parse_field)
     return single_tsv
 
 
-def convert_outputs_to_nested_dict(output_files: List[str]) -> dict:
-    """Convert multiple prediction.tsv files into a nested dictionary."""
+def convert_store_to_single_tsv(store: str) -> pd.DataFrame:
+    """Convert a columnar prediction store into the single DataFrame of `convert_outputs_to_single_tsv`."""
+    single_tsv = predictions_by_target(read_predictions(store))
+    single_tsv = single_tsv.rename(columns={"value": "prediction"}, level=1)
+    variables = ["prediction", "error", "units", "is_novel", "warning"]
+    single_tsv = single_tsv[sorted(single_tsv.columns, key=lambda column: (variables.index(column[1]), column[0]))]
+    single_tsv.columns.names = ["target", "variable"]
+    # genomes are read back as pandas strings; accessions from TSVs are objects
+    single_tsv.index = single_tsv.index.astype(object)
+    single_tsv.index.name = None
+    return single_tsv
+
+
+def convert_outputs_to_nested_dict(output_files: List[str], threads: int = THREADS) -> dict:
+    """Convert multiple prediction.tsv files into a nested dictionary.
+
+    Files that cannot be read or lack a target are logged and skipped.
+    """
+    tables, malformed = read_output_tsvs(output_files, threads=threads)
     output_dict = {}
-    for tsv in output_files:
+    for accession, table in tables:
+        predictions_dict = {
+            target: {variable: parse_field(field) for variable, field in zip(VARIABLES, fields)}
+            for target, fields in table.items()
+        }
         try:
-            accession, predictions_df = load_output_tsv(tsv)
-            output_dict[accession] = {}
-            predictions_dict = predictions_df.T.to_dict()
-            for condition in ["temperature", "ph", "salinity"]:
-                condition_dict = {}
-                for attr in ["optimum", "min", "max"]:
-                    target = f"{condition}_{attr}"
-                    condition_dict[attr] = predictions_dict[target]
-                    condition_dict[attr].pop("is_novel", None)
-                    condition_dict[attr].pop("units", None)
-                    if attr == "optimum":
-                        condition_dict["is_novel"] = predictions_dict[target].get("is_novel", None)
-                        condition_dict["units"] = predictions_dict[target].get("units", None)
-
-                output_dict[accession][condition] = condition_dict
-        except:
+            output_dict[accession] = predictions_to_nested_dict(predictions_dict)
+        except KeyError as error:
+            malformed.append((accession, f"missing target {error}"))
+    report_malformed(malformed)
+    return output_dict
+
+
+def parse_field(field: Optional[str]) -> Union[None, bool, float, str]:
+    """Convert a field of a prediction.tsv file to a JSON value."""
+    if field is None or field in ("True", "False"):
+        return None if field is None else field == "True"
+    try:
+        return float(field)
+    except ValueError:
+        return field
+
+
+def convert_store_to_nested_dict(store: str) -> dict:
+    """Convert a columnar prediction store into the nested dictionary of `convert_outputs_to_nested_dict`."""
+    predictions_df = predictions_by_target(read_predictions(store)).astype(object)
+    output_dict = {}
+    for accession, row in predictions_df.iterrows():
+        predictions_dict = {}
+        for (target, variable), value in row.items():
+            predictions_dict.setdefault(target, {})[variable] = None if pd.isna(value) else value
+        try:
+            output_dict[accession] = predictions_to_nested_dict(predictions_dict)
+        except KeyError:
             pass
     return output_dict
 
 
+def predictions_to_nested_dict(predictions_dict: dict) -> dict:
+    """Nest one genome's predictions by condition and attribute (optimum, min, max)."""
+    nested_dict = {}
+    for condition in ["temperature", "ph", "salinity"]:
+        condition_dict = {}
+        for attr in ["optimum", "min", "max"]:
+            target = f"{condition}_{attr}"
+            condition_dict[attr] = predictions_dict[target]
+            is_novel = condition_dict[attr].pop("is_novel", None)
+            units = condition_dict[attr].pop("units", None)
+            if attr == "optimum":
+                condition_dict["is_novel"] = is_novel
+                condition_dict["units"] = units
+
+        nested_dict[condition] = condition_dict
+    return nested_dict
+
+
 def parse_args():
 
     parser = argparse.ArgumentParser(description="Join outputs of individual genome predictions")
@@ -90,6 +268,18 @@ def parse_args():
         type=str,
         help="Path to directory containing *.prediction.tsv files",
     )
+    parser.add_argument(
+        "--store",
+        type=str,
+        default=None,
+        help="Path to a columnar prediction store to read instead of *.prediction.tsv files",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=THREADS,
+        help="Number of threads reading *.prediction.tsv files",
+    )
     parser.add_argument(
         "--write-to-tsv",
         action="store_true",
@@ -111,4 +301,6 @@ if __name__ == "__main__":
         outdir=args.dir,
         write_to_tsv=args.write_to_tsv,
         write_to_dict=args.write_to_json,
+        store=args.store,
+        threads=args.threads,
     )
@@ -7,14 +7,35 @@ usage is run as a script (runtime: about 1 sec per 100 entries):
 python3 src/query_bacdive.py -c .bacdive_credentials -max 171000 \
         -o bacdive_data.json
 ```
+
+With `--cache-dir`, each chunk of 100 IDs is saved as it arrives, a restarted
+download skips chunks already saved, and `--workers` chunks are queried at once:
+
+```shell
+python3 src/query_bacdive.py -c .bacdive_credentials -max 171000 \
+        --cache-dir bacdive_chunks --workers 4 --requests-per-second 2
+```
 """
 
 import argparse
 import json
 import logging
+import os
 import re
+import threading
+import time
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    as_completed,
+)
+from pathlib import Path
 from typing import (
+    Callable,
     Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
     Tuple,
 )
 
@@ -26,6 +47,65 @@ import pandas as pd
 FREQUENT_OPTIMUM_PH = [6.0, 6.5, 6.75, 7.0, 7.25, 7.5, 7.75, 8.0, 8.5, 9.0]
 FREQUENT_OPTIMUM_TEMP = [20.0, 25.0, 26.0, 26.5, 27.5, 28.0, 29.0, 30.0, 31.0, 32.5, 33.5, 35.0, 36.0, 37.0, 40.0]
 FREQUENT_OPTIMUM_SALINITY = [0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0, 6.0, 7.5, 10.0]
+CHUNK_SIZE = 100  # BacDive API call limit
+VALUE_REGEX = re.compile(r"[-+]?(?:\d*\.*\d+)")
+TAXID_LEVELS = ["strain", "species", "genus", "family", "order", "class", "phylum", "domain"]
+OXYGEN_TOLERANCES = [
+    "aerobe",
+    "anaerobe",
+    "microaerophile",
+    "facultative anaerobe",
+    "obligate aerobe",
+    "obligate anaerobe",
+    "facultative aerobe",
+    "aerotolerant",
+    "microaerotolerant",
+]
+AEROBES = {
+    "obligate aerobe",
+    "aerobe",
+    "facultative anaerobe",
+    "facultative aerobe",
+    "microaerophile",
+    "aerotolerant",
+}
+OBLIGATE_ANAEROBES = {"obligate anaerobe", "anaerobe"}
+
+
+def format_values(string: str) -> list:
+    """
+    Uses regex and replace to extract non-float characters from
+    strings and correct for typos in data entry. If a range,
+    like 3.4-8.4, both values will be returned. Otherwise, one
+    value will be returned.
+    """
+    if "-" in string:
+        return [float(VALUE_REGEX.search(val).group(0).replace("..", ".")) for val in string.split("-") if len(val) > 0]
+    else:
+        return [float(VALUE_REGEX.search(string).group(0))]
+
+
+class RateLimiter:
+    """Spaces out calls, from any thread, to at most `calls_per_second`
+
+    Args:
+        calls_per_second: Maximum rate of calls, or None for no limit
+    """
+
+    def __init__(self, calls_per_second: Optional[float] = None):
+        self.interval = 1.0 / calls_per_second if calls_per_second else 0.0
+        self._lock = threading.Lock()
+        self._next_call = 0.0
+
+    def wait(self):
+        """Blocks until the next call is allowed"""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            call_time = max(now, self._next_call)
+            self._next_call = call_time + self.interval
+        time.sleep(call_time - now)
 
 
 class QueryBacDive:
@@ -34,6 +114,12 @@ class QueryBacDive:
     Queries all BacDive IDs from 0 to the highest ID available, which
     as of 2023-03 was about 171000. IDs appear to be sequential.
 
+    With a `cache_dir`, the raw response of each chunk of IDs is saved to
+    its own JSONL file (`ids-<first ID>-<last ID>.jsonl`, one strain per line)
+    once the chunk is complete. Chunks already saved are skipped, so an
+    interrupted download resumes where it stopped. Up to `max_workers` chunks
+    are queried at once, each thread with its own client.
+
     Typical usage:
     ```
     bacdive_dict = QueryBacDive(
@@ -51,6 +137,11 @@ class QueryBacDive:
             for readability
         max_bacdive_id: Highest BacDive ID to query. Set above the highest
             available ID. See function `find_highest_bacdive_id`
+        cache_dir: Directory to save the response of each chunk in
+        max_workers: Number of chunks queried at once
+        requests_per_second: Maximum rate of chunk queries, or None for no limit
+        client_factory: Function returning a logged-in client, by default
+            a `bacdive.BacdiveClient` with the credentials
     """
 
     def __init__(
@@ -59,12 +150,20 @@ class QueryBacDive:
         password: str,
         max_bacdive_id: int,
         min_bacdive_id: int = 0,
+        cache_dir: Optional[str] = None,
+        max_workers: int = 1,
+        requests_per_second: Optional[float] = None,
+        client_factory: Optional[Callable] = None,
     ):
         self.username = username
         self.password = password
         self.min_bacdive_id = min_bacdive_id
         self.max_bacdive_id = max_bacdive_id
         self.query_list = list(range(self.min_bacdive_id, self.max_bacdive_id, 1))
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.requests_per_second = requests_per_second
+        self.client_factory = client_factory
 
     def load_credentials(self, filepath: str) -> Tuple[str, str]:
         """Loads secret credentials from file.
@@ -92,7 +191,7 @@ class QueryBacDive:
         """
 
         logging.info("Logging into BacdiveClient")
-        client = bacdive.BacdiveClient(self.username, self.password)
+        client = self.make_client()
 
         results = self.paginated_query(
             client=client,
@@ -101,11 +200,30 @@ class QueryBacDive:
 
         return results
 
+    def make_client(self):
+        """Returns a logged-in client"""
+        if self.client_factory is not None:
+            return self.client_factory()
+        return bacdive.BacdiveClient(self.username, self.password)
+
+    def chunk_query_list(self, chunk_size: int = CHUNK_SIZE) -> List[list]:
+        """Splits the IDs to query into chunks of at most `chunk_size`"""
+        return [self.query_list[i : i + chunk_size] for i in range(0, len(self.query_list), chunk_size)]
+
+    def query_chunk(self, client, query_type: str, query: list) -> List[dict]:
+        """Returns the strains found for one chunk of queries"""
+        client.result = {}  # Refreshes queue for retrieve
+        count = client.search(**{query_type: query})
+        strains = list(client.retrieve())
+        logging.info("Searching query indices %s-%s returned %s results", query[0], query[-1], count)
+        return strains
+
     def paginated_query(self, client, query_type: str) -> Dict[str, dict]:
         """Returns a dictionary keyed by BacDive ID.
 
         The BacDive API limits to 100 queries per API call. This
-        function chunks out a query accordingly.
+        function chunks out a query accordingly. With a `cache_dir`, chunks are
+        downloaded to the cache first (see `download_chunks`) and read back.
 
         Args:
             client: bacdive.BacdiveClient object
@@ -115,24 +233,105 @@ class QueryBacDive:
         Returns:
             results: Dictionary keyed by BacDive ID
         """
+        if self.cache_dir is not None:
+            self.download_chunks(query_type, client=client)
+            return {strain["General"]["BacDive-ID"]: strain for strain in iter_bacdive_strains(self.cache_dir)}
+
         results = {}
-        chunk_size = 100  # BacDive API call limit
-        chunks = max([1, round(len(self.query_list) / chunk_size)])
-        logging.info("Iniating %s queries in %s chunks", len(self.query_list), chunks)
-        for n_split in range(chunks):
-            l_idx = chunk_size * n_split
-            r_idx = chunk_size * (n_split + 1)
-            query = {query_type: self.query_list[l_idx:r_idx]}
-
-            client.result = {}  # Refreshes queue for retrieve
-            count = client.search(**query)
-            for strain in client.retrieve():
+        chunks = self.chunk_query_list()
+        logging.info("Iniating %s queries in %s chunks", len(self.query_list), len(chunks))
+        for query in chunks:
+            for strain in self.query_chunk(client, query_type, query):
                 bacdive_id = strain["General"]["BacDive-ID"]
                 results[bacdive_id] = strain
-            logging.info("Searching query indices %s-%s returned %s results", l_idx, r_idx, count)
 
         return results
 
+    def chunk_filename(self, query: list) -> str:
+        """Path of the cached response of a chunk"""
+        return f"{self.cache_dir}/ids-{query[0]:07d}-{query[-1]:07d}.jsonl"
+
+    def download_chunks(self, query_type: str = "id", client=None) -> List[list]:
+        """Saves the response of each chunk not yet in `cache_dir`.
+
+        Chunks are queried by `max_workers` threads at no more than
+        `requests_per_second`. A chunk whose query fails is not saved and is
+        queried again on the next run.
+
+        Args:
+            query_type: Query type for API
+            client: Client used if queries are not concurrent, otherwise
+                each thread makes its own
+
+        Returns:
+            failed: Chunks of queries that failed
+        """
+        Path(self.cache_dir).mkdir(parents=True, exist_ok=True)
+        chunks = self.chunk_query_list()
+        pending = [query for query in chunks if not os.path.exists(self.chunk_filename(query))]
+        logging.info(
+            "Querying %s chunks, %s of %s chunks already in %s",
+            len(pending),
+            len(chunks) - len(pending),
+            len(chunks),
+            self.cache_dir,
+        )
+
+        rate_limiter = RateLimiter(self.requests_per_second)
+        clients = threading.local()
+
+        def download(query):
+            if self.max_workers <= 1 and client is not None:
+                thread_client = client
+            else:
+                if not hasattr(clients, "client"):
+                    clients.client = self.make_client()
+                thread_client = clients.client
+            rate_limiter.wait()
+            strains = self.query_chunk(thread_client, query_type, query)
+            write_chunk(self.chunk_filename(query), strains)
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            futures = {executor.submit(download, query): query for query in pending}
+            for future in as_completed(futures):
+                query = futures[future]
+                try:
+                    future.result()
+                except Exception as error:  # any failure of the API leaves the chunk to retry
+                    logging.warning("Querying indices %s-%s failed: %s", query[0], query[-1], error)
+                    failed.append(query)
+        if failed:
+            logging.warning("%s chunks failed and will be queried again on the next run", len(failed))
+        return failed
+
+
+def write_chunk(filename: str, strains: List[dict]):
+    """Writes strains to a JSONL file, replacing it at once so partial chunks are never saved"""
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, "w") as fh:
+        for strain in strains:
+            fh.write(json.dumps(strain) + "\n")
+    os.replace(tmp_filename, filename)
+
+
+def iter_bacdive_strains(bacdive_download: str) -> Iterator[dict]:
+    """Yields the strains of a BacDive download.
+
+    Args:
+        bacdive_download: JSON file keyed by BacDive ID, or a directory of
+            chunks cached by QueryBacDive, which are read one line at a time
+    """
+    if os.path.isdir(bacdive_download):
+        for filename in sorted(Path(bacdive_download).glob("ids-*.jsonl")):
+            with open(filename, "r") as fh:
+                for line in fh:
+                    if line.strip():
+                        yield json.loads(line)
+    else:
+        with open(bacdive_download, "r") as fh:
+            yield from json.loads(fh.read()).values()
+
 
 class ComputeBacDiveTraits:
     """
@@ -216,17 +415,8 @@ class ComputeBacDiveTraits:
             return None
 
     def _format_values(self, string: str) -> list:
-        """
-        Uses regex and replace to extract non-float characters from
-        strings and correct for typos in data entry. If a range,
-        like 3.4-8.4, both values will be returned. Otherwise, one
-        value will be returned.
-        """
-        regex = re.compile(r"[-+]?(?:\d*\.*\d+)")
-        if "-" in string:
-            return [float(regex.search(val).group(0).replace("..", ".")) for val in string.split("-") if len(val) > 0]
-        else:
-            return [float(regex.search(string).group(0))]
+        """See `format_values`"""
+        return format_values(string)
 
     def get_reported_media(self) -> set:
         subsection = self.entry.get("Culture and growth conditions", None).get("culture medium", {})
@@ -247,16 +437,7 @@ class ComputeBacDiveTraits:
     def get_taxid_ncbi(self) -> str:
         """Returns taxid for lowest taxonomic level"""
         subsection = self.entry.get("General", {}).get("NCBI tax id", {})
-        for level in [
-            "strain",
-            "species",
-            "genus",
-            "family",
-            "order",
-            "class",
-            "phylum",
-            "domain",
-        ]:
+        for level in TAXID_LEVELS:
             taxid = self._query_list_of_dicts(subsection, "NCBI tax id", "Matching level", [level])
             if taxid:
                 return taxid[0]
@@ -402,33 +583,13 @@ class ComputeBacDiveTraits:
         no aerotolerant subtypes are recorded AND the organism is described
         as an anaerobe or obligate anaerobe.
         """
-        onehot_tolerances = {
-            "aerobe": None,
-            "anaerobe": None,
-            "microaerophile": None,
-            "facultative anaerobe": None,
-            "obligate aerobe": None,
-            "obligate anaerobe": None,
-            "facultative aerobe": None,
-            "aerotolerant": None,
-            "microaerotolerant": None,
-        }
-
-        aerobes = {
-            "obligate aerobe",
-            "aerobe",
-            "facultative anaerobe",
-            "facultative aerobe",
-            "microaerophile",
-            "aerotolerant",
-        }
-        obligate_anaerobes = {"obligate anaerobe", "anaerobe"}
+        onehot_tolerances = {tolerance: None for tolerance in OXYGEN_TOLERANCES}
 
         for tolerance in self.reported_oxygen_tolerances:
             onehot_tolerances[tolerance] = 1
-        if len(self.reported_oxygen_tolerances.intersection(aerobes)) > 0:
+        if len(self.reported_oxygen_tolerances.intersection(AEROBES)) > 0:
             onehot_tolerances["oxygen"] = 1
-        elif len(self.reported_oxygen_tolerances.intersection(obligate_anaerobes)) > 0:
+        elif len(self.reported_oxygen_tolerances.intersection(OBLIGATE_ANAEROBES)) > 0:
             onehot_tolerances["oxygen"] = 0
         else:
             onehot_tolerances["oxygen"] = None
@@ -538,20 +699,350 @@ class ComputeBacDiveTraits:
         return features
 
 
-def load_targets_to_dataframe(bacdive_download_file: str) -> pd.DataFrame:
+def _subsection_records(subsection) -> List[dict]:
+    """Returns a subsection as a list of dictionaries, as `_query_list_of_dicts` reads it"""
+    if isinstance(subsection, dict):
+        return [subsection]
+    if isinstance(subsection, list):
+        return [record for record in subsection if isinstance(record, dict)]
+    return []
+
+
+def flatten_bacdive_strains(strains: Iterable[dict]) -> Dict[str, pd.DataFrame]:
+    """Flattens the sections of BacDive entries used for traits into long tables.
+
+    Strains are numbered in order in the `strain` column of every table.
+
+    Returns:
+        tables: Dictionary of tables:
+            - "info": one row per strain with strain_id, ncbi_taxid, species and ncbi_accession
+            - "temperature" and "ph": one row per reported value string, flagged as
+                reported (positive growth) and/or optimum
+            - "halophily": one row per halophily record
+            - "oxygen": one row per reported oxygen tolerance
+    """
+    info = []
+    conditions = {"temperature": [], "ph": []}
+    halophily = []
+    oxygen = []
+    for strain, entry in enumerate(strains):
+        general = entry.get("General", {})
+        taxid_records = _subsection_records(general.get("NCBI tax id", {}))
+        taxid = None
+        for level in TAXID_LEVELS:
+            taxids = [r.get("NCBI tax id") for r in taxid_records if r.get("Matching level") == level]
+            taxids = [value for value in taxids if value]
+            if taxids:
+                taxid = taxids[0]
+                break
+        genomes = _subsection_records(entry.get("Sequence information", {}).get("Genome sequences", {}))
+        accessions = [r.get("accession") for r in genomes if r.get("database") == "ncbi" and r.get("accession")]
+        accession = accessions[0] if accessions else None
+        if accession is not None and len(accession.split(".")) == 1:
+            accession += ".1"
+        species = entry.get("Name and taxonomic classification", {}).get("species", None)
+        info.append((general.get("BacDive-ID", None), taxid, species, accession))
+
+        culture = entry.get("Culture and growth conditions") or {}
+        for condition, subsection, key, growth_key in [
+            ("temperature", "culture temp", "temperature", "growth"),
+            ("ph", "culture pH", "pH", "ability"),
+        ]:
+            for record in _subsection_records(culture.get(subsection, {})):
+                value = record.get(key)
+                if value:
+                    is_reported = record.get(growth_key) in ["yes", "positive"]
+                    is_optimum = record.get("type") == "optimum"
+                    conditions[condition].append((strain, value, is_reported, is_optimum))
+
+        physiology = entry.get("Physiology and metabolism") or {}
+        for record in _subsection_records(physiology.get("halophily", {})):
+            halophily.append(
+                (
+                    strain,
+                    record.get("concentration", ""),
+                    record.get("growth"),
+                    record.get("salt"),
+                    record.get("tested relation", None),
+                )
+            )
+        for record in _subsection_records(physiology.get("oxygen tolerance", {})):
+            tolerance = record.get("oxygen tolerance") if record.get("", None) is None else None
+            if tolerance:
+                oxygen.append((strain, tolerance))
+
+    tables = {
+        "info": pd.DataFrame(info, columns=["strain_id", "ncbi_taxid", "species", "ncbi_accession"], dtype=object),
+        "halophily": pd.DataFrame(halophily, columns=["strain", "concentration", "growth", "salt", "tested_relation"]),
+        "oxygen": pd.DataFrame(oxygen, columns=["strain", "tolerance"]),
+    }
+    for condition, rows in conditions.items():
+        table = pd.DataFrame(rows, columns=["strain", "value", "is_reported", "is_optimum"])
+        tables[condition] = table.astype({"is_reported": bool, "is_optimum": bool})
+    # keep integer strains for empty tables
+    for table in tables.values():
+        if "strain" in table:
+            table["strain"] = table["strain"].astype(np.intp)
+    return tables
+
+
+def _explode_values(strains: np.ndarray, strings: pd.Series) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Parses value strings with `format_values`, once per distinct string
+
+    Returns:
+        rows: Row of the string each value comes from
+        strains: Strain of each value
+        values: Values, in order of rows
+    """
+    parsed = {string: format_values(string) for string in pd.unique(strings)}
+    lists = [parsed[string] for string in strings]
+    lengths = np.fromiter((len(values) for values in lists), dtype=np.intp, count=len(lists))
+    rows = np.repeat(np.arange(len(lists)), lengths)
+    values = np.fromiter((value for values in lists for value in values), dtype=float, count=lengths.sum())
+    return rows, np.asarray(strains)[rows], values
+
+
+def _reported_range(strains: np.ndarray, values: np.ndarray, n_strains: int) -> Tuple[np.ndarray, ...]:
+    """Min, max and number of distinct values of each strain, NaN and 0 without values"""
+    distinct = pd.DataFrame({"strain": strains, "value": values}).drop_duplicates()
+    grouped = distinct.groupby("strain")["value"].agg(["min", "max", "size"])
+    min_ = np.full(n_strains, np.nan)
+    max_ = np.full(n_strains, np.nan)
+    n_values = np.zeros(n_strains, dtype=int)
+    min_[grouped.index] = grouped["min"]
+    max_[grouped.index] = grouped["max"]
+    n_values[grouped.index] = grouped["size"]
+    return min_, max_, n_values
+
+
+def _grouped_reduce(ufunc, strains: np.ndarray, values: np.ndarray, n_strains: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Reduces the values of each strain in order, e.g. np.add for sums like `np.sum`
+
+    Returns:
+        reduced: Reduced value of each strain, NaN without values
+        counts: Number of values of each strain
+    """
+    reduced = np.full(n_strains, np.nan)
+    counts = np.bincount(strains, minlength=n_strains)
+    if len(values):
+        # values are grouped by strain in strain order
+        starts = np.flatnonzero(np.r_[True, strains[1:] != strains[:-1]])
+        reduced[strains[starts]] = ufunc.reduceat(values, starts)
+    return reduced, counts
+
+
+def _grouped_mean(strains: np.ndarray, values: np.ndarray, n_strains: int) -> np.ndarray:
+    """Mean of the values of each strain, as `np.mean` of each strain's list"""
+    sums, counts = _grouped_reduce(np.add, strains, values, n_strains)
+    with np.errstate(invalid="ignore"):
+        return sums / counts
+
+
+def _halophily_values(halophily: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Applies `ComputeBacDiveTraits.parse_halophily_dict` to every halophily record
+
+    Returns:
+        strains: Strain of each salinity (% NaCl)
+        salinities: Salinities, in order of records
+        is_optimum: Whether each salinity is from an optimum record
+    """
+    concentration = halophily["concentration"].astype(str)
+    growth = halophily["growth"]
+    is_nacl = (halophily["salt"] == "NaCl").values
+    is_growth = growth.isin(["positive", "inconsistent"]).values
+    no_growth_above = (concentration.str.startswith(">") & (growth == "no")).values
+    growth_below = concentration.str.startswith("<").values & is_growth
+    # ranges with one bound start at 0
+    from_zero = is_nacl & (no_growth_above | growth_below)
+    is_parsed = from_zero | (is_nacl & is_growth)
+
+    parsed = halophily[is_parsed]
+    rows, strains, values = _explode_values(parsed["strain"].values, parsed["concentration"])
+    zero_rows = np.flatnonzero(from_zero[is_parsed])
+    rows = np.concatenate([zero_rows, rows])
+    strains = np.concatenate([parsed["strain"].values[zero_rows], strains])
+    values = np.concatenate([np.zeros(len(zero_rows)), values])
+    order = np.argsort(rows, kind="stable")
+    rows, strains, values = rows[order], strains[order], values[order]
+
+    parsed_concentration = concentration[is_parsed].values[rows]
+    conversion = np.ones(len(values))
+    conversion[pd.Series(parsed_concentration, dtype=object).str.contains("M", regex=False).values] = 58.443 / 10.0
+    conversion[pd.Series(parsed_concentration, dtype=object).str.contains("g/L", regex=False).values] = 0.1
+    salinities = values * conversion
+    is_optimum = (parsed["tested_relation"] == "optimum").values[rows]
+    keep = salinities < 39
+    return strains[keep].astype(np.intp), salinities[keep], is_optimum[keep]
+
+
+def _qc_condition(
+    optimum: np.ndarray,
+    min_: np.ndarray,
+    max_: np.ndarray,
+    n_values_reported: np.ndarray,
+    required_range: float,
+    optima_to_check: list,
+    keep_below: float,
+    keep_above: float,
+) -> np.ndarray:
+    """`ComputeBacDiveTraits.qc_condition` for arrays with NaN for missing values"""
+    is_complete = ~(np.isnan(optimum) | np.isnan(min_) | np.isnan(max_))
+    is_frequent = np.isin(optimum, optima_to_check)
+    is_suspect = is_frequent & ((min_ == optimum) | (max_ == optimum) | (n_values_reported < 4))
+    is_extreme = (optimum <= keep_below) | (optimum >= keep_above)
+    is_narrow = np.abs(max_ - min_) <= required_range
+    return is_complete & (is_extreme | (~is_narrow & ~is_suspect))
+
+
+def _as_objects(values: np.ndarray) -> np.ndarray:
+    """Converts a float array to objects with None for NaN, like the per-strain traits"""
+    objects = values.astype(object)
+    objects[np.isnan(values)] = None
+    return objects
+
+
+def compute_trait_table(strains: Iterable[dict]) -> pd.DataFrame:
+    """Computes the traits of `ComputeBacDiveTraits.compute_trait_data` for many strains at once.
+
+    The sections used for traits are flattened into long tables once (see
+    `flatten_bacdive_strains`), each distinct value string is parsed once, and
+    ranges, optima, QC flags and oxygen tolerances are computed with grouped
+    array operations instead of one object per strain.
+
+    Returns:
+        traits_df: Traits indexed by genome accession like `load_targets_to_dataframe`:
+            strains without an NCBI genome are dropped, and the last strain of a
+            genome is kept
+    """
+    tables = flatten_bacdive_strains(strains)
+    info = tables["info"]
+    n_strains = len(info)
+    traits = {}
+
+    for condition in ["temperature", "ph"]:
+        table = tables[condition]
+        rows, strain_of_value, values = _explode_values(table["strain"].values, table["value"])
+        is_reported = table["is_reported"].values[rows]
+        traits[f"{condition}_range"] = _reported_range(strain_of_value[is_reported], values[is_reported], n_strains)
+        is_optimum = table["is_optimum"].values[rows]
+        traits[f"{condition}_optima"] = (strain_of_value[is_optimum], values[is_optimum])
+
+    temperature_min, temperature_max, n_temperatures = traits["temperature_range"]
+    temperature_optimum = _grouped_mean(*traits["temperature_optima"], n_strains)
+
+    ph_min, ph_max, n_phs = traits["ph_range"]
+    ph_optimum_min, _ = _grouped_reduce(np.minimum, *traits["ph_optima"], n_strains)
+    ph_optimum_max, _ = _grouped_reduce(np.maximum, *traits["ph_optima"], n_strains)
+    # a bound of 0 counts as missing, as in `get_optimum_ph`
+    has_optimum_range = (ph_optimum_min != 0) & (ph_optimum_max != 0)
+    ph_optimum = np.where(has_optimum_range, (ph_optimum_min + ph_optimum_max) / 2, np.nan)
+
+    strain_of_salinity, salinities, is_optimum_salinity = _halophily_values(tables["halophily"])
+    salinity_min, salinity_max, n_salinities = _reported_range(strain_of_salinity, salinities, n_strains)
+    salinity_midpoint = (salinity_min + salinity_max) / 2
+    salinity_optimum = _grouped_mean(
+        strain_of_salinity[is_optimum_salinity], salinities[is_optimum_salinity], n_strains
+    )
+
+    tolerances = tables["oxygen"].drop_duplicates()
+    is_aerobe = np.zeros(n_strains, dtype=bool)
+    is_aerobe[tolerances["strain"][tolerances["tolerance"].isin(AEROBES)].values] = True
+    is_anaerobe = np.zeros(n_strains, dtype=bool)
+    is_anaerobe[tolerances["strain"][tolerances["tolerance"].isin(OBLIGATE_ANAEROBES)].values] = True
+    oxygen = np.full(n_strains, None, dtype=object)
+    oxygen[is_anaerobe] = 0
+    oxygen[is_aerobe] = 1
+
+    columns = {
+        "ncbi_accession": info["ncbi_accession"].values,
+        "ncbi_taxid": info["ncbi_taxid"].values,
+        "strain_id": info["strain_id"].values,
+        "species": info["species"].values,
+        "ph_optimum": _as_objects(ph_optimum),
+        "ph_optimum_min": _as_objects(ph_optimum_min),
+        "ph_optimum_max": _as_objects(ph_optimum_max),
+        "temperature_optimum": _as_objects(temperature_optimum),
+        "salinity_optimum": _as_objects(salinity_optimum),
+        "salinity_midpoint": _as_objects(salinity_midpoint),
+        "salinity_min": _as_objects(salinity_min),
+        "salinity_max": _as_objects(salinity_max),
+        "ph_min": _as_objects(ph_min),
+        "ph_max": _as_objects(ph_max),
+        "temperature_min": _as_objects(temperature_min),
+        "temperature_max": _as_objects(temperature_max),
+        "oxygen": oxygen,
+        "use_ph": _qc_condition(
+            ph_optimum,
+            ph_min,
+            ph_max,
+            n_values_reported=n_phs,
+            required_range=1.5,
+            keep_below=4,
+            keep_above=9,
+            optima_to_check=FREQUENT_OPTIMUM_PH,
+        ),
+        "use_temperature": _qc_condition(
+            temperature_optimum,
+            temperature_min,
+            temperature_max,
+            n_values_reported=n_temperatures,
+            required_range=10,
+            keep_below=19,
+            keep_above=45,
+            optima_to_check=FREQUENT_OPTIMUM_TEMP,
+        ),
+        "use_salinity": _qc_condition(
+            salinity_optimum,
+            salinity_min,
+            salinity_max,
+            n_values_reported=n_salinities,
+            required_range=0.5,
+            keep_below=0,  # required to keep 0% salinity values
+            keep_above=15,
+            optima_to_check=FREQUENT_OPTIMUM_SALINITY,
+        ),
+        "use_oxygen": is_aerobe | is_anaerobe,
+    }
+    for column in ["use_ph", "use_temperature", "use_salinity", "use_oxygen"]:
+        columns[column] = columns[column].astype(object)
+    # tolerances outside the usual ones are set only for strains reporting them,
+    # and are columns only if a strain in the table reports them
+    has_genome = info["ncbi_accession"].notna() & (info["ncbi_accession"] != "")
+    is_kept = (has_genome & ~info["ncbi_accession"].duplicated(keep="last")).values
+    other_tolerances = tolerances[~tolerances["tolerance"].isin(OXYGEN_TOLERANCES) & is_kept[tolerances["strain"]]]
+    other_tolerances = other_tolerances.sort_values(["strain", "tolerance"])["tolerance"].unique().tolist()
+    for tolerance in OXYGEN_TOLERANCES + other_tolerances:
+        is_reported = np.zeros(n_strains, dtype=bool)
+        is_reported[tolerances["strain"][tolerances["tolerance"] == tolerance].values] = True
+        onehot = np.full(n_strains, None if tolerance in OXYGEN_TOLERANCES else np.nan, dtype=object)
+        onehot[is_reported] = 1
+        columns[tolerance] = onehot
+
+    # keep the last strain of each genome at the position of the first
+    traits_df = pd.DataFrame(columns, dtype=object)[is_kept]
+    traits_df.index = traits_df["ncbi_accession"].values
+    first_order = pd.unique(info["ncbi_accession"][has_genome])
+    return traits_df.loc[first_order]
+
+
+def load_targets_to_dataframe(bacdive_download_file: str, bulk: bool = True) -> pd.DataFrame:
     """Use ComputeBacDiveTraits to create a dataframe
     calculated from the downloaded BacDive data.
 
     Args:
         bacdive_download_file (str): path to BacDive data downloaded using
-            the script download_training_data.py
+            the script download_training_data.py, or to its directory of
+            cached chunks, which is streamed
+        bulk (bool): compute traits for all strains at once with
+            `compute_trait_table` instead of one ComputeBacDiveTraits per strain
 
     Returns:
         df_targets (pd.DataFrame): dataframe with trait data
     """
-    bacdive_dict = json.loads(open(bacdive_download_file, "r").read())
+    if bulk:
+        return compute_trait_table(iter_bacdive_strains(bacdive_download_file))
     trait_dict = {}
-    for data in bacdive_dict.values():
+    for data in iter_bacdive_strains(bacdive_download_file):
         strain_traits = ComputeBacDiveTraits(data).compute_trait_data()
         genome_accession = strain_traits.get("ncbi_accession", None)
         if genome_accession:
@@ -569,6 +1060,9 @@ def get_bacdive_trait_data(
     traits_tsv: str = "trait_data.tsv",
     genome_accessions_txt: str = "genbank_accessions.txt",
     use_existing: bool = False,
+    cache_dir: Optional[str] = None,
+    max_workers: int = 1,
+    requests_per_second: Optional[float] = None,
 ):
     """Main function to download and engineer data from BacDive.
 
@@ -581,24 +1075,36 @@ def get_bacdive_trait_data(
         max_bacdive_id: Maximum BacDive id to query - see QueryBacDive
         min_bacdive_id: (Optional) Minimum BacDive id to query - see QueryBacDive
         bacdive_json: (Optional) A preexisting download from BacDive
+        cache_dir: (Optional) Directory of cached chunks to download to and
+            compute traits from instead of `bacdive_output` - see QueryBacDive
+        max_workers: Number of chunks queried at once - see QueryBacDive
+        requests_per_second: Maximum rate of chunk queries - see QueryBacDive
     """
     # Query BacDive
     if use_existing is not True:
         logging.info("Attempting to download data from BacDive API")
-        bacdive_dict = QueryBacDive(
+        query = QueryBacDive(
             username=bacdive_username,
             password=bacdive_password,
             max_bacdive_id=int(max_bacdive_id),
             min_bacdive_id=int(min_bacdive_id),
-        ).scrape_bacdive_api()
-        logging.info("Saving BacDive data to file: %s", bacdive_output)
-        json.dump(bacdive_dict, open(bacdive_output, "w"))
+            cache_dir=cache_dir,
+            max_workers=max_workers,
+            requests_per_second=requests_per_second,
+        )
+        if cache_dir is not None:
+            failed = query.download_chunks()
+            if failed:
+                raise RuntimeError(f"{len(failed)} chunks of BacDive IDs failed to download, run again to resume")
+        else:
+            bacdive_dict = query.scrape_bacdive_api()
+            logging.info("Saving BacDive data to file: %s", bacdive_output)
+            json.dump(bacdive_dict, open(bacdive_output, "w"))
     else:
         logging.info("Data from BacDive API supplied by user")
-        bacdive_dict = json.loads(open(bacdive_output, "r").read())
 
     # Compute trait data indexed by genome
-    traits_df = load_targets_to_dataframe(bacdive_output)
+    traits_df = load_targets_to_dataframe(cache_dir if cache_dir is not None else bacdive_output)
     traits_df.to_csv(traits_tsv, sep="\t")
 
     # Save genome list
@@ -634,6 +1140,16 @@ def parse_args():
         required=False,
     )
     parser.add_argument("--use-existing", action="store_true", help="Existing  BacDive data download")
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Optional: directory to save each chunk of raw BacDive data in, resuming downloads",
+        required=False,
+    )
+    parser.add_argument("--workers", type=int, default=1, help="Number of chunks of IDs to query at once")
+    parser.add_argument(
+        "--requests-per-second", type=float, default=None, help="Optional: maximum rate of chunk queries"
+    )
     parser.add_argument("-o", "--output", default="trait_data.tsv", help="Output TSV of trait data")
     parser.add_argument(
         "-a", "--accessions", default="genbank_accessions.txt", help="Output TXT file with genome accessions"
@@ -658,4 +1174,7 @@ if __name__ == "__main__":
         max_bacdive_id=int(args.max),
         min_bacdive_id=int(args.min),
         use_existing=args.use_existing,
+        cache_dir=args.cache_dir,
+        max_workers=args.workers,
+        requests_per_second=args.requests_per_second,
     )
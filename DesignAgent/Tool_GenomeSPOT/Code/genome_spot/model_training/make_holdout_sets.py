@@ -28,7 +28,7 @@ from ..helpers import (
 )
 from ..taxonomy.balance import BalanceTaxa
 from ..taxonomy.partition import PartitionTaxa
-from ..taxonomy.taxonomy import TaxonomyGTDB
+from ..taxonomy.taxonomy import load_taxonomy
 
 
 logging.basicConfig(level=logging.INFO, datefmt="%Y-%m-%d %H:%M:%S", format="%(asctime)s %(levelname)s %(message)s")
@@ -71,7 +71,7 @@ def make_holdout_sets(
     Returns:
         Dictionary of holdout sets, keyed by each condition, e.g. 'oxygen', 'salinity', etc.
     """
-    taxonomy = TaxonomyGTDB()
+    taxonomy = load_taxonomy()
     balancer = BalanceTaxa(taxonomy=taxonomy)
     partitioner = PartitionTaxa(
         taxonomy=taxonomy,
@@ -351,7 +351,7 @@ def make_cv_sets_by_phylogeny(
     """
 
     partitioner = PartitionTaxa(
-        taxonomy=TaxonomyGTDB(),
+        taxonomy=load_taxonomy(),
         partition_rank=partition_rank,
         diversity_rank="species",
     )
@@ -1,25 +1,44 @@
 import argparse
+import hashlib
+import json
 import logging
 import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 from glob import glob
+from itertools import chain
 from pathlib import Path
 from typing import (
     List,
+    Optional,
     Tuple,
     Union,
 )
 
+import numpy as np
 import pandas as pd
 
 from ..bioinformatics.genome import measure_genome_features
+from ..bioinformatics.signal_peptide import load_trained_model
 from ..genome_spot import save_results
 from ..helpers import load_file_pairs_from_directory
-from ..taxonomy.taxonomy import TaxonomyGTDB
+from ..taxonomy.taxonomy import load_taxonomy
+
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 
 
 logger = multiprocessing.log_to_stderr()
 logger.setLevel(logging.INFO)
 
+
 IGNORE_GENOMES = [
     "GCA_000875775",  # BacDive salinity decimal point error up
     "GCA_003751385",  # BacDive salinity decimal point error up
@@ -46,34 +65,100 @@ def generate_inputs(input_list: List[Tuple[str, str, str]], output_dir: str):
         yield n, Path(faa_path), Path(fna_path), output_prefix
 
 
-def process_measure_genome_features(inputs: Tuple[int, str, str, str]):
-    """Function to be called in multiprocessing pool. Measures genome features and saves to file."""
+def is_valid_features_file(filename: str) -> bool:
+    """Whether a features JSON exists, is complete and has features.
+
+    Empty features are written for genomes that failed, so those are measured
+    again by a resumed run.
+    """
+    try:
+        with open(filename, "r", encoding="utf-8") as fh:
+            genome_features = json.load(fh)
+    except (OSError, ValueError):
+        return False
+    return (
+        isinstance(genome_features, dict)
+        and all(isinstance(feat_dict, dict) for feat_dict in genome_features.values())
+        and len(genome_features.get("all", {})) > 0
+    )
+
+
+@contextmanager
+def time_limit(seconds: Optional[float]):
+    """Raises TimeoutError in the block after `seconds`, where SIGALRM is available.
+
+    Pool workers run tasks in their main thread, which is where signals are handled.
+    """
+    if not seconds or not hasattr(signal, "SIGALRM"):
+        yield
+        return
+
+    def handle_alarm(signum, frame):
+        raise TimeoutError(f"timed out after {seconds} s")
+
+    previous_handler = signal.signal(signal.SIGALRM, handle_alarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+def process_measure_genome_features(inputs: Tuple[int, str, str, str], timeout: Optional[float] = None):
+    """Function to be called in multiprocessing pool. Measures genome features and saves to file.
+
+    Returns:
+        inputs and the status: "ok", "failed" or "timeout"
+    """
     n, faa_path, fna_path, output_prefix = inputs
+    status = "ok"
     try:
-        genome_features = measure_genome_features(faa_path=faa_path, fna_path=fna_path)
-    except:
+        with time_limit(timeout):
+            genome_features = measure_genome_features(faa_path=faa_path, fna_path=fna_path)
+    except TimeoutError:
+        status = "timeout"
+        genome_features = {}
+    except Exception:
+        status = "failed"
         genome_features = {}
     save_results(
         predictions=None, genome_features=genome_features, output_prefix=output_prefix, save_genome_features=True
     )
-    if n % 1000 == 0:
-        logger.info("%i features calculated", n)
-    return inputs
+    return inputs, status
 
 
 def pool_measure_genome_features(
-    directory: str, suffix_fna: str, suffix_faa: str, output_dir: str, processes: Union[int, None]
+    directory: str,
+    suffix_fna: str,
+    suffix_faa: str,
+    output_dir: str,
+    processes: Union[int, None],
+    chunksize: int = 1,
+    timeout: Optional[float] = None,
+    max_tasks_per_child: Optional[int] = 100,
+    resume: bool = True,
+    progress_every: int = 100,
 ) -> list:
     """Use multiprocessing to measure genome features in parallel.
 
+    Genomes are handed to workers as they free up and logged as they finish,
+    with throughput and the time remaining.
+
     Args:
         directory (str): directory containing genome files (pairs of DNA and protein FASTAs)
         suffix_fna (str): suffix of DNA FASTA files
         suffix_faa (str): suffix of protein FASTA files
         output_dir (str): directory to save genome features
-        processes (int): number of parallel processes
+        processes (int): number of parallel processes (default: number of CPUs - 1)
+        chunksize (int): number of genomes sent to a worker at once
+        timeout (float): seconds after which a genome is abandoned and saved without features
+        max_tasks_per_child (int): genomes measured by a worker before it is replaced,
+            which bounds the memory a worker can accumulate
+        resume (bool): whether to skip genomes with a valid features file in output_dir
+        progress_every (int): number of genomes between progress reports, or 0 for none
     Returns:
-        outputs (list): list of inputs provided to process_measure_genome_features
+        outputs (list): inputs provided to process_measure_genome_features, in order of completion
     """
 
     # Set inputs
@@ -82,20 +167,54 @@ def pool_measure_genome_features(
     input_list, n_missing_files = load_file_pairs_from_directory(
         directory, suffix_fna=suffix_fna, suffix_faa=suffix_faa
     )
-    filepath_gen = generate_inputs(input_list, output_dir)
     logger.info("Found both DNA and protein FASTA for %i genomes", len(input_list))
     logger.info("MISSING %i files (DNA or protein)", n_missing_files)
+    if resume is True:
+        n_genomes = len(input_list)
+        input_list = [
+            (genome_accession, faa_path, fna_path)
+            for genome_accession, faa_path, fna_path in input_list
+            if not is_valid_features_file(f"{output_dir}/{genome_accession}.features.json")
+        ]
+        logger.info("Skipping %i genomes with features already measured", n_genomes - len(input_list))
+    filepath_gen = generate_inputs(input_list, output_dir)
 
-    workers = int(processes)
-    if workers is None:
-        workers = multiprocessing.cpu_count() - 1
+    workers = int(processes) if processes is not None else max(1, multiprocessing.cpu_count() - 1)
     logging.info("Measuring %i genomes with %i CPUs", len(input_list), workers)
 
-    # Measure
-    with multiprocessing.Pool(workers) as p:
-        pipeline_gen = p.map(process_measure_genome_features, filepath_gen)
-        outputs = list(pipeline_gen)
-    logger.info("Measured %i genomes", len(outputs))
+    # Measure. The signal peptide HMM is loaded before forking so workers share the
+    # parent's copy; the initializer covers start methods that do not fork.
+    load_trained_model()
+    outputs = []
+    n_status = {"ok": 0, "failed": 0, "timeout": 0}
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers, initializer=load_trained_model, maxtasksperchild=max_tasks_per_child) as p:
+        task = partial(process_measure_genome_features, timeout=timeout)
+        for inputs, status in p.imap_unordered(task, filepath_gen, chunksize=max(1, int(chunksize))):
+            outputs.append(inputs)
+            n_status[status] += 1
+            if status != "ok":
+                outcome = "timed out" if status == "timeout" else "failed"
+                logger.warning("Measuring %s %s", Path(inputs[3]).name, outcome)
+            n_done = len(outputs)
+            if progress_every > 0 and (n_done % progress_every == 0 or n_done == len(input_list)):
+                elapsed = time.perf_counter() - start
+                rate = n_done / elapsed if elapsed > 0 else 0.0
+                remaining = (len(input_list) - n_done) / rate if rate > 0 else 0.0
+                logger.info(
+                    "%i/%i genomes measured (%.2f genomes/s, ~%.0f s remaining)",
+                    n_done,
+                    len(input_list),
+                    rate,
+                    remaining,
+                )
+    logger.info(
+        "Measured %i genomes: %i ok, %i failed, %i timed out",
+        len(outputs),
+        n_status["ok"],
+        n_status["failed"],
+        n_status["timeout"],
+    )
 
     return outputs
 
@@ -103,31 +222,149 @@ def pool_measure_genome_features(
 ### FUNCTIONS TO CREATE DATAFRAME
 
 
-def load_features_to_dataframe(features_dir: str) -> pd.DataFrame:
+def load_features_to_dataframe(
+    features_dir: str,
+    dtype: np.dtype = np.float32,
+    processes: int = 1,
+    cache_path: Optional[str] = None,
+    chunksize: int = 256,
+) -> pd.DataFrame:
     """Load features from genomes to a dataframe
 
+    Chunks of feature files are parsed, in parallel processes if requested, into
+    matrices that are then copied into one matrix, with columns in the order they
+    first appear. Features missing from a genome are 0. Files that cannot be read
+    or have no features are skipped.
+
     Args:
         features_dir (str): directory containing genome features
+        dtype (np.dtype): type of the feature values
+        processes (int): number of processes parsing feature files
+        cache_path (str): optional .npz file to reuse the matrix from while the
+            feature files are unchanged, and to save it to otherwise
+        chunksize (int): number of feature files parsed per task
     Returns:
         df_features (pd.DataFrame): dataframe with genome features
     """
-    sers = []
-    for filename in glob(features_dir + "/*.features.json"):
-        try:
-            ser_genome = load_features_json_to_df(filename)
-            sers.append(ser_genome)
-        except:
-            pass
-    df_features = pd.concat(sers, axis=1).T
+    filenames = sorted(glob(features_dir + "/*.features.json"))
+    signature = _features_signature(filenames)
+    if cache_path is not None:
+        df_features = _load_features_cache(cache_path, signature, dtype)
+        if df_features is not None:
+            logging.info("Loaded features of %i genomes from %s", len(df_features), cache_path)
+            return df_features
+
+    chunks = [filenames[i : i + chunksize] for i in range(0, len(filenames), chunksize)]
+    read_chunk = partial(_read_features_chunk, dtype=dtype)
+    if processes is not None and int(processes) > 1:
+        with ProcessPoolExecutor(int(processes)) as executor:
+            parsed = list(executor.map(read_chunk, chunks))
+    else:
+        parsed = list(map(read_chunk, chunks))
+
+    columns = {}
+    for _, chunk_columns, _ in parsed:
+        for name in chunk_columns:
+            columns.setdefault(name, len(columns))
+    n_genomes = sum(len(accessions) for accessions, _, _ in parsed)
+    if n_genomes < len(filenames):
+        logging.warning("Skipped %i features files that were unreadable or empty", len(filenames) - n_genomes)
+    matrix = np.zeros((n_genomes, len(columns)), dtype=dtype)
+    row = 0
+    for accessions, chunk_columns, chunk_matrix in parsed:
+        matrix[row : row + len(accessions), [columns[name] for name in chunk_columns]] = chunk_matrix
+        row += len(accessions)
+
+    accessions = [accession for chunk_accessions, _, _ in parsed for accession in chunk_accessions]
+    df_features = pd.DataFrame(matrix, index=accessions, columns=list(columns))
+    if cache_path is not None:
+        _save_features_cache(cache_path, signature, df_features)
+        logging.info("Saved features of %i genomes to %s", len(df_features), cache_path)
+    return df_features
 
+
+def _read_features_chunk(filenames: List[str], dtype: np.dtype) -> Tuple[List[str], List[str], np.ndarray]:
+    """Parses features files into a matrix, skipping files that cannot be read or are empty
+
+    Returns:
+        accessions, `<localization>_<feature>` column names and the matrix
+    """
+    parsed = []
+    for filename in filenames:
+        try:
+            accession, layout, values = _read_features_json(filename)
+        except (OSError, ValueError, TypeError, AttributeError):
+            continue
+        if len(values) > 0:
+            parsed.append((accession, layout, values))
+
+    # Map each distinct feature layout, usually one for all genomes, to matrix columns once.
+    # Like a table of localizations by features, each localization has every feature of the file.
+    columns = {}
+    layouts = {}
+    for _, layout, _ in parsed:
+        if layout not in layouts:
+            all_feats = dict.fromkeys(feat for _, feats in layout for feat in feats)
+            for localization, _ in layout:
+                for feat in all_feats:
+                    columns.setdefault(f"{localization}_{feat}", len(columns))
+            names = [f"{localization}_{feat}" for localization, feats in layout for feat in feats]
+            layouts[layout] = np.array([columns[name] for name in names], dtype=np.intp)
+    matrix = np.zeros((len(parsed), len(columns)), dtype=dtype)
+    for row, (_, layout, values) in enumerate(parsed):
+        matrix[row, layouts[layout]] = values
     # Missing data should be 0
-    df_features = df_features.fillna(0.0)
-    # Join localization and variable together
-    renamed_cols = ["_".join(ser) for ser in df_features]
-    df_features.columns = df_features.columns.droplevel()
-    df_features.columns = renamed_cols
+    matrix[np.isnan(matrix)] = 0.0
+    return [accession for accession, _, _ in parsed], list(columns), matrix
 
-    return df_features
+
+def _read_features_json(filename: str) -> Tuple[str, tuple, np.ndarray]:
+    """Returns the accession, layout ((localization, features), ...) and values of a features file"""
+    with open(filename, "rb") as fh:
+        text = fh.read()
+    try:
+        genome_features = json_loads(text)
+    except ValueError:
+        # NaN written by json.dump is not strict JSON
+        genome_features = json.loads(text)
+    layout = tuple((localization, tuple(feat_dict)) for localization, feat_dict in genome_features.items())
+    values = np.fromiter(
+        chain.from_iterable(feat_dict.values() for feat_dict in genome_features.values()), dtype=float
+    )
+    accession = filename.split("/")[-1].split(".")[0]
+    return accession, layout, values
+
+
+def _features_signature(filenames: List[str]) -> str:
+    """Hash of the names, sizes and modification times of feature files"""
+    digest = hashlib.sha256()
+    for filename in filenames:
+        stat = os.stat(filename)
+        digest.update(f"{filename}\t{stat.st_size}\t{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _load_features_cache(cache_path: str, signature: str, dtype: np.dtype) -> Optional[pd.DataFrame]:
+    """Returns cached features if they were saved from the same feature files"""
+    try:
+        with np.load(cache_path, allow_pickle=False) as cache:
+            if str(cache["signature"]) != signature or cache["values"].dtype != np.dtype(dtype):
+                return None
+            return pd.DataFrame(cache["values"], index=cache["genomes"].tolist(), columns=cache["columns"].tolist())
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _save_features_cache(cache_path: str, signature: str, df_features: pd.DataFrame):
+    tmp_path = f"{cache_path}.tmp.npz"
+    np.savez(
+        tmp_path,
+        values=df_features.to_numpy(),
+        genomes=np.array(df_features.index, dtype=str),
+        columns=np.array(df_features.columns, dtype=str),
+        signature=np.array(signature),
+    )
+    os.replace(tmp_path, cache_path)
 
 
 def load_features_json_to_df(filename: str) -> pd.DataFrame:
@@ -194,24 +431,29 @@ def qc_targets_dataframe(input_df_targets: pd.DataFrame) -> pd.DataFrame:
     df_targets = df_targets.rename(columns={"species": "ncbi_species"})
 
     # Add taxonomy
-    taxonomy = TaxonomyGTDB()
-    for taxlevel, index in taxonomy.indices.items():
-        df_targets[taxlevel] = df_targets.index.map({k: v[index] for k, v in taxonomy.taxonomy_dict.items()})
+    taxonomy = load_taxonomy()
+    lineages = taxonomy.lineages_of_genomes(df_targets.index)
+    for taxlevel in taxonomy.indices:
+        df_targets[taxlevel] = lineages[taxlevel].values
 
     return df_targets
 
 
-def make_training_df(features_dir: str, trait_data_tsv: str) -> pd.DataFrame:
+def make_training_df(
+    features_dir: str, trait_data_tsv: str, features_cache: Optional[str] = None, processes: int = 1
+) -> pd.DataFrame:
     """Load features JSONs and target data to create a training dataframe
 
     Args:
         features_dir (str): directory containing genome features
         trait_data_tsv (str): path to trait data produced using
             the script download_training_data.py
+        features_cache (str): optional .npz file caching the loaded features
+        processes (int): number of processes loading features
     Returns:
         df (pd.DataFrame): dataframe with features and targets ready for training
     """
-    df_features = load_features_to_dataframe(features_dir)
+    df_features = load_features_to_dataframe(features_dir, processes=processes, cache_path=features_cache)
     df_features = qc_features_dataframe(df_features)
     df_targets = load_target_dataframe(trait_data_tsv=trait_data_tsv)
     df_targets = qc_targets_dataframe(df_targets)
@@ -228,6 +470,11 @@ def make_training_dataset(
     output_tsv: str,
     processes: Union[int, None] = None,
     skip_measure_features: bool = False,
+    chunksize: int = 1,
+    timeout: Optional[float] = None,
+    max_tasks_per_child: Optional[int] = 100,
+    resume: bool = True,
+    features_cache: Optional[str] = None,
 ) -> pd.DataFrame:
     """Make a training dataset by measuring genome features and joining
     that data with downloaded trait data
@@ -241,15 +488,35 @@ def make_training_dataset(
         output_tsv (str): path to write the training data TSV file
         processes (int): number of parallel processes (default=4)
         skip_measure_features (bool): whether to skip measuring genome features (recommended if already computed)
+        chunksize (int): number of genomes sent to a worker at once
+        timeout (float): seconds after which a genome is abandoned and saved without features
+        max_tasks_per_child (int): genomes measured by a worker before it is replaced
+        resume (bool): whether to skip genomes with a valid features file in output_features_dir
+        features_cache (str): optional .npz file caching the features loaded from output_features_dir
     Returns:
         df (pd.DataFrame): dataframe with features and targets
     """
     # Measure genome features in parallel
     if skip_measure_features is False:
-        pool_measure_genome_features(genomes_dir, suffix_fna, suffix_faa, output_features_dir, processes)
+        pool_measure_genome_features(
+            genomes_dir,
+            suffix_fna,
+            suffix_faa,
+            output_features_dir,
+            processes,
+            chunksize=chunksize,
+            timeout=timeout,
+            max_tasks_per_child=max_tasks_per_child,
+            resume=resume,
+        )
 
     # Join features with downloaded trait data
-    df = make_training_df(output_features_dir, downloaded_traits)
+    df = make_training_df(
+        output_features_dir,
+        downloaded_traits,
+        features_cache=features_cache,
+        processes=int(processes) if processes is not None else 1,
+    )
     df.to_csv(output_tsv, sep="\t")
     return df
 
@@ -289,6 +556,33 @@ def parse_args():
 
     parser.add_argument("-p", "--processes", help="Number of parallel processes (default=4)", default=4, required=False)
 
+    parser.add_argument(
+        "--chunksize", type=int, default=1, help="Number of genomes sent to a worker process at once"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Seconds after which a genome is abandoned and saved without features",
+    )
+    parser.add_argument(
+        "--max-tasks-per-child",
+        type=int,
+        default=100,
+        help="Number of genomes measured by a worker process before it is replaced, to bound its memory",
+    )
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        default=False,
+        help="Measure all genomes, including those with a valid features file in the features directory",
+    )
+    parser.add_argument(
+        "--features-cache",
+        type=str,
+        default=None,
+        help="Optional .npz file to cache features loaded from the features directory",
+    )
     parser.add_argument(
         "--skip-measure-features",
         action="store_true",
@@ -315,4 +609,9 @@ if __name__ == "__main__":
         output_tsv=args.tsv_output,
         processes=args.processes,
         skip_measure_features=args.skip_measure_features,
+        chunksize=args.chunksize,
+        timeout=args.timeout,
+        max_tasks_per_child=args.max_tasks_per_child,
+        resume=not args.no_resume,
+        features_cache=args.features_cache,
     )
@@ -10,15 +10,25 @@ specified in the `outdir` argument.
 import argparse
 import json
 import logging
+import os
+import tempfile
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    as_completed,
+)
 from datetime import datetime
+from pathlib import Path
 from typing import (
+    Dict,
     List,
+    Optional,
     Tuple,
 )
 
 import joblib
 import numpy as np
 import pandas as pd
+from sklearn.base import clone
 from sklearn.feature_selection import (
     SelectKBest,
     f_regression,
@@ -43,7 +53,7 @@ from ..helpers import (
     rename_condition_to_variable,
     split_train_and_test_data,
 )
-from .train_models import predict_and_score
+from .train_models import score_predictions
 
 
 logging.basicConfig(format="%(asctime)s %(levelname)-8s %(message)s", level=logging.INFO, datefmt="%H:%M:%S")
@@ -103,14 +113,30 @@ BASE_VARS_DERIVED_GENOME = [
 
 BASE_VARS_ALL = BASE_VARS_DERIVED_GENOME + BASE_VARS_DERIVED_PROTEIN + BASE_VARS_AAS + BASE_VARS_PIS
 
+# Scores of every model, one row per model and target
+RESULTS_TABLE = "model_selection_results.tsv"
+
+# Training data and pipelines of the condition being scored, set in each worker by `_init_worker`
+_WORKER_DATA = {}
+
 
 class ModelSelection:
     """Provides data for model and feature selection by training and scoring
     different combinations of models and features, using cross-validation at the specified rank.
     Models and features are predefined and loaded using functions of this class.
 
+    Each model is scored by fitting its pipeline once per cross-validation fold
+    and once on all training data. These fits run as separate tasks over
+    `n_jobs` processes. Pipelines cache the fitted transformers of each fold
+    (scaling and SelectKBest scores) in `cache_dir`, so pipelines sharing
+    a feature set and preprocessing compute them once. Scores of all models
+    are collected in `<outdir>/model_selection_results.tsv`.
+
     Args:
         cv_rank: str, the taxonomic rank at which to perform cross-validation
+        n_jobs: int, number of processes fitting pipelines
+        cache_dir: str, directory caching fitted transformers; a temporary
+            directory for each condition if None
 
 
     Example usage:
@@ -122,11 +148,13 @@ class ModelSelection:
         ```
     """
 
-    def __init__(self, cv_rank="family"):
+    def __init__(self, cv_rank="family", n_jobs: int = 1, cache_dir: Optional[str] = None):
         self.named_feature_sets = self.generate_named_feature_sets()
         self.feature_set_names = [tup[0] for tup in self.named_feature_sets]
 
         self.cv_rank = cv_rank
+        self.n_jobs = n_jobs
+        self.cache_dir = cache_dir
         self.conditions = CONDITIONS
 
         # features before localization
@@ -333,49 +361,94 @@ class ModelSelection:
 
         return classifiers
 
-    def score_all_models_and_feature_sets(self, df: pd.DataFrame, condition: str, path_to_holdouts: str, outdir: str):
+    def score_all_models_and_feature_sets(
+        self, df: pd.DataFrame, condition: str, path_to_holdouts: str, outdir: str, resume: bool = True
+    ):
         """Score performance all models and feature sets for a given condition. Save the performance.
 
+        Fits of each pipeline to each cross-validation fold and to all training data
+        run in parallel. When every fit of a model is done, the model and its scores
+        are saved and added to the results table.
+
         Args:
             df: pd.DataFrame, the training data
             condition: str, the condition to be predicted (e.g. 'temperature')
             path_to_holdouts: str, the path to the directory containing holdout sets
+            outdir: str, the directory to save models and results in
+            resume: bool, skip models already in the results table
         Returns:
             None
         """
+        target = rename_condition_to_variable(condition)
+        df_train, _ = split_train_and_test_data(df, condition, path_to_holdouts=path_to_holdouts)
+        cv_sets = load_cv_sets(condition, path_to_holdouts=path_to_holdouts, taxlevel=self.cv_rank)
+
+        results_table = f"{outdir}/{RESULTS_TABLE}"
+        results_df = load_results_table(results_table)
+        models = {}
+        n_scored = 0
         feature_sets = self.generate_named_feature_sets()
         for i, (set_name, features) in enumerate(feature_sets):
             pipelines = self.load_pipeline_for_condition(condition, features)
             for j, pipeline in enumerate(pipelines):
-                logging.info("Predicting %s with features %i and pipeline %i", condition, i, j)
-                target = rename_condition_to_variable(condition)
                 prefix = f"{target}_features{i}_pipeline{j}"
-                self.score_model_and_save(df, condition, features, set_name, pipeline, path_to_holdouts, outdir, prefix)
-
-    def score_model_and_save(self, df, condition, features, set_name, pipeline, path_to_holdouts, outdir, prefix):
-        """Score and save the performance of a model in cross-validation at the specified
-        taxonomic rank."""
-        df_train, _ = split_train_and_test_data(df, condition, path_to_holdouts=path_to_holdouts)
-        cv_sets = load_cv_sets(condition, path_to_holdouts=path_to_holdouts, taxlevel=self.cv_rank)
-        target = rename_condition_to_variable(condition)
-
-        cv_score = predict_and_score(
-            X_train=df_train[features],
-            y_train=df_train[target],
-            condition=condition,
-            cv_sets=cv_sets,
-            pipeline=pipeline,
-        )
-        results = self.save_performance(
-            pipeline=pipeline,
-            feature_set=set_name,
-            features=features,
-            target=target,
-            prefix=prefix,
-            outdir=outdir,
-            validation_statistics=cv_score,
-        )
-        return cv_score
+                if resume and prefix in results_df.index:
+                    n_scored += 1
+                    continue
+                models[prefix] = (set_name, features, pipeline)
+        logging.info("Scoring %i models for %s, %i already scored", len(models), condition, n_scored)
+        if not models:
+            return
+
+        all_features = list(dict.fromkeys(feature for _, features, _ in models.values() for feature in features))
+        folds = list(range(len(cv_sets))) + [None]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            data = {
+                "X": df_train[all_features],
+                "y": df_train[target],
+                "cv_sets": cv_sets,
+                "models": {prefix: (features, pipeline) for prefix, (_, features, pipeline) in models.items()},
+                "method": "predict_proba" if condition == "oxygen" else "predict",
+                "cache_dir": self.cache_dir if self.cache_dir is not None else tmp_dir,
+            }
+            # fits of one pipeline are adjacent so the next pipeline finds its transformers cached
+            tasks = [(prefix, fold) for prefix in models for fold in folds]
+            fits = {prefix: {} for prefix in models}
+            for prefix, fold, result in self._run_fits(tasks, data):
+                fits[prefix][fold] = result
+                if len(fits[prefix]) < len(folds):
+                    continue
+                set_name, features, _ = models[prefix]
+                model_fits = fits.pop(prefix)
+                pipeline = model_fits.pop(None)
+                cv_score = score_cv_predictions(condition, data["y"], cv_sets, model_fits)
+                results = self.save_performance(
+                    pipeline=pipeline,
+                    feature_set=set_name,
+                    features=features,
+                    target=target,
+                    prefix=prefix,
+                    outdir=outdir,
+                    validation_statistics=cv_score,
+                )
+                results_df = add_results_to_table(results_df, results)
+                save_results_table(results_df, results_table)
+                logging.info("Scored %s (%i/%i models)", prefix, len(models) - len(fits), len(models))
+
+    def _run_fits(self, tasks: list, data: dict):
+        """Yields (prefix, fold, result) of each fit task as it completes"""
+        if self.n_jobs <= 1:
+            _init_worker(data)
+            try:
+                for task in tasks:
+                    yield _fit_fold(task)
+            finally:
+                _WORKER_DATA.clear()
+            return
+        with ProcessPoolExecutor(self.n_jobs, initializer=_init_worker, initargs=(data,)) as executor:
+            futures = [executor.submit(_fit_fold, task) for task in tasks]
+            for future in as_completed(futures):
+                yield future.result()
 
     def save_performance(self, pipeline, target, feature_set, features, outdir, prefix, validation_statistics={}):
         """Save the model performance to a file and save the model to a file."""
@@ -401,7 +474,76 @@ class ModelSelection:
         return results
 
 
-def run_model_selection(training_data_filename: str, path_to_holdouts: str, outdir: str):
+def _init_worker(data: dict):
+    _WORKER_DATA.clear()
+    _WORKER_DATA.update(data)
+
+
+def _fit_fold(task: Tuple[str, Optional[int]]):
+    """Fits a model to the training genomes of a fold and predicts its validation genomes.
+
+    A fold of None fits the model to all genomes and returns the fitted pipeline.
+    """
+    prefix, fold = task
+    features, pipeline = _WORKER_DATA["models"][prefix]
+    X = _WORKER_DATA["X"][features]
+    y = _WORKER_DATA["y"]
+    pipeline = clone(pipeline).set_params(memory=_WORKER_DATA["cache_dir"])
+    if fold is None:
+        pipeline.fit(X, y)
+        # saved models should not refer to the cache
+        return prefix, fold, pipeline.set_params(memory=None)
+    training_indices, validation_indices = _WORKER_DATA["cv_sets"][fold]
+    pipeline.fit(X.iloc[training_indices], y.iloc[training_indices])
+    y_valid_pred = getattr(pipeline, _WORKER_DATA["method"])(X.iloc[validation_indices])
+    return prefix, fold, y_valid_pred
+
+
+def score_cv_predictions(
+    condition: str,
+    y_train: pd.Series,
+    cv_sets: List[Tuple[np.ndarray, np.ndarray]],
+    fold_predictions: Dict[int, np.ndarray],
+) -> dict:
+    """Scores the predictions of validation genomes over all folds, like `predict_and_score`"""
+    first_fold = fold_predictions[0]
+    y_valid_pred = np.empty((len(y_train),) + first_fold.shape[1:], dtype=first_fold.dtype)
+    for fold, (_, validation_indices) in enumerate(cv_sets):
+        y_valid_pred[validation_indices] = fold_predictions[fold]
+    return score_predictions(condition, y_train, y_valid_pred)
+
+
+def load_results_table(results_table: str) -> pd.DataFrame:
+    """Loads the table of model scores indexed by prefix, or an empty table"""
+    if not Path(results_table).exists():
+        return pd.DataFrame(index=pd.Index([], name="prefix"))
+    return pd.read_csv(results_table, sep="\t", index_col="prefix")
+
+
+def add_results_to_table(results_df: pd.DataFrame, results: dict) -> pd.DataFrame:
+    """Adds or replaces the row of a model, with one column per score"""
+    row = {key: value for key, value in results.items() if key not in ["prefix", "features", "performance"]}
+    row.update({key: float(value) for key, value in results["performance"].items()})
+    row["n_features"] = len(results["features"])
+    row_df = pd.DataFrame([row], index=pd.Index([results["prefix"]], name="prefix"))
+    return pd.concat([results_df.drop(index=results["prefix"], errors="ignore"), row_df])
+
+
+def save_results_table(results_df: pd.DataFrame, results_table: str):
+    """Writes the table of model scores, replacing the previous table at once"""
+    tmp_table = f"{results_table}.tmp"
+    results_df.to_csv(tmp_table, sep="\t")
+    os.replace(tmp_table, results_table)
+
+
+def run_model_selection(
+    training_data_filename: str,
+    path_to_holdouts: str,
+    outdir: str,
+    n_jobs: int = 1,
+    cache_dir: Optional[str] = None,
+    resume: bool = True,
+):
     """Measure performance of different model and features on the training dataset
     to provide data for selecting a model and features for each target variable.
 
@@ -409,13 +551,16 @@ def run_model_selection(training_data_filename: str, path_to_holdouts: str, outd
         training_data_filename: str, path to training data TSV file
         path_to_holdouts: str, path to directory to save holdout sets
         outdir: str, path to directory to save model selection results
+        n_jobs: int, number of processes fitting pipelines
+        cache_dir: str, directory caching fitted transformers between runs
+        resume: bool, skip models already in the results table
     """
     logging.info("Loading training data from %s", training_data_filename)
     df = pd.read_csv(training_data_filename, index_col=0, sep="\t")
-    selection = ModelSelection()
+    selection = ModelSelection(n_jobs=n_jobs, cache_dir=cache_dir)
     for condition in CONDITIONS:
         logging.info("Scoring models and features for %s", condition)
-        selection.score_all_models_and_feature_sets(df, condition, path_to_holdouts, outdir)
+        selection.score_all_models_and_feature_sets(df, condition, path_to_holdouts, outdir, resume=resume)
 
 
 def parse_args():
@@ -437,6 +582,24 @@ def parse_args():
         help="Path to directory to save holdout sets",
     )
     parser.add_argument("-o", "--outdir", required=True, help="Output directory")
+    parser.add_argument(
+        "--n_jobs",
+        type=int,
+        default=1,
+        help="Number of processes fitting pipelines",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=None,
+        help="Directory to cache scaled features and SelectKBest scores of each fold, kept between runs",
+    )
+    parser.add_argument(
+        "--no_resume",
+        action="store_true",
+        default=False,
+        help="Score all models again instead of skipping models in model_selection_results.tsv",
+    )
 
     args = parser.parse_args()
 
@@ -451,4 +614,7 @@ if __name__ == "__main__":
         training_data_filename=args.training_data_filename,
         path_to_holdouts=args.path_to_holdouts,
         outdir=args.outdir,
+        n_jobs=args.n_jobs,
+        cache_dir=args.cache_dir,
+        resume=not args.no_resume,
     )
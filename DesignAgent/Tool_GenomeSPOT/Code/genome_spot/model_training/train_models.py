@@ -3,11 +3,17 @@
 import argparse
 import json
 import logging
-from typing import Tuple
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
 
 import joblib
 import numpy as np
 import pandas as pd
+from sklearn.base import clone
 from sklearn.metrics import (
     confusion_matrix,
     f1_score,
@@ -21,7 +27,6 @@ from sklearn.svm import OneClassSVM
 from ..helpers import (
     load_train_and_test_sets,
     load_training_data,
-    rename_condition_to_variable,
 )
 from .make_holdout_sets import (
     make_cv_sets_by_phylogeny,
@@ -32,6 +37,13 @@ from .make_holdout_sets import (
 logging.basicConfig(level=logging.INFO, datefmt="%Y-%m-%d %H:%M:%S", format="%(asctime)s %(levelname)s %(message)s")
 rng = np.random.default_rng(0)
 
+# Width of the window of predicted values the error of a prediction is measured over
+ERROR_INTERVALS = {
+    "ph": 1,
+    "salinity": 2,
+    "temperature": 10,
+}
+
 
 def load_instructions(instructions_filename: str) -> dict:
     """Loads and validates a dictionary with
@@ -106,7 +118,13 @@ def train_novelty_detection_model(
 
 
 def train_error_model(
-    pipeline: Pipeline, df_train: pd.DataFrame, features: list, target: str, path_to_models: str, save: bool = True
+    pipeline: Pipeline,
+    df_train: pd.DataFrame,
+    features: list,
+    target: str,
+    path_to_models: str,
+    save: bool = True,
+    bins_per_interval: Optional[int] = None,
 ) -> np.ndarray:
     """Creates an 'error model' which is the RMSE for each value
     predicted by model in cross-validation within a given interval.
@@ -118,20 +136,21 @@ def train_error_model(
     classifier. The model is later used by finding the RMSE of the cross-
     validation prediction closest to the prediction of interest.
 
+    With `bins_per_interval`, the model has one row per bin of predicted
+    values (see `binned_rmse_by_value`), with bins that many times narrower
+    than the interval, instead of one row per training genome. It is smaller
+    to store and faster to look up.
+
     Args:
         pipeline (Pipeline): pipeline to fit
         df_train (pd.DataFrame): training data
         features (list): list of features to use
         target (str): name of target variable
         save (bool): whether to save the model
+        bins_per_interval (int): number of bins per interval, or None for one row per genome
     Returns:
         error_model (np.ndarray): array of predicted values (col 1) and RMSE (col 2)
     """
-    interval_dict = {
-        "ph": 1,
-        "salinity": 2,
-        "temperature": 10,
-    }
     condition = target.split("_")[0]
     X_train = df_train[features].values
     y_train = df_train[target]
@@ -144,16 +163,30 @@ def train_error_model(
         _, _, y_valid_pred = predict_training_and_cv(
             X_train, y_train, pipeline, cv=yield_cv_sets(cv_sets), method=method
         )
-        error_model = rmse_by_value(y_train, y_valid_pred, interval=interval_dict[condition])
+        error_model = error_model_from_predictions(y_train, y_valid_pred, target, bins_per_interval)
         if save is True:
             joblib.dump(error_model, f"{path_to_models}/error_{target}.joblib")
         return error_model
 
 
+def error_model_from_predictions(
+    y_true: np.ndarray, y_valid_pred: np.ndarray, target: str, bins_per_interval: Optional[int] = None
+) -> np.ndarray:
+    """Creates the error model of `train_error_model` from values predicted in cross-validation"""
+    interval = ERROR_INTERVALS[target.split("_")[0]]
+    if bins_per_interval is None:
+        return rmse_by_value(y_true, y_valid_pred, interval=interval)
+    return binned_rmse_by_value(y_true, y_valid_pred, interval=interval, bin_width=interval / bins_per_interval)
+
+
 def rmse_by_value(y_true: np.ndarray, y_pred: np.ndarray, interval: float) -> np.ndarray:
     """Returns an array where col 1 is the value and col 2
     is the RMSE of values predicted to be y +/- interval
 
+    Predictions are sorted once, and the squared errors of each window are
+    taken from prefix sums, so the cost is O(n log n) instead of a mask of all
+    predictions for each prediction.
+
     Args:
         y_true (np.ndarray): true values
         y_pred (np.ndarray): predicted values
@@ -161,16 +194,61 @@ def rmse_by_value(y_true: np.ndarray, y_pred: np.ndarray, interval: float) -> np
     Returns:
         error_arr (np.ndarray): array of predicted values (col 1) and RMSE (col 2)
     """
-    rmse_arr = np.empty(y_true.shape)
-    for i, y in enumerate(y_pred):
-        mask = (y_pred > (y - interval / 2)) & (y_pred < (y + interval / 2))
-        rmse = np.sqrt(mean_squared_error(y_true[mask], y_pred[mask]))
-        rmse_arr[i] = rmse
-
+    y_pred = np.asarray(y_pred, dtype=float)
+    rmse_arr = windowed_rmse(y_true, y_pred, centers=y_pred, interval=interval)
     error_arr = np.stack([y_pred, rmse_arr], axis=1)
     return error_arr
 
 
+def binned_rmse_by_value(y_true: np.ndarray, y_pred: np.ndarray, interval: float, bin_width: float) -> np.ndarray:
+    """Compact form of `rmse_by_value` with one row per bin of predicted values
+
+    Rows are evenly spaced values from the lowest to the highest prediction,
+    `bin_width` apart, with the RMSE of values predicted to be within
+    +/- interval / 2 of each. Bins without predictions in their window are
+    dropped. The array has the same columns as `rmse_by_value`, so it is looked up
+    the same way, but its size depends on the range of predictions instead of
+    the number of training genomes.
+
+    Args:
+        y_true (np.ndarray): true values
+        y_pred (np.ndarray): predicted values
+        interval (float): interval to compute RMSE overall
+        bin_width (float): spacing of the values of the rows
+    Returns:
+        error_arr (np.ndarray): array of binned values (col 1) and RMSE (col 2)
+    """
+    y_pred = np.asarray(y_pred, dtype=float)
+    n_bins = int(np.ceil((y_pred.max() - y_pred.min()) / bin_width)) + 1
+    centers = y_pred.min() + bin_width * np.arange(n_bins)
+    rmse_arr = windowed_rmse(y_true, y_pred, centers=centers, interval=interval)
+    is_filled = ~np.isnan(rmse_arr)
+    error_arr = np.stack([centers[is_filled], rmse_arr[is_filled]], axis=1)
+    return error_arr
+
+
+def windowed_rmse(y_true: np.ndarray, y_pred: np.ndarray, centers: np.ndarray, interval: float) -> np.ndarray:
+    """Returns the RMSE of predictions strictly within +/- interval / 2 of each center,
+    or NaN where the window is empty"""
+    y_true = np.asarray(y_true, dtype=float)
+    y_pred = np.asarray(y_pred, dtype=float)
+    centers = np.asarray(centers, dtype=float)
+    order = np.argsort(y_pred, kind="stable")
+    sorted_pred = y_pred[order]
+    # extended precision keeps differences of large prefix sums accurate
+    squared_errors = (y_true[order] - sorted_pred).astype(np.longdouble) ** 2
+    cumulative_errors = np.concatenate([np.zeros(1, dtype=np.longdouble), np.cumsum(squared_errors)])
+    # same bounds as the mask (y_pred > center - interval / 2) & (y_pred < center + interval / 2)
+    start = np.searchsorted(sorted_pred, centers - interval / 2, side="right")
+    stop = np.searchsorted(sorted_pred, centers + interval / 2, side="left")
+    n_in_window = np.maximum(stop - start, 0)
+    rmse_arr = np.full(len(centers), np.nan)
+    has_values = n_in_window > 0
+    sums = cumulative_errors[stop[has_values]] - cumulative_errors[start[has_values]]
+    rmse_arr[has_values] = np.sqrt((sums / n_in_window[has_values]).astype(float))
+    return rmse_arr
+
+
 def predict_training_and_cv(
     X_train, y_train, pipeline, cv, method="predict"
 ) -> Tuple[Pipeline, np.ndarray, np.ndarray]:
@@ -197,23 +275,76 @@ def predict_training_and_cv(
     return pipeline, y_train_pred, y_valid_pred
 
 
-def predict_and_score(condition, X_train, y_train, cv_sets, pipeline):
-    """Predict and score the performance of a pipeline on a given condition."""
-    if condition in ["temperature", "salinity", "ph"]:
-        pipeline, y_train_pred, y_valid_pred = predict_training_and_cv(
-            X_train, y_train, pipeline=pipeline, cv=yield_cv_sets(cv_sets), method="predict"
-        )
-        validation_statistics = score_regression(y_train, y_valid_pred)
-    elif condition == "oxygen":
-        pipe, y_train_pred_probs, y_valid_pred_probs = predict_training_and_cv(
+def fit_with_cv(
+    pipelines: Dict[str, Pipeline],
+    X_train: np.ndarray,
+    y_train: pd.DataFrame,
+    cv_sets: List[Tuple[np.ndarray, np.ndarray]],
+    method: str = "predict",
+    n_jobs: int = 1,
+) -> Tuple[Dict[str, Pipeline], Dict[str, np.ndarray]]:
+    """Fits pipelines for several targets to all data and to each fold, all in parallel
+
+    Equivalent to `predict_training_and_cv` for each target, but the fits of
+    every target and fold are spread over `n_jobs` processes together.
+
+    Args:
+        pipelines (dict): pipeline to fit for each target
+        X_train (np.ndarray): training data
+        y_train (pd.DataFrame): training labels with a column per target
+        cv_sets (list): list of (training indices, validation indices) for each fold
+        method (str): 'predict' or 'predict_proba'
+        n_jobs (int): number of processes fitting pipelines
+    Returns:
+        - fitted_pipelines: pipeline of each target fit to all data
+        - y_valid_preds: values of each target predicted in cross-validation
+            by models not trained on those values
+    """
+    tasks = [(target, fold) for target in pipelines for fold in [None, *range(len(cv_sets))]]
+    results = joblib.Parallel(n_jobs=n_jobs)(
+        joblib.delayed(_fit_and_predict)(
+            clone(pipelines[target]),
             X_train,
-            y_train,
-            pipeline=pipeline,
-            cv=yield_cv_sets(cv_sets),
-            method="predict_proba",
+            y_train[target].values,
+            *(cv_sets[fold] if fold is not None else (None, None)),
+            method=method,
         )
-        validation_statistics = score_classification(y_train.values, y_valid_pred_probs[:, 1])
-    return validation_statistics
+        for target, fold in tasks
+    )
+    fitted_pipelines = {}
+    y_valid_preds = {}
+    for (target, fold), result in zip(tasks, results):
+        if fold is None:
+            fitted_pipelines[target] = result
+            continue
+        if target not in y_valid_preds:
+            y_valid_preds[target] = np.empty((len(X_train),) + result.shape[1:], dtype=result.dtype)
+        y_valid_preds[target][cv_sets[fold][1]] = result
+    return fitted_pipelines, y_valid_preds
+
+
+def _fit_and_predict(pipeline, X_train, y_train, training_indices, validation_indices, method):
+    """Fits a pipeline to all data if no fold is given, otherwise predicts the validation set of the fold"""
+    if training_indices is None:
+        return pipeline.fit(X_train, y_train)
+    pipeline.fit(X_train[training_indices], y_train[training_indices])
+    return getattr(pipeline, method)(X_train[validation_indices])
+
+
+def predict_and_score(condition, X_train, y_train, cv_sets, pipeline):
+    """Predict and score the performance of a pipeline on a given condition."""
+    method = "predict_proba" if condition == "oxygen" else "predict"
+    pipeline, y_train_pred, y_valid_pred = predict_training_and_cv(
+        X_train, y_train, pipeline=pipeline, cv=yield_cv_sets(cv_sets), method=method
+    )
+    return score_predictions(condition, y_train, y_valid_pred)
+
+
+def score_predictions(condition: str, y_true, y_valid_pred) -> dict:
+    """Scores values predicted in cross-validation, by regression or by probability for oxygen"""
+    if condition == "oxygen":
+        return score_classification(np.asarray(y_true), y_valid_pred[:, 1])
+    return score_regression(y_true, y_valid_pred)
 
 
 def score_regression(y_true, y_pred) -> dict:
@@ -285,6 +416,8 @@ def train_model_for_each_condition(
     instructions: dict,
     path_to_models: str,
     path_to_holdouts: str,
+    error_bins_per_interval: Optional[int] = None,
+    n_jobs: int = 1,
 ):
     """Trains models for each condition
 
@@ -293,6 +426,11 @@ def train_model_for_each_condition(
     - Novelty detection model (2% of training data considered novel)
     - Error model (for regression only)
 
+    Cross-validation sets are made once per condition. The fits of the
+    models for every target of the condition (optimum, min and max) to all data
+    and to each fold run in parallel, and the values predicted in
+    cross-validation are used both to score the models and for the error models.
+
     Models are saved under the path_to_models directory.
 
     Args:
@@ -301,13 +439,14 @@ def train_model_for_each_condition(
         instructions (dict): dictionary with instructions for each model
         path_to_models (str): path to models directory
         path_to_holdouts (str): path to directory with train and test sets for each condition
+        error_bins_per_interval (int): bins per interval of binned error models, or None for one row per genome
+        n_jobs (int): number of processes fitting models
     Returns:
         None
     """
     logging.info("Loading data for %s", condition)
     pipeline_filename = instructions[condition]["pipeline_filename"]
     features = instructions[condition]["features"]
-    target = rename_condition_to_variable(condition)
     condition_df = df[df[f"use_{condition}"] == True]
     logging.info("%s data available for %s genomes", condition, len(condition_df))
 
@@ -316,39 +455,55 @@ def train_model_for_each_condition(
     training_df = condition_df.loc[list(balanced_genomes)]
     logging.info("%s data available for %s genomes in train and test sets", condition, len(training_df))
 
-    if condition in ["temperature", "ph", "salinity"]:
-        for attr in ["optimum", "min", "max"]:
-            logging.info("Training model for %s", target)
-            target = f"{condition}_{attr}"
-            pipeline = joblib.load(pipeline_filename)
-            pipeline = train_model(pipeline, training_df, features, target, path_to_models=path_to_models, save=True)
-            logging.info("Training model for %s novelty", target)
-            novelty_model = train_novelty_detection_model(
-                training_df, features, target, nu=0.02, path_to_models=path_to_models, save=True
-            )
-            logging.info("Training model for %s error", target)
-            error_model = train_error_model(
-                pipeline, training_df, features, target, path_to_models=path_to_models, save=True
-            )
-    elif condition == "oxygen":
-        logging.info("Training model for %s", target)
-        target = condition
+    if condition == "oxygen":
+        targets = [condition]
+        method = "predict_proba"
+    else:
+        targets = [f"{condition}_{attr}" for attr in ["optimum", "min", "max"]]
+        method = "predict"
+
+    logging.info("Making cross-validation sets for %s", condition)
+    cv_sets = make_cv_sets_by_phylogeny(genomes=training_df.index.tolist(), partition_rank="family", kfold=5)
+    pipelines = {}
+    for target in targets:
         pipeline = joblib.load(pipeline_filename)
-        pipeline = train_model(pipeline, training_df, features, target, path_to_models=path_to_models, save=True)
-        logging.info("Training model for %s novelty", target)
-        novelty_model = train_novelty_detection_model(
-            training_df, features, target, nu=0.02, path_to_models=path_to_models, save=True
-        )
-        logging.info("Training model for %s error", target)
-        error_model = train_error_model(
-            pipeline, training_df, features, target, path_to_models=path_to_models, save=True
+        pipeline[-1].max_iter = 50000  # spare no expense!
+        pipelines[target] = pipeline
+    logging.info("Training models for %s", ", ".join(targets))
+    fitted_pipelines, y_valid_preds = fit_with_cv(
+        pipelines, training_df[features].values, training_df[targets], cv_sets, method=method, n_jobs=n_jobs
+    )
+
+    for target in targets:
+        y_train = training_df[target]
+        validation_statistics = score_predictions(condition, y_train, y_valid_preds[target])
+        logging.info(
+            "Cross-validation of %s: %s",
+            target,
+            ", ".join(f"{name}={value:.3f}" for name, value in validation_statistics.items()),
         )
+        joblib.dump(fitted_pipelines[target], f"{path_to_models}/{target}.joblib")
+        save_data(target, features, genome_accessions=training_df.index.tolist(), path_to_models=path_to_models)
+        if condition != "oxygen":
+            logging.info("Training model for %s error", target)
+            error_model = error_model_from_predictions(
+                y_train, y_valid_preds[target], target, bins_per_interval=error_bins_per_interval
+            )
+            joblib.dump(error_model, f"{path_to_models}/error_{target}.joblib")
+
+    # the novelty model depends only on the features, shared by every target of the condition
+    logging.info("Training model for %s novelty", condition)
+    novelty_model = train_novelty_detection_model(
+        training_df, features, targets[0], nu=0.02, path_to_models=path_to_models, save=True
+    )
 
 
 def train_models(
     training_data_filename: str,
     path_to_models: str,
     path_to_holdouts: str,
+    error_bins_per_interval: Optional[int] = None,
+    n_jobs: int = 1,
 ):
     """Main function to train and save models for each condition
 
@@ -356,6 +511,8 @@ def train_models(
         training_data_filename (str): path to training data
         path_to_models (str): path to models directory
         path_to_holdouts (str): path to directory with train and test sets for each condition
+        error_bins_per_interval (int): bins per interval of binned error models, or None for one row per genome
+        n_jobs (int): number of processes fitting models
     Returns:
         None
     """
@@ -364,7 +521,13 @@ def train_models(
     logging.info("Training models for conditions: %s", ", ".join(instructions.keys()))
     for condition in instructions.keys():
         train_model_for_each_condition(
-            condition, df, instructions, path_to_models=path_to_models, path_to_holdouts=path_to_holdouts
+            condition,
+            df,
+            instructions,
+            path_to_models=path_to_models,
+            path_to_holdouts=path_to_holdouts,
+            error_bins_per_interval=error_bins_per_interval,
+            n_jobs=n_jobs,
         )
 
 
@@ -391,6 +554,18 @@ def parse_args():
         required=True,
         help="Path to directory with train and test sets for each condition",
     )
+    parser.add_argument(
+        "--error_bins_per_interval",
+        type=int,
+        default=None,
+        help="Save error models with this many bins of predicted values per interval instead of one row per genome",
+    )
+    parser.add_argument(
+        "--n_jobs",
+        type=int,
+        default=1,
+        help="Number of processes fitting models",
+    )
     args = parser.parse_args()
     return args
 
@@ -401,4 +576,6 @@ if __name__ == "__main__":
         training_data_filename=args.training_data_filename,
         path_to_models=args.path_to_models,
         path_to_holdouts=args.path_to_holdouts,
+        error_bins_per_interval=args.error_bins_per_interval,
+        n_jobs=args.n_jobs,
     )
@@ -0,0 +1,184 @@
+"""
+Columnar store of predictions and genome features for many genomes.
+
+Instead of one `<prefix>.predictions.tsv` and `<prefix>.features.json` per
+genome, a store is a directory of Parquet files with one row per genome
+and a `genome` column:
+
+```
+<store>/predictions/part-<time>-<pid>.parquet
+<store>/features/part-<time>-<pid>.parquet
+```
+
+Prediction columns are named `<target>.<variable>` (e.g. `ph_optimum.value`,
+`ph_optimum.error`); feature columns are named `<localization>_<feature>`
+like the model inputs. Writers buffer genomes and add a new part file per
+flush, so parallel writers never touch the same file. Readers concatenate
+the parts, keeping the latest row when a genome was written more than once.
+Parquet support requires `pyarrow`.
+
+Example usage:
+
+```python
+with PredictionStoreWriter("all_genomes.store") as store:
+    for genome_id, (predictions, genome_features) in results.items():
+        store.add(genome_id, predictions, genome_features)
+predictions_df = read_predictions("all_genomes.store")
+```
+"""
+
+import os
+import time
+from pathlib import Path
+from typing import (
+    Dict,
+    List,
+    Optional,
+)
+
+import pandas as pd
+
+
+PREDICTIONS = "predictions"
+FEATURES = "features"
+PREDICTION_VARIABLES = ["value", "error", "units", "is_novel", "warning"]
+FLUSH_EVERY = 1000
+
+
+def predictions_to_row(genome_id: str, predictions: Dict[str, dict]) -> dict:
+    """Flattens the predictions of one genome to `<target>.<variable>` columns"""
+    row = {"genome": genome_id}
+    for target, values in sorted(predictions.items()):
+        for variable in PREDICTION_VARIABLES:
+            row[f"{target}.{variable}"] = values.get(variable)
+    return row
+
+
+def genome_features_to_row(genome_id: str, genome_features: Dict[str, dict]) -> dict:
+    """Flattens the features of one genome to `<localization>_<feature>` columns"""
+    row = {"genome": genome_id}
+    for localization, feat_dict in sorted(genome_features.items()):
+        for feat, value in sorted(feat_dict.items()):
+            row[f"{localization}_{feat}"] = value
+    return row
+
+
+def _normalize_prediction_types(df: pd.DataFrame) -> pd.DataFrame:
+    """Gives every prediction column one consistent type, as Parquet requires"""
+    df = df.copy()
+    for column in df.columns:
+        variable = column.rsplit(".", 1)[-1]
+        if column == "genome" or variable in ["units", "warning"]:
+            df[column] = df[column].astype("string")
+        elif variable == "is_novel":
+            df[column] = df[column].astype("boolean")
+        elif variable == "value":
+            numeric = pd.to_numeric(df[column], errors="coerce")
+            # classifications such as oxygen tolerance are labels
+            is_label = df[column].notna() & numeric.isna()
+            df[column] = df[column].astype("string") if is_label.any() else numeric.astype(float)
+        else:
+            df[column] = pd.to_numeric(df[column], errors="coerce").astype(float)
+    return df
+
+
+class PredictionStoreWriter:
+    """Appends predictions and features of genomes to a columnar store
+
+    Args:
+        store: Directory of the store, created if needed
+        flush_every: Number of genomes buffered before a part file is written
+    """
+
+    def __init__(self, store: str, flush_every: int = FLUSH_EVERY):
+        self.store = Path(store)
+        self.flush_every = flush_every
+        self._prediction_rows = []
+        self._feature_rows = []
+        for table in [PREDICTIONS, FEATURES]:
+            (self.store / table).mkdir(parents=True, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(
+        self,
+        genome_id: str,
+        predictions: Optional[Dict[str, dict]] = None,
+        genome_features: Optional[Dict[str, dict]] = None,
+    ):
+        """Buffers the predictions and/or features of one genome"""
+        if predictions:
+            self._prediction_rows.append(predictions_to_row(genome_id, predictions))
+        if genome_features:
+            self._feature_rows.append(genome_features_to_row(genome_id, genome_features))
+        if max(len(self._prediction_rows), len(self._feature_rows)) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Writes buffered genomes to new part files"""
+        part_name = f"part-{time.time_ns():020d}-{os.getpid()}.parquet"
+        if self._prediction_rows:
+            predictions_df = _normalize_prediction_types(pd.DataFrame(self._prediction_rows))
+            self._write(predictions_df, self.store / PREDICTIONS / part_name)
+            self._prediction_rows = []
+        if self._feature_rows:
+            features_df = pd.DataFrame(self._feature_rows)
+            self._write(features_df.astype({"genome": "string"}), self.store / FEATURES / part_name)
+            self._feature_rows = []
+
+    def close(self):
+        self.flush()
+
+    @staticmethod
+    def _write(df: pd.DataFrame, path: Path):
+        # write then rename so readers never see a partial part
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+
+def _read_table(store: str, table: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Concatenates the parts of a table, keeping the latest row of each genome"""
+    parts = sorted((Path(store) / table).glob("part-*.parquet"))
+    if not parts:
+        return pd.DataFrame(columns=["genome"]).set_index("genome")
+    if columns is not None:
+        columns = ["genome"] + [column for column in columns if column != "genome"]
+    dfs = [pd.read_parquet(part, columns=columns) for part in parts]
+    df = pd.concat(dfs, ignore_index=True) if len(dfs) > 1 else dfs[0]
+    return df.drop_duplicates(subset="genome", keep="last").set_index("genome")
+
+
+def read_predictions(store: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Returns predictions indexed by genome, with `<target>.<variable>` columns"""
+    return _read_table(store, PREDICTIONS, columns)
+
+
+def read_features(store: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Returns genome features indexed by genome, with `<localization>_<feature>` columns"""
+    return _read_table(store, FEATURES, columns)
+
+
+def compact_store(store: str):
+    """Merges all part files of each table into one"""
+    for table, read in [(PREDICTIONS, read_predictions), (FEATURES, read_features)]:
+        parts = sorted((Path(store) / table).glob("part-*.parquet"))
+        if len(parts) <= 1:
+            continue
+        df = read(store).reset_index()
+        if table == PREDICTIONS:
+            df = _normalize_prediction_types(df)
+        PredictionStoreWriter._write(df, Path(store) / table / f"part-{time.time_ns():020d}-{os.getpid()}.parquet")
+        for part in parts:
+            part.unlink()
+
+
+def predictions_by_target(predictions_df: pd.DataFrame) -> pd.DataFrame:
+    """Splits `<target>.<variable>` columns into a (target, variable) MultiIndex"""
+    df = predictions_df.copy()
+    df.columns = pd.MultiIndex.from_tuples([tuple(column.rsplit(".", 1)) for column in df.columns])
+    return df
@@ -55,37 +55,28 @@ class BalanceTaxa:
             proportion_to_keep: the fraction of genomes to keep.
             diversity_rank: what rank to use to measure diversity
         """
-        balanced_genomes = set()
-
-        # Ratio of obversed counts in data to expectation based on reference
-        obs_exp_ratio_by_rank = {}
-        for rank, i in self.taxonomy.indices.items():
-            obs_exp_ratio_by_rank[i] = {}
-            n_expected = self.taxonomy.measure_diversity(rank, diversity_rank)
-            n_observed = self.taxonomy.measure_diversity(rank, diversity_rank, subset_genomes=genomes)
-            for taxon, n_obs in n_observed.items():
-                obs_exp_ratio = n_obs / n_expected[taxon]
-                if rank == "phylum":
-                    # hacky correction to keep phyla with few isolates but also few genomes
-                    _reweight_rare_phyla = lambda n: (n / 500) ** 4
-                    obs_exp_ratio = min([obs_exp_ratio, _reweight_rare_phyla(n_obs)])
-                obs_exp_ratio_by_rank[i][taxon] = obs_exp_ratio
+        rows = self.taxonomy.rows_of_genomes(genomes)
+        found = rows >= 0
+        rows = rows[found]
 
         # Probability of selection - should be inversely proportional
-        # to degree of enrichment in observations
-        probabilities = []
-        for genome in genomes:
-            taxonomy = self.taxonomy.taxonomy_dict.get(genome)
-            if taxonomy:
-                # Multiply the observation frequency over all taxonomy ranks
-                obs_exp_ratio = 1.0
-                for i, taxon in enumerate(taxonomy):
-                    obs_exp_ratio = obs_exp_ratio * obs_exp_ratio_by_rank[i][taxon]
-            else:
-                # Not present in GTDB and should be removed
-                obs_exp_ratio = 1.0
-            p = 1 / obs_exp_ratio
-            probabilities.append(p)
+        # to degree of enrichment in observations. Genomes not present
+        # in GTDB have a ratio of 1.
+        obs_exp_ratios = np.ones(len(genomes))
+        ratios_found = np.ones(len(rows))
+        for rank, i in self.taxonomy.indices.items():
+            # Ratio of obversed counts in data to expectation based on reference
+            n_expected = self.taxonomy.diversity_counts(rank, diversity_rank)
+            n_observed = self.taxonomy.diversity_counts(rank, diversity_rank, rows=rows)
+            codes = self.taxonomy.rank_codes[rows, i]
+            obs_exp_ratio = n_observed[codes] / n_expected[codes]
+            if rank == "phylum":
+                # hacky correction to keep phyla with few isolates but also few genomes
+                obs_exp_ratio = np.minimum(obs_exp_ratio, (n_observed[codes] / 500) ** 4)
+            # Multiply the observation frequency over all taxonomy ranks
+            ratios_found = ratios_found * obs_exp_ratio
+        obs_exp_ratios[found] = ratios_found
+        probabilities = 1 / obs_exp_ratios
 
         # Use probability to select a certain number of genomes
         n_selections = int(proportion_to_keep * len(genomes))
@@ -1,7 +1,5 @@
 """PartitionTax partitions a dataset using taxonomy"""
 
-from collections import defaultdict
-
 import numpy as np
 
 from .taxonomy import TaxonomyGTDB
@@ -49,28 +47,31 @@ class PartitionTaxa:
         self.taxonomy = taxonomy
 
     def partition(self, genomes, partition_size: float) -> set:
-        partitioned_genomes = []
-
-        # Get taxa
-        taxa = list(self.taxonomy.taxa_of_genomes(genomes, self.partition_rank))
-        taxon_to_genomes = defaultdict(list)
-        taxlevel_idx = self.taxonomy.indices[self.partition_rank]
-        for genome in genomes:
-            genome_taxonomy = self.taxonomy.taxonomy_dict.get(genome, None)
-            if genome_taxonomy is not None:
-                taxon_to_genomes[genome_taxonomy[taxlevel_idx]].append(genome)
+        genomes = list(genomes)
+        rows = self.taxonomy.rows_of_genomes(genomes)
+        found = rows >= 0
+        if not found.any():
+            return set()
+
+        # Get taxa, in order of name
+        index = self.taxonomy.indices[self.partition_rank]
+        genome_codes = self.taxonomy.rank_codes[rows[found], index]
+        codes, n_genomes = np.unique(genome_codes, return_counts=True)
+        by_name = np.argsort(self.taxonomy.rank_names[index][codes])
+        codes, n_genomes = codes[by_name], n_genomes[by_name]
 
         # Create random order of taxa at partition_rank
         rng = np.random.default_rng(seed=12345)
-        random_order = rng.choice(taxa, size=len(taxa), replace=False)
+        random_order = rng.choice(len(codes), size=len(codes), replace=False)
 
         # Add to genomes to partition until desired size is reached
-        for taxon in random_order:
-            partitioned_genomes.extend(taxon_to_genomes[taxon])
-            if len(partitioned_genomes) / len(genomes) >= partition_size:
-                break
+        is_large_enough = np.cumsum(n_genomes[random_order]) / len(genomes) >= partition_size
+        n_taxa = np.argmax(is_large_enough) + 1 if is_large_enough.any() else len(codes)
+        partitioned_codes = codes[random_order[:n_taxa]]
 
-        return set(partitioned_genomes)
+        is_partitioned = np.zeros(len(genomes), dtype=bool)
+        is_partitioned[found] = np.isin(genome_codes, partitioned_codes)
+        return set(np.array(genomes, dtype=object)[is_partitioned].tolist())
 
     def find_relatives_of_partitioned_set_in_reference(self, partitioned_genomes: set) -> set:
         """Provides all genomes within taxa selected for partitioning.
@@ -90,6 +91,9 @@ class PartitionTaxa:
         Returns:
             related_genomes: Set of genomes within the same taxon as partitioned genomes
         """
-        taxa = self.taxonomy.taxa_of_genomes(partitioned_genomes, self.partition_rank)
-        related_genomes = self.taxonomy.genomes_in_taxa(taxa, self.partition_rank)
+        rows = self.taxonomy.rows_of_genomes(list(partitioned_genomes))
+        index = self.taxonomy.indices[self.partition_rank]
+        codes = self.taxonomy.rank_codes[rows[rows >= 0], index]
+        rows = self.taxonomy.rows_in_taxa(codes, self.partition_rank)
+        related_genomes = set(self.taxonomy.accessions[rows].astype(str).tolist())
         return related_genomes
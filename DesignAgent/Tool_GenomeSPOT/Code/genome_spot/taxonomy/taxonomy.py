@@ -1,17 +1,35 @@
 """TaxonomyGTDB is a helper class to use the Genome Taxonomy Database (GTDB) taxonomy."""
 
 import gzip
-import io
+import hashlib
+import json
+import logging
+import os
+import shutil
 import subprocess as sp
-from collections import Counter
+import tempfile
+from functools import cached_property
 from pathlib import Path
 from typing import (
+    List,
     Optional,
     Tuple,
     Union,
 )
 
 import numpy as np
+import pandas as pd
+
+
+RANKS = ["domain", "phylum", "class", "order", "family", "genus", "species"]
+DEFAULT_INDEX_LOCATION = os.environ.get(
+    "GENOME_SPOT_TAXONOMY_INDEX", str(Path.home() / ".cache" / "genome_spot" / "taxonomy")
+)
+# Bump when the layout of the index files changes
+INDEX_VERSION = 1
+
+# Taxonomies keyed by absolute paths of the taxonomy files and index location
+_TAXONOMIES = {}
 
 
 class TaxonomyGTDB:
@@ -19,6 +37,13 @@ class TaxonomyGTDB:
     Class for taxonomy operations using the taxonomy
     from the Genome Taxonomy Database (gtdb.ecogenomic.org/)
 
+    The taxonomy files are parsed once into a binary index of NumPy arrays:
+    genome accessions in sorted order, which are looked up by binary search,
+    and one integer code per rank for each genome, with the names of the codes.
+    The index is saved under `index_location` and memory-mapped when the
+    same files are loaded again. Use `load_taxonomy` to share one instance
+    within a process.
+
     Typical usage:
         ```
         from taxonomy import TaxonomyGTDB
@@ -30,21 +55,25 @@ class TaxonomyGTDB:
     Args:
         taxonomy_filenames: list of taxonomy files. If not provided,
             will download files from GTDB if files are not in path.
+        index_location: directory to save and load indexes in, or None to
+            always parse the taxonomy files
 
     """
 
-    def __init__(self, taxonomy_filenames: Optional[list] = None):
-        self.indices = {
-            "domain": 0,
-            "phylum": 1,
-            "class": 2,
-            "order": 3,
-            "family": 4,
-            "genus": 5,
-            "species": 6,
-        }
+    def __init__(
+        self, taxonomy_filenames: Optional[list] = None, index_location: Optional[str] = DEFAULT_INDEX_LOCATION
+    ):
+        self.indices = {rank: i for i, rank in enumerate(RANKS)}
         self.taxonomy_filenames = self.download_taxonomy_files(taxonomy_filenames)
-        self.taxonomy_dict = self.make_taxonomy_dict()
+        index = self.load_index(index_location) if index_location is not None else None
+        if index is None:
+            index = self.make_index()
+            if index_location is not None:
+                self.save_index(index, index_location)
+        self.accessions, self.rank_codes, self.rank_names = index
+        # Per-level lookups built on first use
+        self._code_of_taxon = {}
+        self._rows_by_taxon = {}
 
     def download_taxonomy_files(self, taxonomy_filenames: Optional[list] = None):
         """Downloads taxonomy files if desired files not already in path"""
@@ -59,9 +88,10 @@ class TaxonomyGTDB:
         else:
             return taxonomy_filenames
 
-    def make_taxonomy_dict(self) -> dict:
+    @cached_property
+    def taxonomy_dict(self) -> dict:
         """
-        Load a taxonomic file into a dict keyed by genome accession.
+        Taxonomy as a dict keyed by genome accession, built from the index on first use.
 
         For example:
             {'GCA_016456235': ('Bacteria',
@@ -73,6 +103,14 @@ class TaxonomyGTDB:
                             'Escherichia coli'),...}
 
         """
+        names = [self.rank_names[i][self.rank_codes[:, i]].tolist() for i in range(len(RANKS))]
+        return dict(zip(self.accessions.astype(str).tolist(), zip(*names)))
+
+    def make_taxonomy_dict(self) -> dict:
+        """
+        Load the taxonomic files into a dict keyed by genome accession.
+        Accessions found more than once keep the last taxonomy.
+        """
 
         taxonomy_dict = {}
 
@@ -81,8 +119,7 @@ class TaxonomyGTDB:
                 fh = gzip.open(filename, "rt")
             else:
                 fh = open(filename, "r")
-            fh.seek(0)
-            for line in fh.readlines():
+            for line in fh:
                 gtdb_accession, taxstring = line.strip().split("\t")
                 ncbi_accession = self.convert_gtdb_to_ncbi(gtdb_accession, make_genbank=True, remove_version=True)
                 _, taxonomy = self.format_taxonomy_as_tuple(taxstring)
@@ -90,6 +127,78 @@ class TaxonomyGTDB:
             fh.close()
         return taxonomy_dict
 
+    def make_index(self) -> Tuple[np.ndarray, np.ndarray, List[np.ndarray]]:
+        """Parses the taxonomy files into arrays
+
+        Returns:
+            Sorted genome accessions (bytes), an int32 array of taxon codes with
+            one column per rank, and for each rank an array of taxon names by code
+        """
+        taxonomy_dict = self.make_taxonomy_dict()
+        genomes = sorted(taxonomy_dict)
+        accessions = np.array([genome.encode("utf-8") for genome in genomes], dtype=bytes)
+        lineages = [taxonomy_dict[genome] for genome in genomes]
+        # taxstrings missing ranks are padded with empty taxa
+        lineages = [lineage + ("",) * (len(RANKS) - len(lineage)) for lineage in lineages]
+        rank_codes = np.zeros((len(genomes), len(RANKS)), dtype=np.int32)
+        rank_names = []
+        for i, taxa in enumerate(zip(*lineages) if lineages else [()] * len(RANKS)):
+            codes, names = pd.factorize(np.array(taxa, dtype=object))
+            rank_codes[:, i] = codes
+            rank_names.append(np.array(names, dtype=str))
+        return accessions, rank_codes, rank_names
+
+    def index_signature(self) -> str:
+        """Hash identifying the taxonomy files by path, size and modification time"""
+        digest = hashlib.sha256(f"taxonomy index {INDEX_VERSION}\n".encode("utf-8"))
+        for filename in self.taxonomy_filenames:
+            stat = os.stat(filename)
+            digest.update(f"{os.path.abspath(filename)}\t{stat.st_size}\t{stat.st_mtime_ns}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def load_index(self, index_location: str) -> Optional[Tuple[np.ndarray, np.ndarray, List[np.ndarray]]]:
+        """Memory-maps the index of the taxonomy files, or returns None if there is none"""
+        index_dir = Path(index_location) / self.index_signature()
+        try:
+            accessions = np.load(index_dir / "accessions.npy", mmap_mode="r")
+            rank_codes = np.load(index_dir / "rank_codes.npy", mmap_mode="r")
+            rank_names = [np.load(index_dir / f"names_{rank}.npy", mmap_mode="r") for rank in RANKS]
+        except (OSError, ValueError):
+            return None
+        return accessions, rank_codes, rank_names
+
+    def save_index(self, index: Tuple[np.ndarray, np.ndarray, List[np.ndarray]], index_location: str):
+        """Saves the index so that it can be memory-mapped by `load_index`"""
+        accessions, rank_codes, rank_names = index
+        index_dir = Path(index_location) / self.index_signature()
+        tmp_dir = None
+        try:
+            Path(index_location).mkdir(parents=True, exist_ok=True)
+            # write to a new directory then rename so readers never see a partial index
+            tmp_dir = tempfile.mkdtemp(dir=index_location, prefix=".tmp-")
+            np.save(Path(tmp_dir) / "accessions.npy", accessions)
+            np.save(Path(tmp_dir) / "rank_codes.npy", rank_codes)
+            for rank, names in zip(RANKS, rank_names):
+                np.save(Path(tmp_dir) / f"names_{rank}.npy", names)
+            with open(Path(tmp_dir) / "sources.json", "w", encoding="utf-8") as fh:
+                json.dump([os.path.abspath(filename) for filename in self.taxonomy_filenames], fh)
+            # mkdtemp creates the directory readable by its owner only
+            os.chmod(tmp_dir, 0o755)
+            os.replace(tmp_dir, index_dir)
+        except OSError as error:
+            # e.g. another process saved the same index first
+            logging.info("Not saving taxonomy index to %s: %s", index_dir, error)
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def rows_of_genomes(self, genomes: Union[list, set, np.ndarray]) -> np.ndarray:
+        """Returns the index row of each genome, or -1 for genomes not in the taxonomy"""
+        keys = np.array([str(genome).encode("utf-8") for genome in genomes], dtype=bytes)
+        if len(keys) == 0 or len(self.accessions) == 0:
+            return np.full(len(keys), -1, dtype=np.intp)
+        rows = np.minimum(np.searchsorted(self.accessions, keys), len(self.accessions) - 1)
+        return np.where(self.accessions[rows] == keys, rows, -1)
+
     def convert_gtdb_to_ncbi(self, accession: str, make_genbank: bool = True, remove_version: bool = True) -> str:
         """Convert GTDB 'accession' into NCBI accession.
 
@@ -138,43 +247,102 @@ class TaxonomyGTDB:
             names.append(taxon)
         return tuple(levels), tuple(names)
 
+    def taxon_codes(self, taxa: Union[list, set], taxonomic_level: str) -> np.ndarray:
+        """Returns the codes of taxa at a level, ignoring taxa not in the taxonomy"""
+        rank = self.indices[taxonomic_level]
+        if rank not in self._code_of_taxon:
+            self._code_of_taxon[rank] = {taxon: code for code, taxon in enumerate(self.rank_names[rank].tolist())}
+        code_of_taxon = self._code_of_taxon[rank]
+        return np.array([code_of_taxon[taxon] for taxon in taxa if taxon in code_of_taxon], dtype=np.intp)
+
+    def rows_in_taxa(self, codes: np.ndarray, taxonomic_level: str) -> np.ndarray:
+        """Returns the sorted index rows of genomes in taxa, given taxon codes at a level
+
+        Uses an inverted index of each level, built on first use: rows ordered by
+        taxon code and the offset of each taxon's rows.
+        """
+        rank = self.indices[taxonomic_level]
+        if rank not in self._rows_by_taxon:
+            rows_by_code = np.argsort(self.rank_codes[:, rank], kind="stable")
+            counts = np.bincount(self.rank_codes[:, rank], minlength=len(self.rank_names[rank]))
+            offsets = np.concatenate([[0], np.cumsum(counts)])
+            self._rows_by_taxon[rank] = (rows_by_code, offsets)
+        rows_by_code, offsets = self._rows_by_taxon[rank]
+        codes = np.unique(codes)
+        if len(codes) == 0:
+            return np.empty(0, dtype=np.intp)
+        rows = np.concatenate([rows_by_code[offsets[code] : offsets[code + 1]] for code in codes])
+        return np.sort(rows)
+
     def taxonomy_dict_at_taxlevel(self, taxlevel: str) -> dict:
         """Returns taxonomy at the specified level"""
         index = self.indices[taxlevel]
-        return {k: v[index] for k, v in self.taxonomy_dict.items()}
+        taxa = self.rank_names[index][self.rank_codes[:, index]].tolist()
+        return dict(zip(self.accessions.astype(str).tolist(), taxa))
+
+    def lineages_of_genomes(self, genomes: Union[list, np.ndarray]) -> pd.DataFrame:
+        """Returns a table of the taxon of each genome at each level, NaN for genomes not in the taxonomy"""
+        rows = self.rows_of_genomes(genomes)
+        found = rows >= 0
+        lineages = pd.DataFrame(index=genomes, columns=list(self.indices), dtype=object)
+        for taxlevel, index in self.indices.items():
+            taxa = np.full(len(rows), np.nan, dtype=object)
+            taxa[found] = self.rank_names[index][self.rank_codes[rows[found], index]]
+            lineages[taxlevel] = taxa
+        return lineages
 
     def measure_diversity(self, query_rank: str, diversity_rank: str, subset_genomes: Optional[list] = None) -> dict:
         """Counts the number of taxa at rank `diversity_rank`
         under each taxon of the `query_rank` for a set of genomes.
         """
         query_index = self.indices[query_rank]
-        diversity_index = self.indices[diversity_rank]
-        ancestor_dict = {}
+        rows = None
         if subset_genomes:
-            for genome in subset_genomes:
-                taxonomy = self.taxonomy_dict.get(genome, None)
-                if taxonomy:
-                    ancestor_dict[taxonomy[diversity_index]] = taxonomy[query_index]
-        else:
-            for genome, taxonomy in self.taxonomy_dict.items():
-                ancestor_dict[taxonomy[diversity_index]] = taxonomy[query_index]
+            rows = self.rows_of_genomes(subset_genomes)
+            rows = rows[rows >= 0]
+        counts = self.diversity_counts(query_rank, diversity_rank, rows=rows)
+        codes = np.flatnonzero(counts)
+        return dict(zip(self.rank_names[query_index][codes].tolist(), counts[codes].tolist()))
+
+    def diversity_counts(self, query_rank: str, diversity_rank: str, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Counts the number of taxa at rank `diversity_rank` under each taxon
+        of the `query_rank`, as `measure_diversity` but indexed by taxon code.
 
-        return dict(Counter(ancestor_dict.values()))
+        Args:
+            rows: Index rows of the genomes to count, by default all genomes
+        """
+        query_index = self.indices[query_rank]
+        diversity_index = self.indices[diversity_rank]
+        if rows is None:
+            rows = np.arange(len(self.accessions))
+        diversity_codes = self.rank_codes[rows, diversity_index]
+        # each taxon at diversity_rank counts once, under the query taxon of its last genome
+        _, last = np.unique(diversity_codes[::-1], return_index=True)
+        query_codes = self.rank_codes[rows[::-1][last], query_index]
+        return np.bincount(query_codes, minlength=len(self.rank_names[query_index]))
 
     def taxa_of_genomes(self, genomes: Union[list, set], taxonomic_level: str):
         """Get taxa for a set of genomes at the specified level"""
-        taxa = set()
-        for genome in genomes:
-            taxonomy = self.taxonomy_dict.get(genome, None)
-            if taxonomy:
-                taxa.add(taxonomy[self.indices[taxonomic_level]])
-        return sorted(taxa)
+        index = self.indices[taxonomic_level]
+        rows = self.rows_of_genomes(list(genomes))
+        codes = np.unique(self.rank_codes[rows[rows >= 0], index])
+        return sorted(self.rank_names[index][codes].tolist())
 
     def genomes_in_taxa(self, taxa: list, taxonomic_level: str):
         """Get all genomes for a set of taxa, must specify level"""
-        genomes = set()
-        for genome, taxonomy in self.taxonomy_dict.items():
-            taxon = taxonomy[self.indices[taxonomic_level]]
-            if taxon in taxa:
-                genomes.add(genome)
-        return sorted(genomes)
+        rows = self.rows_in_taxa(self.taxon_codes(taxa, taxonomic_level), taxonomic_level)
+        # rows are in order of accession
+        return self.accessions[rows].astype(str).tolist()
+
+
+def load_taxonomy(
+    taxonomy_filenames: Optional[list] = None, index_location: Optional[str] = DEFAULT_INDEX_LOCATION
+) -> TaxonomyGTDB:
+    """Returns the taxonomy of the taxonomy files, loading it once per process"""
+    taxonomy_key = (
+        tuple(os.path.abspath(filename) for filename in taxonomy_filenames) if taxonomy_filenames else None,
+        index_location,
+    )
+    if taxonomy_key not in _TAXONOMIES:
+        _TAXONOMIES[taxonomy_key] = TaxonomyGTDB(taxonomy_filenames, index_location=index_location)
+    return _TAXONOMIES[taxonomy_key]
@@ -4,6 +4,13 @@
 Minimal GenomeSPOT runner (per-sample TSV only)
 - Input : a directory (or a single .faa file)
 - Effect: For each .faa, run GenomeSPOT and write <workdir>/<stem>.predictions.tsv
+- Models are loaded once and genomes run in a pool of --jobs processes; each
+  genome's summary row is appended to summary_predictions.csv as it finishes,
+  and a failing genome is reported without stopping the batch.
+- With --incremental, only TSVs added or changed since the last summary are
+  parsed, using summary_predictions.csv.manifest.json.
+- With --prediction-store DIR, predictions and features of all genomes are also
+  appended to one columnar Parquet store (see genome_spot.prediction_store).
 
 Usage examples:
   # contigs and .faa in the same folder (same stem)
@@ -15,12 +22,17 @@ Usage examples:
   python run_genomespot_batch.py \
       --input "/Users/frank_gong/文档/生物智能体/硬盘备份/faa文件" \
       --contigs-dir "/Users/frank_gong/文档/生物智能体/硬盘备份/fa文件" \
-      --workdir outputs_genomespot
+      --workdir outputs_genomespot \
+      --jobs 8
 """
 
 import argparse
-import subprocess
+import csv
+import json
+import os
 import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 import pandas as pd
 import numpy as np
@@ -28,8 +40,38 @@ import warnings
 from pandas.errors import PerformanceWarning
 import re
 
+from genome_spot.feature_cache import DEFAULT_CACHE_LOCATION, FeatureCache
+from genome_spot.genome_spot import GenomeSPOT, load_model_bundle, run_genome_spot, save_results
+from genome_spot.prediction_store import PredictionStoreWriter
+
 
 CONTIG_SUFFIXES = (".fna", ".fa", ".fasta", ".ffn", ".fsa")
+MANIFEST_SUFFIX = ".manifest.json"
+SUMMARY_COLUMNS = [
+    "strain",
+    "temperature_optimum_C",
+    "temperature_minimum",
+    "temperature_maximum",
+    "ph_optimum",
+    "ph_minimum",
+    "ph_maximum",
+    "salinity_optimum",
+    "salinity_minimum",
+    "salinity_maximum",
+    "oxygen_tolerance",
+]
+# Summary columns holding continuous predictions, by GenomeSPOT target
+SUMMARY_TARGETS = {
+    "temperature_optimum": "temperature_optimum_C",
+    "temperature_min": "temperature_minimum",
+    "temperature_max": "temperature_maximum",
+    "ph_optimum": "ph_optimum",
+    "ph_min": "ph_minimum",
+    "ph_max": "ph_maximum",
+    "salinity_optimum": "salinity_optimum",
+    "salinity_min": "salinity_minimum",
+    "salinity_max": "salinity_maximum",
+}
 
 
 def find_models_dir() -> str:
@@ -75,35 +117,248 @@ def find_contigs_for(faa_path: Path, contigs_dir: Path | None = None) -> Path |
     return None
 
 
-def run_genomespot(models_dir: str, contigs: Path, faa: Path, out_dir: Path) -> Path:
+def run_genomespot(models_dir: str, contigs: Path, faa: Path, out_dir: Path, feature_cache: str | None = None):
+    """Runs GenomeSPOT in this process and writes <out_dir>/<stem>.predictions.tsv.
+
+    Models are loaded on the first call in each process and reused afterwards.
+    Features are reused from the feature cache when the same files were measured before.
+    Returns the TSV path, predictions and genome features.
+    """
     out_dir.mkdir(parents=True, exist_ok=True)
-    stem = faa.stem
-    out_prefix = out_dir / stem
-    cmd = [
-        sys.executable, "-m", "genome_spot.genome_spot",
-        "-m", models_dir,
-        "-c", str(contigs),
-        "-p", str(faa),
-        "-o", str(out_prefix),
-    ]
-    print(f"[RUN] {stem}")
-    res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    if res.returncode != 0:
-        print(f"[ERROR] GenomeSPOT failed for {stem}:\n{res.stderr}", file=sys.stderr)
+    out_prefix = out_dir / faa.stem
+    predictions, genome_features = run_genome_spot(
+        fna_path=str(contigs),
+        faa_path=str(faa),
+        path_to_models=models_dir,
+        feature_cache=FeatureCache(feature_cache) if feature_cache else None,
+    )
+    save_results(
+        predictions=predictions,
+        genome_features=genome_features,
+        output_prefix=str(out_prefix),
+        save_genome_features=False,
+    )
+    # stems such as GCA_000172155.1_ASM17215v1 contain dots, so the suffix is appended rather than replaced
+    return out_dir / f"{faa.stem}.predictions.tsv", predictions, genome_features
+
+
+def _run_one(models_dir: str, contigs: Path, faa: Path, out_dir: Path, feature_cache: str | None = None):
+    """Worker entry point: returns (stem, outputs, error) so one genome cannot fail the batch."""
+    try:
+        return faa.stem, run_genomespot(models_dir, contigs, faa, out_dir, feature_cache), None
+    except Exception:
+        return faa.stem, None, traceback.format_exc()
+
+
+def run_batch(models_dir: str, tasks: list, out_dir: Path, jobs: int = 1, feature_cache: str | None = None):
+    """Yields (stem, (tsv_path, predictions, genome_features), error) for each (contigs, faa) task as it completes."""
+    # load in the parent so forked workers share the models; spawned workers load them once each
+    load_model_bundle(models_dir)
+    if jobs <= 1:
+        for contigs, faa in tasks:
+            yield _run_one(models_dir, contigs, faa, out_dir, feature_cache)
+        return
+    with ProcessPoolExecutor(max_workers=jobs, initializer=load_model_bundle, initargs=(models_dir,)) as pool:
+        futures = {
+            pool.submit(_run_one, models_dir, contigs, faa, out_dir, feature_cache): faa.stem for contigs, faa in tasks
+        }
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception:
+                # e.g. a worker killed by the OS; the pool reports it on the affected futures
+                yield futures[future], None, traceback.format_exc()
+
+
+def summarize_predictions_tsv(tsv: Path) -> dict | None:
+    """Maps one <stem>.predictions.tsv to a summary row, or None if it cannot be read."""
+    try:
+        df = pd.read_csv(tsv, sep="\t", header=0)
+        # Expect rows like: target, value, error, units, is_novel, warning
+        if "target" not in df.columns or "value" not in df.columns:
+            print(f"[WARN] {tsv.name} has unexpected columns: {list(df.columns)}", file=sys.stderr)
+            return None
+        # Normalize target names for robust lookup
+        df["_target_norm"] = (
+            df["target"].astype(str)
+            .str.strip()
+            .str.lower()
+            .str.replace(" ", "_", regex=False)
+            .str.replace("-", "_", regex=False)
+        )
+        lookup = dict(zip(df["_target_norm"], df["value"]))
+
+        def get_by_targets(cands):
+            for k in cands:
+                if k in lookup:
+                    return lookup[k]
+            return np.nan
+
+        row = {
+            "strain": tsv.stem.replace(".predictions", ""),
+            "temperature_optimum_C": get_by_targets(["temperature_optimum", "temp_optimum", "topt"]),
+            "temperature_minimum":   get_by_targets(["temperature_minimum", "temperature_min", "temp_min", "tmin"]),
+            "temperature_maximum":   get_by_targets(["temperature_maximum", "temperature_max", "temp_max", "tmax"]),
+            "ph_optimum":            get_by_targets(["ph_optimum", "pH_optimum".lower()]),
+            "ph_minimum":            get_by_targets(["ph_minimum", "ph_min"]),
+            "ph_maximum":            get_by_targets(["ph_maximum", "ph_max"]),
+            "salinity_optimum":      get_by_targets(["salinity_optimum", "salt_optimum", "nacl_optimum"]),
+            "salinity_minimum":      get_by_targets(["salinity_minimum", "salinity_min", "salt_min", "nacl_min"]),
+            "salinity_maximum":      get_by_targets(["salinity_maximum", "salinity_max", "salt_max", "nacl_max"]),
+            "oxygen_tolerance":      get_by_targets(["oxygen", "o2", "oxygen_tolerance"]),
+        }
+
+        # If all metrics are NaN, dump debug info once
+        if all(pd.isna(v) for k, v in row.items() if k != "strain"):
+            print(f"[DEBUG] Could not map targets in {tsv.name}. Available targets:", file=sys.stderr)
+            print(df[["target", "value"]].to_string(index=False), file=sys.stderr)
+
+        return row
+    except Exception as e:
+        print(f"[WARN] Failed to read {tsv.name}: {e}", file=sys.stderr)
+        return None
+
+
+def format_summary_row(row: dict) -> dict:
+    """Formats a summary row for csv, writing missing values as empty cells like pandas does."""
+    return {k: "" if v is None or (isinstance(v, float) and np.isnan(v)) else v for k, v in row.items()}
+
+
+def scan_predictions_tsvs(workdir: Path) -> dict:
+    """Returns {file name: [mtime_ns, size]} of every *.predictions.tsv in workdir."""
+    tsvs = {}
+    with os.scandir(workdir) as entries:
+        for entry in entries:
+            if entry.name.endswith(".predictions.tsv") and entry.is_file():
+                stat = entry.stat()
+                tsvs[entry.name] = [stat.st_mtime_ns, stat.st_size]
+    return tsvs
+
+
+def manifest_path_for(summary_path: Path) -> Path:
+    return summary_path.with_name(summary_path.name + MANIFEST_SUFFIX)
+
+
+def load_manifest(summary_path: Path) -> dict | None:
+    """Returns the manifest of TSVs folded into summary_path, or None if either is missing or out of sync."""
+    manifest_path = manifest_path_for(summary_path)
+    if not summary_path.exists() or not manifest_path.exists():
+        return None
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        print(f"[WARN] Ignoring unreadable manifest {manifest_path.name}: {e}", file=sys.stderr)
+        return None
+    stat = summary_path.stat()
+    if manifest.get("summary") != [stat.st_mtime_ns, stat.st_size] or "files" not in manifest:
+        print(f"[WARN] {summary_path.name} changed since its manifest was written; re-aggregating all TSVs", file=sys.stderr)
+        return None
+    return manifest
+
+
+def save_manifest(summary_path: Path, folded: dict):
+    """Records the TSVs folded into summary_path and the summary's own mtime/size."""
+    stat = summary_path.stat()
+    manifest = {"summary": [stat.st_mtime_ns, stat.st_size], "files": folded}
+    manifest_path = manifest_path_for(summary_path)
+    tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+    tmp_path.write_text(json.dumps(manifest), encoding="utf-8")
+    os.replace(tmp_path, manifest_path)
+
+
+def read_summary_rows(summary_path: Path) -> dict:
+    """Reads an existing summary CSV into {strain: row}, keeping cells as written."""
+    with open(summary_path, newline="", encoding="utf-8") as fh:
+        return {row["strain"]: row for row in csv.DictReader(fh)}
+
+
+def strain_of_tsv(name: str) -> str:
+    """Returns the summary strain of a <stem>.predictions.tsv file name, as summarize_predictions_tsv names it."""
+    return Path(name).stem.replace(".predictions", "")
+
+
+def fold_summary_row(rows: dict, tsv: Path, row: dict | None) -> bool:
+    """Puts a TSV's summary row into rows, dropping the strain if the TSV no longer parses.
+
+    Returns True if a row already in rows was replaced or dropped, i.e. the summary must be rewritten.
+    """
+    strain = row["strain"] if row is not None else strain_of_tsv(tsv.name)
+    replaced = strain in rows
+    if row is None:
+        rows.pop(strain, None)
     else:
-        print(f"[OK] {stem} → {out_prefix.with_suffix('.predictions.tsv')}")
-    return out_prefix.with_suffix(".predictions.tsv")
+        rows[strain] = row
+    return replaced
+
+
+def fold_predictions_tsvs(workdir: Path, rows: dict, folded: dict) -> tuple[list, bool]:
+    """Folds TSVs added or changed since the last aggregation into rows and drops removed ones.
+
+    Returns the new rows that can be appended to the summary, and whether it must be rewritten instead.
+    """
+    appended = []
+    rewrite = False
+    current = scan_predictions_tsvs(workdir)
+    for name in sorted(folded.keys() - current.keys()):
+        del folded[name]
+        if rows.pop(strain_of_tsv(name), None) is not None:
+            rewrite = True
+    for name, stat in sorted(current.items()):
+        if folded.get(name) == stat:
+            continue
+        folded[name] = stat
+        row = summarize_predictions_tsv(workdir / name)
+        rewrite = fold_summary_row(rows, workdir / name, row) or rewrite
+        if row is not None:
+            appended.append(row)
+    return appended, rewrite
+
+
+def write_summary(summary_path: Path, rows: dict, appended: list, rewrite: bool):
+    """Rewrites the summary CSV from rows, or only appends the new rows to it."""
+    if rewrite:
+        with open(summary_path, "w", newline="", encoding="utf-8") as fh:
+            writer = csv.DictWriter(fh, fieldnames=SUMMARY_COLUMNS, lineterminator="\n")
+            writer.writeheader()
+            writer.writerows(format_summary_row(rows[strain]) for strain in sorted(rows))
+    elif appended:
+        with open(summary_path, "a", newline="", encoding="utf-8") as fh:
+            writer = csv.DictWriter(fh, fieldnames=SUMMARY_COLUMNS, lineterminator="\n")
+            writer.writerows(format_summary_row(row) for row in appended)
+
+
+def rescore_summary_errors(summary_path: Path, models_dir: str, out_path: Path | None = None) -> Path:
+    """Adds an <column>_error column for each continuous target of a summary CSV, in one lookup per target."""
+    summary = pd.read_csv(summary_path)
+    summary = summary.drop(columns=[c for c in summary.columns if c.endswith("_error")])
+    errors = GenomeSPOT().predict_errors_for_table(summary, load_model_bundle(models_dir), SUMMARY_TARGETS)
+    out_path = out_path or summary_path
+    pd.concat([summary, errors], axis=1).to_csv(out_path, index=False)
+    print(f"[OK] Re-scored errors for {len(summary)} genomes: {out_path}")
+    return out_path
 
 
 def main():
     ap = argparse.ArgumentParser(description="Minimal per-sample GenomeSPOT runner")
-    ap.add_argument("--input", required=True, help="Path to a .faa file or a directory containing .faa files")
+    ap.add_argument("--input", default=None, help="Path to a .faa file or a directory containing .faa files")
     ap.add_argument("--workdir", default="outputs_genomespot", help="Directory to store per-sample outputs")
     ap.add_argument("--models", default=None, help="Path to GenomeSPOT models/ (optional; auto-detect if omitted)")
     ap.add_argument("--contigs-dir", default=None, help="Optional directory with contigs (.fna/.fa/.fasta) matching .faa stems")
     ap.add_argument("--summary", default=None, help="Optional path to write aggregated CSV (defaults to <workdir>/summary_predictions.csv)")
+    ap.add_argument("--jobs", type=int, default=1, help="Number of genomes to process in parallel (default: 1)")
+    ap.add_argument("--feature-cache", default=DEFAULT_CACHE_LOCATION, help="Directory (or .sqlite file) caching genome features by file contents")
+    ap.add_argument("--no-feature-cache", action="store_true", help="Always measure genome features and do not cache them")
+    ap.add_argument("--prediction-store", default=None, help="Optional directory of a columnar (Parquet) store to append all predictions and features to")
+    ap.add_argument("--incremental", action="store_true", help="Only parse TSVs added or changed since the last summary (see <summary>.manifest.json)")
+    ap.add_argument("--rescore-summary", default=None, help="Only add error columns to an existing summary CSV, in place")
     args = ap.parse_args()
 
+    if args.rescore_summary:
+        rescore_summary_errors(Path(args.rescore_summary).expanduser().resolve(), args.models or find_models_dir())
+        return
+    if args.input is None:
+        ap.error("--input is required unless --rescore-summary is given")
+
     inp = Path(args.input).expanduser().resolve()
     workdir = Path(args.workdir).expanduser().resolve()
     contigs_dir = Path(args.contigs_dir).expanduser().resolve() if args.contigs_dir else None
@@ -114,86 +369,67 @@ def main():
         print(f"No .faa files found in {inp}", file=sys.stderr)
         sys.exit(2)
 
+    tasks = []
     for faa in faa_list:
         contigs = find_contigs_for(faa, contigs_dir)
         if contigs is None:
             print(f"[WARN] No contigs (.fna/.fa/.fasta) found for {faa.name}. Skipping.", file=sys.stderr)
             continue
-        run_genomespot(models_dir, contigs, faa, workdir)
-
-    # === Aggregate all per-sample TSVs into one CSV ===
-    tsv_paths = sorted(workdir.glob("*.predictions.tsv"))
-    rows = []
-    for tsv in tsv_paths:
-        try:
-            df = pd.read_csv(tsv, sep="\t", header=0)
-            # Expect rows like: target, value, error, units, is_novel, warning
-            if "target" not in df.columns or "value" not in df.columns:
-                print(f"[WARN] {tsv.name} has unexpected columns: {list(df.columns)}", file=sys.stderr)
+        tasks.append((contigs, faa))
+
+    # === Stream each genome's summary row into one CSV as it completes ===
+    workdir.mkdir(parents=True, exist_ok=True)
+    summary_path = Path(args.summary).expanduser().resolve() if args.summary else (workdir / "summary_predictions.csv")
+    manifest = load_manifest(summary_path) if args.incremental else None
+    if manifest is not None:
+        rows = read_summary_rows(summary_path)
+        folded = manifest["files"]
+        print(f"[RUN] Incremental aggregation onto {len(rows)} rows in {summary_path.name}")
+    else:
+        rows, folded = {}, {}
+    rewrite = manifest is None
+    failed = []
+    store = PredictionStoreWriter(args.prediction_store) if args.prediction_store else None
+    with open(summary_path, "a" if manifest is not None else "w", newline="", encoding="utf-8") as fh:
+        writer = csv.DictWriter(fh, fieldnames=SUMMARY_COLUMNS, lineterminator="\n")
+        if manifest is None:
+            writer.writeheader()
+        print(f"[RUN] {len(tasks)} genomes with {args.jobs} job(s)")
+        feature_cache = None if args.no_feature_cache else args.feature_cache
+        for stem, outputs, error in run_batch(models_dir, tasks, workdir, jobs=args.jobs, feature_cache=feature_cache):
+            if error is not None:
+                print(f"[ERROR] GenomeSPOT failed for {stem}:\n{error}", file=sys.stderr)
+                failed.append(stem)
                 continue
-            # Normalize target names for robust lookup
-            df["_target_norm"] = (
-                df["target"].astype(str)
-                .str.strip()
-                .str.lower()
-                .str.replace(" ", "_", regex=False)
-                .str.replace("-", "_", regex=False)
-            )
-            lookup = dict(zip(df["_target_norm"], df["value"]))
-
-            def get_by_targets(cands):
-                for k in cands:
-                    if k in lookup:
-                        return lookup[k]
-                return np.nan
-
-            row = {
-                "strain": tsv.stem.replace(".predictions", ""),
-                "temperature_optimum_C": get_by_targets(["temperature_optimum", "temp_optimum", "topt"]),
-                "temperature_minimum":   get_by_targets(["temperature_minimum", "temperature_min", "temp_min", "tmin"]),
-                "temperature_maximum":   get_by_targets(["temperature_maximum", "temperature_max", "temp_max", "tmax"]),
-                "ph_optimum":            get_by_targets(["ph_optimum", "pH_optimum".lower()]),
-                "ph_minimum":            get_by_targets(["ph_minimum", "ph_min"]),
-                "ph_maximum":            get_by_targets(["ph_maximum", "ph_max"]),
-                "salinity_optimum":      get_by_targets(["salinity_optimum", "salt_optimum", "nacl_optimum"]),
-                "salinity_minimum":      get_by_targets(["salinity_minimum", "salinity_min", "salt_min", "nacl_min"]),
-                "salinity_maximum":      get_by_targets(["salinity_maximum", "salinity_max", "salt_max", "nacl_max"]),
-                "oxygen_tolerance":      get_by_targets(["oxygen", "o2", "oxygen_tolerance"]),
-            }
-
-            # If all metrics are NaN, dump debug info once
-            if all(pd.isna(v) for k, v in row.items() if k != "strain"):
-                print(f"[DEBUG] Could not map targets in {tsv.name}. Available targets:", file=sys.stderr)
-                print(df[["target", "value"]].to_string(index=False), file=sys.stderr)
-
-            rows.append(row)
-        except Exception as e:
-            print(f"[WARN] Failed to read {tsv.name}: {e}", file=sys.stderr)
-            continue
+            tsv, predictions, genome_features = outputs
+            print(f"[OK] {stem} → {tsv}")
+            if store is not None:
+                store.add(stem, predictions=predictions, genome_features=genome_features)
+            stat = tsv.stat()
+            folded[tsv.name] = [stat.st_mtime_ns, stat.st_size]
+            row = summarize_predictions_tsv(tsv)
+            rewrite = fold_summary_row(rows, tsv, row) or rewrite
+            if row is not None:
+                writer.writerow(format_summary_row(row))
+                fh.flush()
+
+    if store is not None:
+        store.close()
+        print(f"[OK] Appended predictions and features to store: {args.prediction_store}")
 
+    # === Fold TSVs added or changed since the last aggregation; drop removed ones ===
+    appended, changed = fold_predictions_tsvs(workdir, rows, folded)
+    write_summary(summary_path, rows, appended, rewrite or changed)
+    save_manifest(summary_path, folded)
     if rows:
-        columns_order = [
-            "strain",
-            "temperature_optimum_C",
-            "temperature_minimum",
-            "temperature_maximum",
-            "ph_optimum",
-            "ph_minimum",
-            "ph_maximum",
-            "salinity_optimum",
-            "salinity_minimum",
-            "salinity_maximum",
-            "oxygen_tolerance",
-        ]
-        agg = pd.DataFrame(rows, columns=columns_order)
-        summary_path = Path(args.summary).expanduser().resolve() if args.summary else (workdir / "summary_predictions.csv")
-        agg.to_csv(summary_path, index=False)
-        print(f"[OK] Wrote aggregated CSV: {summary_path} (n={len(agg)})")
+        print(f"[OK] Wrote aggregated CSV: {summary_path} (n={len(rows)})")
     else:
         print("[WARN] No per-sample TSVs found to aggregate.", file=sys.stderr)
 
+    if failed:
+        print(f"[WARN] {len(failed)} genome(s) failed: {', '.join(sorted(failed))}", file=sys.stderr)
     print("[DONE] Finished running GenomeSPOT for all available samples.")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
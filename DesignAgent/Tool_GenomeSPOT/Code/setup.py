@@ -24,7 +24,6 @@ setup(
     packages=find_packages(exclude=["tests"]),
     scripts=["genome_spot/genome_spot.py"],
     install_requires=[
-        "biopython>=1.83",
         "hmmlearn==0.3.0",
         "scikit-learn==1.2.2",
         "bacdive>=0.2",
@@ -32,5 +31,7 @@ setup(
         "pandas>=1.5.3",
         "pytest>=7.4.3",
     ],
+    # pyarrow 26 requires NumPy 2, which install_requires does not
+    extras_require={"store": ["pyarrow>=10,<26"]},
     zip_safe=False,
 )
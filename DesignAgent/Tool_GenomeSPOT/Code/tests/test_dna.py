@@ -1,6 +1,9 @@
 # pylint: disable=missing-docstring
 import pytest
-from genome_spot.bioinformatics.dna import DNA
+from genome_spot.bioinformatics.dna import (
+    DNA,
+    StreamingDNA,
+)
 
 
 class TestDNA:
@@ -44,3 +47,12 @@ class TestDNA:
             "nt_C": 0.5384615384615384,
         }
         assert dna.nucleotide_metrics() == pytest.approx(expected_values)
+
+    def test_streaming_dna_matches_joined_contigs(self):
+        contigs = ["ACTAGCGACTAGC", "ggTTNACGA", "", "CCGRTA"]
+        streaming_dna = StreamingDNA(separator="NN")
+        for contig in contigs:
+            streaming_dna.add_sequence(contig)
+        dna = DNA("".join("NN" + contig for contig in contigs))
+        assert streaming_dna.nucleotide_metrics() == pytest.approx(dna.nucleotide_metrics())
+        assert streaming_dna.nt_2mer_frequencies() == pytest.approx(dna.nt_2mer_frequencies())
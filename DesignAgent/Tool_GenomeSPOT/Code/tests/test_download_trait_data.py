@@ -3,8 +3,13 @@ import json
 from pathlib import Path
 
 import pandas as pd
+import pytest
 from genome_spot.model_training.download_trait_data import (
     ComputeBacDiveTraits,
+    QueryBacDive,
+    RateLimiter,
+    compute_trait_table,
+    iter_bacdive_strains,
     load_targets_to_dataframe,
 )
 
@@ -43,3 +48,154 @@ def test_load_targets_to_dataframe():
     expected_df = pd.read_csv(TRAIT_DATA, sep="\t", index_col=0).set_index("ncbi_accession", drop=False)
     assert set(traits_df.index).difference(expected_df.index) == set()
     assert set(traits_df.columns).difference(expected_df.columns) == set()
+
+
+def make_strain(bacdive_id, accession, temperatures=(), phs=(), halophily=(), oxygen_tolerances=()):
+    return {
+        "General": {"BacDive-ID": bacdive_id, "NCBI tax id": {"NCBI tax id": bacdive_id, "Matching level": "species"}},
+        "Name and taxonomic classification": {"species": f"Species {bacdive_id}"},
+        "Sequence information": {"Genome sequences": [{"database": "ncbi", "accession": accession}]},
+        "Culture and growth conditions": {
+            "culture temp": [{"growth": g, "type": t, "temperature": v} for g, t, v in temperatures],
+            "culture pH": [{"ability": g, "type": t, "pH": v} for g, t, v in phs],
+        },
+        "Physiology and metabolism": {
+            "halophily": [{"salt": s, "growth": g, "tested relation": t, "concentration": c} for s, g, t, c in halophily],
+            "oxygen tolerance": [{"oxygen tolerance": tolerance} for tolerance in oxygen_tolerances],
+        },
+    }
+
+
+class TestComputeTraitTable:
+
+    def test_matches_per_strain_tsv(self, tmp_path):
+        traits_df = load_targets_to_dataframe(BACDIVE_DATA)
+        expected_df = load_targets_to_dataframe(BACDIVE_DATA, bulk=False)
+        traits_df.to_csv(tmp_path / "bulk.tsv", sep="\t")
+        expected_df.to_csv(tmp_path / "per_strain.tsv", sep="\t")
+        assert (tmp_path / "bulk.tsv").read_text() == (tmp_path / "per_strain.tsv").read_text()
+
+    def test_matches_per_strain_traits(self):
+        strains = [
+            make_strain(
+                1,
+                "GCA_000000001",
+                temperatures=[("positive", "growth", "28-30"), ("yes", "optimum", "30"), ("no", "growth", "45")],
+                phs=[("positive", "optimum", "6.5-7.5"), ("positive", "growth", "5-9"), ("no", "growth", "4")],
+                halophily=[
+                    ("NaCl", "positive", "optimum", "0.5-1 M"),
+                    ("NaCl", "no", "maximum", ">80 g/L"),
+                    ("KCl", "positive", "growth", "3 %"),
+                ],
+                oxygen_tolerances=["aerobe", "microaerotolerant"],
+            ),
+            make_strain(
+                2,
+                "GCA_000000002.2",
+                temperatures=[("positive", "optimum", "37")],
+                phs=[("positive", "optimum", "0")],
+                halophily=[("NaCl", "inconsistent", "growth", "<5 %"), ("NaCl", "positive", "optimum", "0")],
+                oxygen_tolerances=["obligate anaerobe"],
+            ),
+            make_strain(3, "GCA_000000003", oxygen_tolerances=["anaerobe", "aerotolerant"]),
+            # the last strain of a genome is kept
+            make_strain(4, "GCA_000000001", temperatures=[("positive", "optimum", "20-25")]),
+        ]
+        traits_df = compute_trait_table(strains)
+        trait_dict = {}
+        for strain in strains:
+            strain_traits = ComputeBacDiveTraits(strain).compute_trait_data()
+            trait_dict[strain_traits["ncbi_accession"]] = strain_traits
+        expected_df = pd.DataFrame(trait_dict).T
+        assert traits_df.index.tolist() == ["GCA_000000001.1", "GCA_000000002.2", "GCA_000000003.1"]
+        assert traits_df.columns.tolist() == expected_df.columns.tolist()
+        pd.testing.assert_frame_equal(traits_df, expected_df)
+
+
+class FakeBacdiveClient:
+    """Serves the test BacDive data like bacdive.BacdiveClient, failing once for `fail_ids`"""
+
+    def __init__(self, fail_ids=(), searches=None):
+        with open(BACDIVE_DATA, "r") as f:
+            self.strains = {int(bacdive_id): strain for bacdive_id, strain in json.loads(f.read()).items()}
+        self.fail_ids = set(fail_ids)
+        self.searches = searches if searches is not None else []
+        self.result = {}
+
+    def search(self, id):
+        self.searches.append(list(id))
+        if self.fail_ids.intersection(id):
+            self.fail_ids.difference_update(id)
+            raise ConnectionError("server error")
+        self.result = {"results": [i for i in id if i in self.strains]}
+        return len(self.result["results"])
+
+    def retrieve(self):
+        for bacdive_id in self.result["results"]:
+            yield self.strains[bacdive_id]
+
+
+def make_query(cache_dir, client_factory, max_workers=4):
+    query = QueryBacDive(
+        "user",
+        "password",
+        max_bacdive_id=0,
+        cache_dir=cache_dir,
+        max_workers=max_workers,
+        client_factory=client_factory,
+    )
+    with open(BACDIVE_DATA, "r") as f:
+        query.query_list = sorted(int(bacdive_id) for bacdive_id in json.loads(f.read()))
+    return query
+
+
+class TestQueryBacDive:
+
+    def test_paginated_query_keeps_last_partial_chunk(self):
+        query = make_query(None, FakeBacdiveClient)
+        query.query_list = list(range(140))
+        results = query.paginated_query(FakeBacdiveClient(), "id")
+        expected = {i for i in FakeBacdiveClient().strains if i < 140}
+        assert len(query.chunk_query_list()) == 2
+        assert set(results) == expected
+
+    def test_download_chunks_resumes(self, tmp_path):
+        searches = []
+        query = make_query(str(tmp_path), lambda: FakeBacdiveClient(searches=searches))
+        assert query.download_chunks() == []
+        assert len(searches) == 1
+        downloaded = list(iter_bacdive_strains(str(tmp_path)))
+        assert [strain["General"]["BacDive-ID"] for strain in downloaded] == query.query_list
+
+        query.query_list = query.query_list + list(range(200000, 200150))
+        assert query.download_chunks() == []
+        # only the two new chunks are queried
+        assert [search[0] for search in searches[1:]] == [200000, 200100]
+
+    def test_failed_chunk_is_retried(self, tmp_path):
+        ids = sorted(FakeBacdiveClient().strains)
+        client = FakeBacdiveClient(fail_ids=[ids[0]])
+        query = make_query(str(tmp_path), lambda: client, max_workers=1)
+        query.query_list = list(range(ids[0] - 5, ids[0] + 5)) + list(range(300000, 300010))
+        failed = query.download_chunks()
+        assert len(failed) == 1 and ids[0] in failed[0]
+        assert not list(tmp_path.glob(f"ids-{failed[0][0]:07d}-*"))
+        assert query.download_chunks() == []
+        assert [strain["General"]["BacDive-ID"] for strain in iter_bacdive_strains(str(tmp_path))] == [ids[0]]
+
+    def test_load_targets_streams_cache(self, tmp_path):
+        query = make_query(str(tmp_path), FakeBacdiveClient)
+        query.download_chunks()
+        traits_df = load_targets_to_dataframe(str(tmp_path))
+        expected_df = load_targets_to_dataframe(BACDIVE_DATA)
+        pd.testing.assert_frame_equal(traits_df.sort_index(), expected_df.sort_index())
+
+
+def test_rate_limiter(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("time.sleep", sleeps.append)
+    rate_limiter = RateLimiter(calls_per_second=10)
+    for _ in range(3):
+        rate_limiter.wait()
+    assert sleeps[0] == pytest.approx(0, abs=0.01)
+    assert sleeps[2] == pytest.approx(0.2, abs=0.01)
@@ -0,0 +1,69 @@
+# pylint: disable=missing-docstring
+import gzip
+import io
+from pathlib import Path
+
+import numpy as np
+import pytest
+from genome_spot.bioinformatics.dna import NUCLEOTIDE_CODES
+from genome_spot.fasta import (
+    iterate_fasta_bytes,
+    iterate_fasta_codes,
+    iterate_fasta_records,
+)
+from genome_spot.helpers import iterate_fasta
+
+cwd = Path(__file__).resolve().parent
+PROTEINS = f"{cwd}/test_data/GCA_000172155.1_ASM17215v1_protein.faa.gz"
+FASTA_TEXT = ">seq1 first\nACGT\nAC\n\n>seq2\r\nGG TT\r\n>empty\n>seq3\nNNACG\n"
+
+
+def write_fasta(tmp_path, compress):
+    path = tmp_path / ("test.fa.gz" if compress else "test.fa")
+    if compress:
+        with gzip.open(path, "wt") as fh:
+            fh.write(FASTA_TEXT)
+    else:
+        path.write_text(FASTA_TEXT)
+    return path
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_iterate_fasta_bytes(tmp_path, compress):
+    path = write_fasta(tmp_path, compress)
+    records = list(iterate_fasta_bytes(path))
+    assert records == [
+        (b"seq1 first", b"ACGTAC"),
+        (b"seq2", b"GGTT"),
+        (b"empty", b""),
+        (b"seq3", b"NNACG"),
+    ]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 1 << 20])
+def test_records_split_across_chunks(tmp_path, chunk_size):
+    path = write_fasta(tmp_path, compress=True)
+    expected = list(iterate_fasta_bytes(path))
+    assert list(iterate_fasta_bytes(path, chunk_size=chunk_size)) == expected
+    assert list(iterate_fasta_bytes(path, threads=2, chunk_size=chunk_size)) == expected
+
+
+def test_iterate_fasta_records_matches_iterate_fasta():
+    with io.TextIOWrapper(io.BufferedReader(gzip.open(PROTEINS, "r"))) as fh:
+        expected = list(iterate_fasta(fh))
+    assert list(iterate_fasta_records(PROTEINS)) == expected
+    assert list(iterate_fasta_records(PROTEINS, threads=2)) == expected
+
+
+def test_iterate_fasta_codes(tmp_path):
+    path = write_fasta(tmp_path, compress=False)
+    header, codes = next(iterate_fasta_codes(path, NUCLEOTIDE_CODES))
+    assert header == "seq1 first"
+    assert codes.tolist() == [0, 1, 2, 3, 0, 1]
+    assert codes.dtype == np.uint8
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / "empty.fa"
+    path.write_text("")
+    assert list(iterate_fasta_bytes(path)) == []
@@ -0,0 +1,72 @@
+# pylint: disable=missing-docstring
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+from genome_spot.bioinformatics.genome import load_genome_features
+from genome_spot.feature_cache import (
+    FeatureCache,
+    decode_genome_features,
+    encode_genome_features,
+)
+
+
+cwd = Path(__file__).resolve().parent
+
+CONTIG_FASTA = f"{cwd}/test_data/GCA_000172155.1_ASM17215v1_genomic.fna.gz"
+PROTEIN_FASTA = f"{cwd}/test_data/GCA_000172155.1_ASM17215v1_protein.faa.gz"
+GENOME_FEATURES_JSON = f"{cwd}/test_data/GCA_000172155.features.json"
+
+
+def test_encode_genome_features():
+    genome_features = load_genome_features(GENOME_FEATURES_JSON)
+    genome_features["all"]["missing"] = np.nan
+    decoded = decode_genome_features(encode_genome_features(genome_features))
+    assert decoded.keys() == genome_features.keys()
+    for localization, feat_dict in genome_features.items():
+        assert decoded[localization].keys() == feat_dict.keys()
+        for feat, value in feat_dict.items():
+            assert type(decoded[localization][feat]) is type(value)
+            assert decoded[localization][feat] == value or np.isnan(value)
+    assert len(encode_genome_features(genome_features)) < os.path.getsize(GENOME_FEATURES_JSON)
+
+
+def test_encode_rejects_non_numbers():
+    with pytest.raises(TypeError):
+        encode_genome_features({"all": {"feature": "text"}})
+
+
+def test_key_depends_on_contents(tmp_path):
+    protein_copy = tmp_path / "renamed.faa.gz"
+    protein_copy.write_bytes(Path(PROTEIN_FASTA).read_bytes())
+    assert FeatureCache.key(PROTEIN_FASTA, CONTIG_FASTA) == FeatureCache.key(str(protein_copy), CONTIG_FASTA)
+    assert FeatureCache.key(PROTEIN_FASTA, CONTIG_FASTA) != FeatureCache.key(CONTIG_FASTA, PROTEIN_FASTA)
+
+
+@pytest.mark.parametrize("location", ["features", "features.sqlite"])
+def test_feature_cache(tmp_path, location):
+    genome_features = load_genome_features(GENOME_FEATURES_JSON)
+    cache = FeatureCache(str(tmp_path / location))
+    assert cache.get("a") is None
+    cache.put("a", genome_features)
+    assert cache.get("a") == genome_features
+    assert cache.size() > 0
+
+
+@pytest.mark.parametrize("location", ["features", "features.sqlite"])
+def test_feature_cache_evicts_least_recently_used(tmp_path, location):
+    genome_features = load_genome_features(GENOME_FEATURES_JSON)
+    entry_size = len(encode_genome_features(genome_features))
+    cache = FeatureCache(str(tmp_path / location), max_size=2 * entry_size)
+    cache.put("a", genome_features)
+    cache.put("b", genome_features)
+    if not cache.use_sqlite:
+        os.utime(tmp_path / location / "a.features.bin", (0, 0))
+        os.utime(tmp_path / location / "b.features.bin", (1, 1))
+    assert cache.get("a") is not None
+    cache.put("c", genome_features)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.size() <= 2 * entry_size
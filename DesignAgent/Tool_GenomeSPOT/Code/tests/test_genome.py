@@ -1,6 +1,7 @@
 # pylint: disable=missing-docstring
 from pathlib import Path
 
+import numpy as np
 import pytest
 from genome_spot.bioinformatics.genome import Genome
 
@@ -145,3 +146,22 @@ class TestGenome:
 
         # check values are calculated consistently
         assert dict(sorted(genome_features["all"].items())) == pytest.approx(dict(sorted(expected_values_all.items())))
+
+    def test_protein_table(self):
+        genome_calc = Genome(
+            contig_filepath=CONTIG_FASTA,
+            protein_filepath=PROTEIN_FASTA,
+        )
+        protein_table = genome_calc.protein_table()
+        assert len(protein_table) == 6519
+        assert protein_table["aa_A"].dtype == np.float32
+        assert protein_table["pi"].dtype == np.float64
+        assert protein_table["is_exported"].dtype == bool
+
+        localization = genome_calc.assign_localization()
+        assert protein_table["localization"].dtype == "category"
+        membrane_ids = {protein for protein, locale in localization.items() if locale == "membrane"}
+        membrane_mask = (protein_table["localization"] == "membrane").values
+        assert genome_calc.compute_protein_statistics(subset_proteins=membrane_ids) == pytest.approx(
+            genome_calc.compute_protein_statistics(subset_proteins=membrane_mask)
+        )
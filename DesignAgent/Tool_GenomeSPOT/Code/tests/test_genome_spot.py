@@ -1,13 +1,20 @@
 # pylint: disable=missing-docstring
 import json
+import shutil
 from pathlib import Path
 
 import joblib
 import numpy as np
+import pandas as pd
 import pytest
 import sklearn
 from genome_spot.bioinformatics.genome import load_genome_features
-from genome_spot.genome_spot import GenomeSPOT
+from genome_spot.genome_spot import (
+    ErrorModel,
+    GenomeSPOT,
+    GenomeSPOTModelBundle,
+    load_model_bundle,
+)
 
 
 cwd = Path(__file__).resolve().parent
@@ -19,6 +26,7 @@ GENOME_FEATURES_JSON = f"{cwd}/test_data/GCA_000172155.features.json"
 PREDICTIONS_JSON = f"{cwd}/test_data/GCA_000172155.predictions.json"
 INSTRUCTIONS_JSON = f"{cwd}/test_data/instructions.json"
 MODEL_FILE = f"{cwd}/test_data/oxygen.joblib"
+MODELS_DIR = f"{cwd.parent}/models"
 CONDITIONS = ["oxygen", "temperature", "salinity", "ph"]
 LOCALIZATIONS = ["all", "extracellular_soluble", "intracellular_soluble", "membrane", "diff_extra_intra"]
 
@@ -105,3 +113,103 @@ class TestGenomeSPOT:
         assert tsv_header == ["target", "value", "error", "units", "is_novel", "warning"]
         for line in tsv.split("\n"):
             assert len(line.split("\t")) == 6
+
+    def test_models_loaded_once(self):
+        models = load_model_bundle(MODELS_DIR)
+        assert load_model_bundle(MODELS_DIR) is models
+        genome_features = load_genome_features(GENOME_FEATURES_JSON)
+        predictions = GenomeSPOT().predict_from_genome(genome_features, MODELS_DIR)
+        expected_predictions = json.loads(open(PREDICTIONS_JSON, "r").read())
+        assert sorted(predictions) == sorted(expected_predictions)
+        assert predictions["oxygen"]["value"] == "tolerant"
+
+    def test_model_bundle_file(self, tmp_path):
+        shutil.copytree(MODELS_DIR, tmp_path, dirs_exist_ok=True)
+        bundle = GenomeSPOTModelBundle.from_directory(str(tmp_path))
+        bundle.save_bundle()
+        bundle_from_file = GenomeSPOTModelBundle.from_directory(str(tmp_path))
+        assert bundle_from_file.instructions == bundle.instructions
+        assert sorted(bundle_from_file.models) == sorted(bundle.models)
+        genome_features = load_genome_features(GENOME_FEATURES_JSON)
+        predictions = GenomeSPOT().predict_from_genome(genome_features, bundle)
+        assert GenomeSPOT().predict_from_genome(genome_features, bundle_from_file) == predictions
+
+    def test_model_bundle_missing_files(self, tmp_path):
+        shutil.copytree(MODELS_DIR, tmp_path, dirs_exist_ok=True)
+        (tmp_path / "error_ph_max.joblib").unlink()
+        with pytest.raises(FileNotFoundError, match="error_ph_max.joblib"):
+            GenomeSPOTModelBundle.from_directory(str(tmp_path))
+
+    @staticmethod
+    def predict_each_target(genome_spot, genome_features):
+        """Predicts one genome target by target, as predict_from_genome did before batching"""
+        instructions = genome_spot.load_instructions(f"{MODELS_DIR}/instructions.json")
+        predictions = {}
+        for condition, condition_instructions in instructions.items():
+            novelty_model = joblib.load(f"{MODELS_DIR}/novelty_{condition}.joblib")
+            X = genome_spot.genome_features_to_input_arr(condition_instructions["features"], genome_features)
+            if condition == "oxygen":
+                targets, method = ["oxygen"], "predict_proba"
+            else:
+                targets, method = [f"{condition}_{attribute}" for attribute in ["optimum", "max", "min"]], "predict"
+            for target in targets:
+                error_model = joblib.load(f"{MODELS_DIR}/error_{target}.joblib") if method == "predict" else None
+                predictions[target] = genome_spot.predict_target_value(
+                    X=X,
+                    model=joblib.load(f"{MODELS_DIR}/{target}.joblib"),
+                    target=target,
+                    method=method,
+                    error_model=error_model,
+                    novelty_model=novelty_model,
+                )
+        return predictions
+
+    def test_predict_from_genomes(self):
+        genome_spot = GenomeSPOT()
+        genome_features = load_genome_features(GENOME_FEATURES_JSON)
+        # no membrane proteins: oxygen can be predicted but the other conditions cannot
+        incomplete_features = {key: value for key, value in genome_features.items() if key != "membrane"}
+        genome_features_list = [genome_features, incomplete_features, genome_features]
+        batch_predictions = genome_spot.predict_from_genomes(genome_features_list, MODELS_DIR)
+        assert len(batch_predictions) == 3
+        for genome_features, predictions in zip(genome_features_list, batch_predictions):
+            expected_predictions = self.predict_each_target(genome_spot, genome_features)
+            assert sorted(predictions) == sorted(expected_predictions)
+            for target, values in predictions.items():
+                for key, value in values.items():
+                    if isinstance(value, float):
+                        assert value == pytest.approx(expected_predictions[target][key])
+                    else:
+                        assert value == expected_predictions[target][key]
+
+        table = genome_spot.predict_from_genomes(
+            genome_features_list, MODELS_DIR, genome_ids=["a", "b", "c"], as_dataframe=True
+        )
+        assert list(table.columns) == ["genome", "target", "value", "error", "units", "is_novel", "warning"]
+        assert len(table) == 3 * len(batch_predictions[0])
+        warnings = table.loc[table["genome"] == "b"].set_index("target")["warning"]
+        assert warnings["oxygen"] is None
+        assert warnings["ph_optimum"] == "genome missing features"
+
+    def test_error_model_matches_scan(self):
+        genome_spot = GenomeSPOT()
+        # repeated and equidistant reference values resolve to the first row, as np.argmin does
+        error_arr = np.array([[1.0, 10.0], [3.0, 30.0], [1.0, 11.0], [2.0, 20.0], [0.0, 5.0]])
+        y = np.array([1.5, 2.5, 0.5, 1.0, -3.0, 9.0, 2.0])
+        expected = [genome_spot.predict_error(value, error_arr) for value in y]
+        assert genome_spot.predict_errors(y, error_arr).tolist() == expected
+        assert [genome_spot.predict_error(value, ErrorModel(error_arr)) for value in y] == expected
+
+        error_arr = joblib.load(f"{MODELS_DIR}/error_ph_optimum.joblib")
+        y = np.random.default_rng(0).uniform(0, 14, size=1000)
+        expected = [genome_spot.predict_error(value, error_arr) for value in y]
+        assert genome_spot.predict_errors(y, error_arr).tolist() == expected
+
+    def test_predict_errors_for_table(self):
+        genome_spot = GenomeSPOT()
+        table = pd.DataFrame({"ph_opt": [7.0, None, 3.5], "oxygen": ["tolerant", "not tolerant", None]})
+        errors = genome_spot.predict_errors_for_table(table, MODELS_DIR, {"ph_optimum": "ph_opt", "oxygen": "oxygen"})
+        assert list(errors.columns) == ["ph_opt_error"]
+        error_arr = joblib.load(f"{MODELS_DIR}/error_ph_optimum.joblib")
+        assert errors["ph_opt_error"][0] == genome_spot.predict_error(7.0, error_arr)
+        assert np.isnan(errors["ph_opt_error"][1])
@@ -0,0 +1,76 @@
+# pylint: disable=missing-docstring
+
+import json
+import logging
+from pathlib import Path
+
+import pandas as pd
+
+from genome_spot.genome_spot import save_results
+from genome_spot.join_outputs import (
+    convert_outputs_to_nested_dict,
+    convert_outputs_to_single_tsv,
+    load_output_tsv,
+    read_output_tsvs,
+)
+
+
+cwd = Path(__file__).resolve().parent
+with open(f"{cwd}/test_data/GCA_000172155.predictions.json", "r", encoding="utf-8") as fh:
+    PREDICTIONS = json.load(fh)
+
+
+def write_outputs(outdir, accessions):
+    for accession in accessions:
+        save_results(predictions=PREDICTIONS, output_prefix=f"{outdir}/{accession}", save_genome_features=False)
+    return [f"{outdir}/{accession}.predictions.tsv" for accession in accessions]
+
+
+class TestJoinOutputs:
+    def test_single_tsv(self, tmp_path):
+        output_files = write_outputs(tmp_path, ["g1", "g2", "g3"])
+        single_tsv = convert_outputs_to_single_tsv(output_files, threads=2)
+        assert list(single_tsv.index) == ["g1", "g2", "g3"]
+        assert list(single_tsv.columns.names) == ["target", "variable"]
+
+        _, predictions_df = load_output_tsv(output_files[0])
+        assert set(single_tsv.columns.get_level_values("target")) == set(predictions_df.index)
+        for target, values in PREDICTIONS.items():
+            assert single_tsv.loc["g2", (target, "prediction")] == values["value"]
+            assert single_tsv.loc["g2", (target, "error")] == values["error"]
+            assert single_tsv.loc["g2", (target, "units")] == values["units"]
+            assert single_tsv.loc["g2", (target, "is_novel")] == values["is_novel"]
+        assert single_tsv.loc["g1", ("ph_optimum", "warning")] is None
+        # numeric fields are floats, as from a prediction store
+        assert single_tsv[("ph_optimum", "prediction")].dtype == float
+        assert single_tsv.xs("error", axis=1, level="variable").dtypes.eq(float).all()
+        assert single_tsv[("oxygen", "prediction")].tolist() == ["tolerant"] * 3
+
+        single_tsv.to_csv(tmp_path / "all.predictions.tsv", sep="\t")
+        reread = pd.read_csv(tmp_path / "all.predictions.tsv", sep="\t", header=[0, 1], index_col=0)
+        assert reread.shape == single_tsv.shape
+
+    def test_nested_dict(self, tmp_path):
+        output_files = write_outputs(tmp_path, ["g1"])
+        output_dict = convert_outputs_to_nested_dict(output_files)
+        assert output_dict["g1"]["temperature"]["optimum"]["value"] == PREDICTIONS["temperature_optimum"]["value"]
+        assert output_dict["g1"]["temperature"]["optimum"]["warning"] is None
+        assert output_dict["g1"]["temperature"]["is_novel"] is False
+        assert output_dict["g1"]["temperature"]["units"] == "C"
+
+    def test_malformed_files_are_reported(self, tmp_path, caplog):
+        output_files = write_outputs(tmp_path, ["g1"])
+        (tmp_path / "empty.predictions.tsv").write_text("")
+        (tmp_path / "header.predictions.tsv").write_text("target\tvalue\noxygen\ttolerant\n")
+        (tmp_path / "ragged.predictions.tsv").write_text("target\tvalue\terror\tunits\tis_novel\twarning\noxygen\t1\n")
+        malformed_files = [str(tmp_path / f"{name}.predictions.tsv") for name in ["empty", "header", "ragged"]]
+        missing_file = str(tmp_path / "missing.predictions.tsv")
+
+        tables, malformed = read_output_tsvs(output_files + malformed_files + [missing_file])
+        assert [accession for accession, _ in tables] == ["g1"]
+        assert [tsv for tsv, _ in malformed] == malformed_files + [missing_file]
+
+        with caplog.at_level(logging.WARNING):
+            single_tsv = convert_outputs_to_single_tsv(output_files + malformed_files)
+        assert list(single_tsv.index) == ["g1"]
+        assert "Skipped 3 malformed predictions file(s)" in caplog.text
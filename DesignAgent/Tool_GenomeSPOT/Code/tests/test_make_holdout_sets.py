@@ -26,7 +26,7 @@ def test_partition_within_percentiles():
         {"ncbi_accession": GENOMES, "oxygen": np.random.choice([1, 0], len(GENOMES)), "use_oxygen": True}
     ).set_index("ncbi_accession")
 
-    taxonomy = TaxonomyGTDB(TAXONOMY_FILENAMES)
+    taxonomy = TaxonomyGTDB(TAXONOMY_FILENAMES, index_location=None)
     partitioner = PartitionTaxa(taxonomy, partition_rank="family", diversity_rank="genus")
     partitioned_genomes = partition_within_percentiles(
         balanced_df=mock_df,
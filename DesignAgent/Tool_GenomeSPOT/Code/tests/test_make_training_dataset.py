@@ -0,0 +1,88 @@
+# pylint: disable=missing-docstring
+
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from genome_spot.model_training import make_training_dataset
+from genome_spot.model_training.make_training_dataset import (
+    is_valid_features_file,
+    load_features_to_dataframe,
+    pool_measure_genome_features,
+    time_limit,
+)
+
+
+cwd = Path(__file__).resolve().parent
+
+
+def test_is_valid_features_file(tmp_path):
+    valid = tmp_path / "valid.features.json"
+    valid.write_text(json.dumps({"all": {"nt_length": 6}, "membrane": {}}))
+    failed = tmp_path / "failed.features.json"
+    failed.write_text(json.dumps({}))
+    truncated = tmp_path / "truncated.features.json"
+    truncated.write_text('{"all": {"nt_length": 6')
+
+    assert is_valid_features_file(str(valid)) is True
+    assert is_valid_features_file(str(failed)) is False
+    assert is_valid_features_file(str(truncated)) is False
+    assert is_valid_features_file(str(tmp_path / "missing.features.json")) is False
+
+
+def test_time_limit():
+    with pytest.raises(TimeoutError):
+        with time_limit(0.05):
+            time.sleep(1)
+    with time_limit(1):
+        time.sleep(0.01)
+    with time_limit(None):
+        time.sleep(0.01)
+
+
+def test_load_features_to_dataframe(tmp_path):
+    with open(f"{cwd}/test_data/GCA_000172155.features.json", "r", encoding="utf-8") as fh:
+        genome_features = json.load(fh)
+    features_dir = tmp_path / "features"
+    features_dir.mkdir()
+    with open(features_dir / "GCA_1.features.json", "w", encoding="utf-8") as fh:
+        json.dump(genome_features, fh)
+    with open(features_dir / "GCA_2.features.json", "w", encoding="utf-8") as fh:
+        json.dump({"all": {"nt_length": 10, "new_feature": None}}, fh)
+    (features_dir / "GCA_3.features.json").write_text("{}")
+    (features_dir / "GCA_4.features.json").write_text('{"all": {')
+
+    df_features = load_features_to_dataframe(str(features_dir))
+    assert list(df_features.index) == ["GCA_1", "GCA_2"]
+    assert df_features.dtypes.unique().tolist() == [np.float32]
+    assert df_features.loc["GCA_1", "all_nt_length"] == genome_features["all"]["nt_length"]
+    assert df_features.loc["GCA_1", "membrane_aa_A"] == np.float32(genome_features["membrane"]["aa_A"])
+    assert df_features.loc["GCA_2", "membrane_aa_A"] == 0.0
+    assert df_features.loc["GCA_2", "all_new_feature"] == 0.0
+
+    cache_path = str(tmp_path / "features.npz")
+    assert load_features_to_dataframe(str(features_dir), cache_path=cache_path).equals(df_features)
+    assert load_features_to_dataframe(str(features_dir), cache_path=cache_path).equals(df_features)
+    (features_dir / "GCA_3.features.json").write_text(json.dumps({"all": {"nt_length": 3}}))
+    assert len(load_features_to_dataframe(str(features_dir), cache_path=cache_path)) == 3
+
+
+@pytest.mark.parametrize("progress_every,n_reports", [(1, 2), (0, 0), (-1, 0)])
+def test_pool_measure_genome_features_progress(tmp_path, monkeypatch, progress_every, n_reports):
+    genome_dir = tmp_path / "genomes"
+    genome_dir.mkdir()
+    for accession in ["GCA_000000001", "GCA_000000002"]:
+        # unreadable genomes fail quickly but still count as measured
+        (genome_dir / f"{accession}.fna").write_text("not a FASTA")
+        (genome_dir / f"{accession}.faa").write_text("not a FASTA")
+    messages = []
+    monkeypatch.setattr(make_training_dataset.logger, "info", lambda msg, *args: messages.append(msg % args))
+
+    outputs = pool_measure_genome_features(
+        str(genome_dir), ".fna", ".faa", str(tmp_path), processes=1, progress_every=progress_every
+    )
+    assert len(outputs) == 2
+    assert len([message for message in messages if "genomes measured" in message]) == n_reports
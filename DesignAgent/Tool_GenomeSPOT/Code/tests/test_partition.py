@@ -16,7 +16,7 @@ class TestPartitionTaxa:
         with open(f"{cwd}/test_data/test_genome_accessions.txt", "r") as fh:
             genomes = [line.strip() for line in fh.readlines()]
 
-        taxonomy = TaxonomyGTDB(TAXONOMY_FILENAMES)
+        taxonomy = TaxonomyGTDB(TAXONOMY_FILENAMES, index_location=None)
         partitioner = PartitionTaxa(
             taxonomy=taxonomy,
             partition_rank="family",
@@ -25,3 +25,11 @@ class TestPartitionTaxa:
         partitioned_genomes = partitioner.partition(genomes, partition_size=0.02)
         expected_values = {"GCA_016190825", "GCA_020056635", "GCA_900549505", "GCA_903888175"}
         assert partitioned_genomes == expected_values
+
+    def test_find_relatives_of_partitioned_set_in_reference(self):
+        taxonomy = TaxonomyGTDB(TAXONOMY_FILENAMES, index_location=None)
+        partitioner = PartitionTaxa(taxonomy=taxonomy, partition_rank="family")
+        related_genomes = partitioner.find_relatives_of_partitioned_set_in_reference({"GCA_000875775"})
+        families = {taxonomy.taxonomy_dict[genome][4] for genome in related_genomes}
+        assert families == {"Nitrosopumilaceae"}
+        assert related_genomes == set(taxonomy.genomes_in_taxa(["Nitrosopumilaceae"], "family"))
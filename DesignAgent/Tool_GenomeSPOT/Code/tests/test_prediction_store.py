@@ -0,0 +1,131 @@
+# pylint: disable=missing-docstring
+
+import json
+import os
+
+import pytest
+
+from genome_spot.genome_spot import save_results
+from genome_spot.join_outputs import (
+    convert_outputs_to_single_tsv,
+    convert_store_to_nested_dict,
+    convert_store_to_single_tsv,
+)
+from genome_spot.prediction_store import (
+    PredictionStoreWriter,
+    compact_store,
+    read_features,
+    read_predictions,
+)
+
+
+try:
+    import pyarrow  # noqa: F401 pylint: disable=unused-import
+except ImportError:
+    pytestmark = pytest.mark.skip(reason="Parquet support requires pyarrow")
+
+
+def make_predictions(value):
+    predictions = {}
+    for condition in ["temperature", "ph", "salinity"]:
+        for attr in ["optimum", "min", "max"]:
+            predictions[f"{condition}_{attr}"] = {
+                "value": value,
+                "error": 1.5,
+                "units": "C",
+                "is_novel": False,
+                "warning": None,
+            }
+    predictions["oxygen"] = {"value": "tolerant", "error": 0.9, "units": "probability", "is_novel": True, "warning": None}
+    return predictions
+
+
+GENOME_FEATURES = {"all": {"protein_length": 300.5, "nt_length": 4000}, "membrane": {"aa_A": 0.1}}
+
+
+class TestPredictionStore:
+    def test_round_trip(self, tmp_path):
+        store = tmp_path / "store"
+        with PredictionStoreWriter(store) as writer:
+            writer.add("g1", make_predictions(30.0), GENOME_FEATURES)
+            writer.add("g2", make_predictions(40.0))
+
+        predictions_df = read_predictions(store)
+        assert list(predictions_df.index) == ["g1", "g2"]
+        assert predictions_df.loc["g2", "ph_optimum.value"] == 40.0
+        assert predictions_df.loc["g1", "oxygen.value"] == "tolerant"
+        assert bool(predictions_df.loc["g1", "oxygen.is_novel"]) is True
+
+        features_df = read_features(store)
+        assert list(features_df.index) == ["g1"]
+        assert features_df.loc["g1", "membrane_aa_A"] == 0.1
+        assert features_df.loc["g1", "all_nt_length"] == 4000
+
+    def test_latest_row_wins_and_compact(self, tmp_path):
+        store = tmp_path / "store"
+        for value in [30.0, 35.0]:
+            with PredictionStoreWriter(store, flush_every=1) as writer:
+                writer.add("g1", make_predictions(value))
+                writer.add("g2", make_predictions(value + 1))
+        assert len(os.listdir(store / "predictions")) == 4
+        expected = read_predictions(store)
+        assert expected.loc["g1", "ph_optimum.value"] == 35.0
+
+        compact_store(store)
+        assert len(os.listdir(store / "predictions")) == 1
+        assert read_predictions(store).equals(expected)
+
+    def test_read_columns(self, tmp_path):
+        store = tmp_path / "store"
+        with PredictionStoreWriter(store) as writer:
+            writer.add("g1", make_predictions(30.0))
+        predictions_df = read_predictions(store, columns=["ph_optimum.value"])
+        assert list(predictions_df.columns) == ["ph_optimum.value"]
+
+    def test_empty_store(self, tmp_path):
+        assert read_predictions(tmp_path / "missing").empty
+
+    def test_save_results_to_store_only(self, tmp_path):
+        store = tmp_path / "store"
+        for genome_id in ["g1", "g2"]:
+            save_results(
+                predictions=make_predictions(30.0),
+                genome_features=GENOME_FEATURES,
+                output_prefix=str(tmp_path / genome_id),
+                prediction_store=store,
+                store_only=True,
+            )
+        assert sorted(os.listdir(tmp_path)) == ["store"]
+        assert list(read_predictions(store).index) == ["g1", "g2"]
+        assert list(read_features(store).index) == ["g1", "g2"]
+        compact_store(store)
+        assert len(os.listdir(store / "predictions")) == len(os.listdir(store / "features")) == 1
+
+        with pytest.raises(ValueError, match="prediction store"):
+            save_results(predictions=make_predictions(30.0), output_prefix=str(tmp_path / "g3"), store_only=True)
+
+
+def test_join_outputs_from_store(tmp_path):
+    store = tmp_path / "store"
+    with PredictionStoreWriter(store) as writer:
+        writer.add("g1", make_predictions(30.0))
+
+    single_tsv = convert_store_to_single_tsv(store)
+    assert single_tsv.loc["g1", ("ph_optimum", "prediction")] == 30.0
+    assert single_tsv.loc["g1", ("oxygen", "prediction")] == "tolerant"
+
+    output_tsv = str(tmp_path / "g1")
+    save_results(predictions=make_predictions(30.0), output_prefix=output_tsv, save_genome_features=False)
+    tsv_single_tsv = convert_outputs_to_single_tsv([f"{output_tsv}.predictions.tsv"])
+    assert sorted(tsv_single_tsv.columns) == sorted(single_tsv.columns)
+    for column in single_tsv.columns:
+        if column[1] in ["prediction", "error"] and single_tsv[column].dtype == float:
+            assert tsv_single_tsv[column].dtype == float
+            assert tsv_single_tsv[column].equals(single_tsv[column])
+
+    output_dict = convert_store_to_nested_dict(store)
+    assert output_dict["g1"]["ph"]["optimum"]["value"] == 30.0
+    assert output_dict["g1"]["ph"]["is_novel"] is False
+    assert output_dict["g1"]["ph"]["units"] == "C"
+    assert output_dict["g1"]["ph"]["optimum"]["warning"] is None
+    json.dumps(output_dict)
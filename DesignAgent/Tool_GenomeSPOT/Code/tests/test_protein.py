@@ -1,6 +1,14 @@
 # pylint: disable=missing-docstring
+import numpy as np
 import pytest
-from genome_spot.bioinformatics.protein import Protein
+from genome_spot.bioinformatics.protein import (
+    AMINO_ACIDS,
+    HYDROPHOBICITY,
+    Protein,
+    count_amino_acids,
+    encode_protein_sequence,
+    isoelectric_points,
+)
 
 
 PROTEIN_SEQUENCE = "".join(
@@ -62,3 +70,34 @@ class TestProtein:
         }
 
         assert protein.protein_metrics() == pytest.approx(expected_values)
+
+    def test_composition(self):
+        protein = Protein(PROTEIN_SEQUENCE)
+        composition = protein.composition()
+        trimmed_sequence = protein.sequence[protein.start_pos :]
+        assert composition.sum() == len(trimmed_sequence)
+        assert composition.tolist() == [trimmed_sequence.count(aa) for aa in AMINO_ACIDS]
+
+    def test_scale_metrics_match_per_residue_loops(self):
+        protein = Protein(PROTEIN_SEQUENCE)
+        trimmed_sequence = protein.sequence[protein.start_pos :]
+        assert protein.gravy() == pytest.approx(np.mean([HYDROPHOBICITY[aa] for aa in trimmed_sequence]))
+
+
+def test_encode_protein_sequence():
+    codes = encode_protein_sequence("ACY*x")
+    assert codes.dtype == np.uint8
+    assert count_amino_acids(codes).sum() == 3
+    assert codes.tolist()[:3] == [AMINO_ACIDS.index(aa) for aa in "ACY"]
+
+
+def test_isoelectric_points():
+    # Values from the Bio.SeqUtils.IsoelectricPoint documentation
+    sequences = ["INGAR", "PETER"]
+    codes = [encode_protein_sequence(sequence) for sequence in sequences]
+    pis = isoelectric_points(
+        np.array([count_amino_acids(c) for c in codes]),
+        np.array([c[0] for c in codes]),
+        np.array([c[-1] for c in codes]),
+    )
+    assert pis.round(2).tolist() == [9.75, 4.53]
@@ -0,0 +1,156 @@
+# pylint: disable=missing-docstring
+import copy
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+import run_genomespot_batch
+from genome_spot.genome_spot import save_results
+from run_genomespot_batch import (
+    fold_predictions_tsvs,
+    load_manifest,
+    read_summary_rows,
+    run_batch,
+    save_manifest,
+    write_summary,
+)
+
+
+cwd = Path(__file__).resolve().parent
+MODELS_DIR = f"{cwd.parent}/models"
+CONTIG_FASTA = cwd / "test_data" / "GCA_000172155.1_ASM17215v1_genomic.fna.gz"
+PROTEIN_FASTA = cwd / "test_data" / "GCA_000172155.1_ASM17215v1_protein.faa.gz"
+with open(f"{cwd}/test_data/GCA_000172155.predictions.json", "r", encoding="utf-8") as fh:
+    PREDICTIONS = json.load(fh)
+
+
+def write_tsv(workdir, strain, ph_optimum=7.0, mtime_ns=None):
+    predictions = copy.deepcopy(PREDICTIONS)
+    predictions["ph_optimum"]["value"] = ph_optimum
+    save_results(predictions=predictions, output_prefix=f"{workdir}/{strain}", save_genome_features=False)
+    tsv = workdir / f"{strain}.predictions.tsv"
+    if mtime_ns is not None:
+        # file systems may not resolve rewrites made within the same tick
+        os.utime(tsv, ns=(mtime_ns, mtime_ns))
+    return tsv
+
+
+def aggregate(workdir, summary_path):
+    """Aggregates TSVs into the summary as `main` does after running genomes"""
+    manifest = load_manifest(summary_path)
+    rows = read_summary_rows(summary_path) if manifest is not None else {}
+    folded = manifest["files"] if manifest is not None else {}
+    appended, rewrite = fold_predictions_tsvs(workdir, rows, folded)
+    write_summary(summary_path, rows, appended, rewrite or manifest is None)
+    save_manifest(summary_path, folded)
+    return pd.read_csv(summary_path, index_col="strain")
+
+
+@pytest.fixture
+def summarized(tmp_path, monkeypatch):
+    summarized = []
+    summarize = run_genomespot_batch.summarize_predictions_tsv
+
+    def summarize_and_record(tsv):
+        summarized.append(tsv.name)
+        return summarize(tsv)
+
+    monkeypatch.setattr(run_genomespot_batch, "summarize_predictions_tsv", summarize_and_record)
+    for strain in ["g1", "g2"]:
+        write_tsv(tmp_path, strain)
+    aggregate(tmp_path, tmp_path / "summary.csv")
+    summarized.clear()
+    return tmp_path, tmp_path / "summary.csv", summarized
+
+
+class TestIncrementalSummary:
+
+    def test_added_tsv_is_appended(self, summarized):
+        workdir, summary_path, summarized_tsvs = summarized
+        write_tsv(workdir, "g0", ph_optimum=5.0)
+        summary = aggregate(workdir, summary_path)
+        assert summarized_tsvs == ["g0.predictions.tsv"]
+        # appended, not rewritten in order
+        assert summary.index.tolist() == ["g1", "g2", "g0"]
+        assert summary.loc["g0", "ph_optimum"] == 5.0
+
+    def test_changed_tsv_replaces_row(self, summarized):
+        workdir, summary_path, summarized_tsvs = summarized
+        mtime_ns = (workdir / "g2.predictions.tsv").stat().st_mtime_ns
+        write_tsv(workdir, "g2", ph_optimum=8.5, mtime_ns=mtime_ns + 10**9)
+        summary = aggregate(workdir, summary_path)
+        assert summarized_tsvs == ["g2.predictions.tsv"]
+        assert summary.index.tolist() == ["g1", "g2"]
+        assert summary.loc["g2", "ph_optimum"] == 8.5
+
+    def test_changed_tsv_that_no_longer_parses_is_dropped(self, summarized):
+        workdir, summary_path, _ = summarized
+        (workdir / "g2.predictions.tsv").write_text("not\ta predictions table\n")
+        assert aggregate(workdir, summary_path).index.tolist() == ["g1"]
+        # and stays dropped in later runs
+        assert aggregate(workdir, summary_path).index.tolist() == ["g1"]
+
+    def test_removed_tsv_drops_row(self, summarized):
+        workdir, summary_path, summarized_tsvs = summarized
+        (workdir / "g1.predictions.tsv").unlink()
+        summary = aggregate(workdir, summary_path)
+        assert summarized_tsvs == []
+        assert summary.index.tolist() == ["g2"]
+        assert "g1.predictions.tsv" not in load_manifest(summary_path)["files"]
+
+    def test_edited_summary_is_reaggregated(self, summarized):
+        workdir, summary_path, summarized_tsvs = summarized
+        with open(summary_path, "a", encoding="utf-8") as fh:
+            fh.write("edited" + "," * 10 + "\n")
+        assert load_manifest(summary_path) is None
+        summary = aggregate(workdir, summary_path)
+        assert sorted(summarized_tsvs) == ["g1.predictions.tsv", "g2.predictions.tsv"]
+        assert summary.index.tolist() == ["g1", "g2"]
+
+
+def make_tasks(tmp_path):
+    genome_dir = tmp_path / "genomes"
+    genome_dir.mkdir()
+    (genome_dir / "bad.fna").write_text(">contig\nACGT\n")
+    (genome_dir / "bad.faa").write_text("not a FASTA")
+    return [(CONTIG_FASTA, PROTEIN_FASTA), (genome_dir / "bad.fna", genome_dir / "bad.faa")]
+
+
+class TestRunBatch:
+
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_failed_genome_is_isolated(self, tmp_path, jobs):
+        out_dir = tmp_path / "out"
+        results = {stem: (outputs, error) for stem, outputs, error in run_batch(
+            MODELS_DIR, make_tasks(tmp_path), out_dir, jobs=jobs, feature_cache=None
+        )}
+        assert sorted(results) == ["GCA_000172155.1_ASM17215v1_protein.faa", "bad"]
+
+        outputs, error = results["GCA_000172155.1_ASM17215v1_protein.faa"]
+        assert error is None
+        tsv, predictions, genome_features = outputs
+        assert tsv == out_dir / "GCA_000172155.1_ASM17215v1_protein.faa.predictions.tsv"
+        assert tsv.exists()
+        assert predictions["oxygen"]["value"] in ["tolerant", "not tolerant"]
+        assert "membrane" in genome_features
+
+        outputs, error = results["bad"]
+        assert outputs is None
+        assert error.startswith("Traceback")
+        assert not (out_dir / "bad.predictions.tsv").exists()
+
+    def test_broken_pool_is_reported(self, tmp_path, monkeypatch):
+        def crash(models_dir, contigs, faa, out_dir, feature_cache=None):
+            # a worker killed by the OS, e.g. for running out of memory
+            os._exit(1)
+
+        # workers are forked and see the patched function
+        monkeypatch.setattr(run_genomespot_batch, "run_genomespot", crash)
+        results = list(run_batch(MODELS_DIR, make_tasks(tmp_path), tmp_path / "out", jobs=2, feature_cache=None))
+        assert sorted(stem for stem, _, _ in results) == ["GCA_000172155.1_ASM17215v1_protein.faa", "bad"]
+        for _, outputs, error in results:
+            assert outputs is None
+            assert "BrokenProcessPool" in error
@@ -0,0 +1,94 @@
+# pylint: disable=missing-docstring
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.base import clone
+from sklearn.feature_selection import (
+    SelectKBest,
+    f_regression,
+)
+from sklearn.linear_model import (
+    Lasso,
+    Ridge,
+)
+from sklearn.preprocessing import StandardScaler
+
+from genome_spot.helpers import (
+    load_cv_sets,
+    split_train_and_test_data,
+)
+from genome_spot.model_training.run_model_selection import (
+    BASE_VARS_AAS,
+    RESULTS_TABLE,
+    ModelSelection,
+    load_results_table,
+)
+from genome_spot.model_training.train_models import predict_and_score
+
+
+FEATURES = [f"all_{feature}" for feature in BASE_VARS_AAS]
+
+
+class SmallModelSelection(ModelSelection):
+    def generate_named_feature_sets(self):
+        return [("aas", FEATURES), ("aas_head", FEATURES[:5])]
+
+    def load_regressors(self, features):
+        selector = SelectKBest(f_regression, k=min([3, len(features)]))
+        return [
+            (StandardScaler(), selector, Ridge(alpha=1.0)),
+            (StandardScaler(), selector, Ridge(alpha=10.0)),
+            (StandardScaler(), Lasso(alpha=0.01)),
+        ]
+
+
+@pytest.fixture
+def holdouts(tmp_path):
+    rng = np.random.default_rng(0)
+    genomes = [f"GCA_{i:09d}" for i in range(60)]
+    df = pd.DataFrame(rng.random((60, len(FEATURES))), index=genomes, columns=FEATURES)
+    df["temperature_optimum"] = 30 * df[FEATURES[0]] + 10 * df[FEATURES[1]] + rng.normal(0, 1, 60)
+    (tmp_path / "train_set_temperature.txt").write_text("\n".join(genomes[:50]))
+    (tmp_path / "test_set_temperature.txt").write_text("\n".join(genomes[50:]))
+    folds = np.array_split(rng.permutation(50), 5)
+    cv_sets = [[sorted(set(range(50)) - set(fold.tolist())), sorted(fold.tolist())] for fold in folds]
+    (tmp_path / "temperature_cv_sets.json").write_text(json.dumps({"family": cv_sets}))
+    outdir = tmp_path / "out"
+    outdir.mkdir()
+    return df, str(tmp_path), str(outdir)
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_scores_match_predict_and_score(holdouts, n_jobs):
+    df, path_to_holdouts, outdir = holdouts
+    selection = SmallModelSelection(n_jobs=n_jobs)
+    selection.score_all_models_and_feature_sets(df, "temperature", path_to_holdouts, outdir)
+
+    results_df = load_results_table(f"{outdir}/{RESULTS_TABLE}")
+    assert len(results_df) == 6
+    df_train, _ = split_train_and_test_data(df, "temperature", path_to_holdouts)
+    cv_sets = load_cv_sets("temperature", path_to_holdouts)
+    for i, (_, features) in enumerate(selection.generate_named_feature_sets()):
+        for j, pipeline in enumerate(selection.load_pipeline_for_condition("temperature", features)):
+            expected = predict_and_score(
+                "temperature", df_train[features], df_train["temperature_optimum"], cv_sets, clone(pipeline)
+            )
+            row = results_df.loc[f"temperature_optimum_features{i}_pipeline{j}"]
+            assert row[["rmse", "r2", "corr"]].tolist() == pytest.approx(list(expected.values()))
+            with open(row["results_file"]) as fh:
+                assert json.load(fh)["features"] == features
+
+
+def test_resume_skips_scored_models(holdouts, monkeypatch):
+    df, path_to_holdouts, outdir = holdouts
+    SmallModelSelection().score_all_models_and_feature_sets(df, "temperature", path_to_holdouts, outdir)
+    timestamps = load_results_table(f"{outdir}/{RESULTS_TABLE}")["timestamp"]
+
+    def fail(*args, **kwargs):
+        raise AssertionError("no model should be refit")
+
+    monkeypatch.setattr(SmallModelSelection, "_run_fits", fail)
+    SmallModelSelection().score_all_models_and_feature_sets(df, "temperature", path_to_holdouts, outdir)
+    assert load_results_table(f"{outdir}/{RESULTS_TABLE}")["timestamp"].equals(timestamps)
@@ -1,5 +1,8 @@
 # pylint: disable=missing-docstring
-from genome_spot.bioinformatics.signal_peptide import SignalPeptideHMM
+from genome_spot.bioinformatics.signal_peptide import (
+    SignalPeptideHMM,
+    load_trained_model,
+)
 
 
 PARTIAL_SEQUENCE = "MNKTLIAAAVAGIVLLASNAQAQTVPEGYQLQQVLMMSRHNLRAPLANNG"
@@ -13,3 +16,16 @@ class TestSignalPeptide:
         signal_peptide = PARTIAL_SEQUENCE[: signal_end_index + 1]
         assert is_exported is True
         assert signal_peptide == "MNKTLIAAAVAGIVLLASNAQA"
+
+    def test_model_loaded_once(self):
+        first_model = SignalPeptideHMM()
+        second_model = SignalPeptideHMM()
+        assert first_model.model is second_model.model
+        assert first_model.model is load_trained_model()
+
+    def test_predict_signal_peptides_batch(self):
+        signal_peptide_model = SignalPeptideHMM()
+        sequences = [PARTIAL_SEQUENCE, PARTIAL_SEQUENCE[:20], "MKXB" * 15, PARTIAL_SEQUENCE[::-1]]
+        expected_values = [signal_peptide_model.predict_signal_peptide(sequence) for sequence in sequences]
+        assert signal_peptide_model.predict_signal_peptides_batch(sequences) == expected_values
+        assert signal_peptide_model.predict_signal_peptides_batch([]) == []
@@ -1,7 +1,12 @@
 # pylint: disable=missing-docstring
 from pathlib import Path
 
-from genome_spot.taxonomy.taxonomy import TaxonomyGTDB
+import numpy as np
+
+from genome_spot.taxonomy.taxonomy import (
+    TaxonomyGTDB,
+    load_taxonomy,
+)
 
 
 cwd = Path(__file__).resolve().parent
@@ -11,13 +16,13 @@ TAXONOMY_FILENAMES = [f"{cwd}/test_data/test_ar53_taxonomy_r214.tsv", f"{cwd}/te
 class TestTaxonomyGTDB:
 
     def test_convert_gtdb_to_ncbi(self):
-        taxonomy = TaxonomyGTDB(TAXONOMY_FILENAMES)
+        taxonomy = TaxonomyGTDB(TAXONOMY_FILENAMES, index_location=None)
         gtdb_accession = "RS_GCF_015350875.1"
         ncbi_accession = taxonomy.convert_gtdb_to_ncbi(gtdb_accession, make_genbank=True, remove_version=True)
         assert ncbi_accession == "GCA_015350875"
 
     def test_make_taxonomy_dict(self):
-        taxonomy = TaxonomyGTDB(TAXONOMY_FILENAMES)
+        taxonomy = TaxonomyGTDB(TAXONOMY_FILENAMES, index_location=None)
         assert len(taxonomy.taxonomy_dict) == 1100
         assert taxonomy.taxonomy_dict["GCA_000875775"] == (
             "Archaea",
@@ -39,14 +44,14 @@ class TestTaxonomyGTDB:
         )
 
     def test_taxa_of_genomes(self):
-        taxonomy = TaxonomyGTDB(TAXONOMY_FILENAMES)
+        taxonomy = TaxonomyGTDB(TAXONOMY_FILENAMES, index_location=None)
         genomes = ["GCA_014729675", "GCA_006954425", "GCA_000875775"]
         taxa = taxonomy.taxa_of_genomes(genomes, "family")
         assert taxa == ["Methanomethylophilaceae", "Nitrosopumilaceae", "WJKL01"]
 
     def test_genomes_in_taxa(self):
 
-        taxonomy = TaxonomyGTDB(TAXONOMY_FILENAMES)
+        taxonomy = TaxonomyGTDB(TAXONOMY_FILENAMES, index_location=None)
         genomes = ["GCA_014729675", "GCA_006954425", "GCA_000875775"]
         taxa = taxonomy.taxa_of_genomes(genomes, "family")
         related_genomes = taxonomy.genomes_in_taxa(taxa, "family")
@@ -69,7 +74,67 @@ class TestTaxonomyGTDB:
         assert related_genomes == expected_values
 
     def test_measure_diversity(self):
-        taxonomy = TaxonomyGTDB(TAXONOMY_FILENAMES)
+        taxonomy = TaxonomyGTDB(TAXONOMY_FILENAMES, index_location=None)
         genomes = ["GCA_014729675", "GCA_006954425", "GCA_000875775"]
         diversity = taxonomy.measure_diversity(query_rank="family", diversity_rank="species", subset_genomes=genomes)
         assert diversity == {"Methanomethylophilaceae": 1, "Nitrosopumilaceae": 1, "WJKL01": 1}
+
+    def test_diversity_counts(self):
+        taxonomy = TaxonomyGTDB(TAXONOMY_FILENAMES, index_location=None)
+        genomes = ["GCA_014729675", "GCA_006954425", "GCA_000875775", "GCA_999999999"]
+        rows = taxonomy.rows_of_genomes(genomes)
+        counts = taxonomy.diversity_counts("family", "species", rows=rows[rows >= 0])
+        assert len(counts) == len(taxonomy.rank_names[taxonomy.indices["family"]])
+        families = taxonomy.rank_names[taxonomy.indices["family"]][np.flatnonzero(counts)].tolist()
+        assert dict(zip(families, counts[counts > 0].tolist())) == taxonomy.measure_diversity(
+            query_rank="family", diversity_rank="species", subset_genomes=genomes
+        )
+
+    def test_index_is_saved_and_memory_mapped(self, tmp_path):
+        parsed = TaxonomyGTDB(TAXONOMY_FILENAMES, index_location=None)
+        built = TaxonomyGTDB(TAXONOMY_FILENAMES, index_location=str(tmp_path))
+        loaded = TaxonomyGTDB(TAXONOMY_FILENAMES, index_location=str(tmp_path))
+        assert isinstance(loaded.rank_codes, np.memmap)
+        assert len(list(tmp_path.iterdir())) == 1
+        # shared index directories are readable by other users
+        assert next(tmp_path.iterdir()).stat().st_mode & 0o777 == 0o755
+        assert parsed.taxonomy_dict == parsed.make_taxonomy_dict()
+        assert built.taxonomy_dict == parsed.taxonomy_dict
+        assert loaded.taxonomy_dict == parsed.taxonomy_dict
+
+    def test_rows_of_genomes(self):
+        taxonomy = TaxonomyGTDB(TAXONOMY_FILENAMES, index_location=None)
+        rows = taxonomy.rows_of_genomes(["GCA_000875775", "GCA_999999999", "GCA_902645985"])
+        assert rows[1] == -1
+        assert taxonomy.accessions[rows[0]] == b"GCA_000875775"
+        family_codes = taxonomy.rank_codes[rows[[0, 2]], taxonomy.indices["family"]]
+        assert taxonomy.rank_names[taxonomy.indices["family"]][family_codes].tolist() == [
+            "Nitrosopumilaceae",
+            "Anaplasmataceae",
+        ]
+
+    def test_array_lookups_match_taxonomy_dict(self):
+        taxonomy = TaxonomyGTDB(TAXONOMY_FILENAMES, index_location=None)
+        index = taxonomy.indices["genus"]
+        at_genus = {genome: lineage[index] for genome, lineage in taxonomy.taxonomy_dict.items()}
+        assert taxonomy.taxonomy_dict_at_taxlevel("genus") == at_genus
+        genera = ["Nitrosopumilus", "Wolbachia", "not_a_genus"]
+        assert taxonomy.genomes_in_taxa(genera, "genus") == sorted(
+            genome for genome, genus in at_genus.items() if genus in genera
+        )
+        n_genera = {}
+        for genus in set(at_genus.values()):
+            family = taxonomy.taxonomy_dict[taxonomy.genomes_in_taxa([genus], "genus")[0]][4]
+            n_genera[family] = n_genera.get(family, 0) + 1
+        assert taxonomy.measure_diversity(query_rank="family", diversity_rank="genus") == n_genera
+
+    def test_lineages_of_genomes(self):
+        taxonomy = TaxonomyGTDB(TAXONOMY_FILENAMES, index_location=None)
+        lineages = taxonomy.lineages_of_genomes(["GCA_902645985", "GCA_999999999"])
+        assert lineages.loc["GCA_902645985"].tolist() == list(taxonomy.taxonomy_dict["GCA_902645985"])
+        assert lineages.loc["GCA_999999999"].isna().all()
+
+
+def test_load_taxonomy_is_shared(tmp_path):
+    taxonomy = load_taxonomy(TAXONOMY_FILENAMES, index_location=str(tmp_path))
+    assert load_taxonomy(TAXONOMY_FILENAMES, index_location=str(tmp_path)) is taxonomy
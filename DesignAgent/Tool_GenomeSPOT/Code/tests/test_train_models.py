@@ -0,0 +1,137 @@
+# pylint: disable=missing-docstring
+import json
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.base import clone
+from sklearn.linear_model import (
+    LogisticRegression,
+    Ridge,
+)
+from sklearn.metrics import mean_squared_error
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+from genome_spot.genome_spot import ErrorModel
+from genome_spot.model_training import train_models
+from genome_spot.model_training.make_holdout_sets import (
+    make_cv_sets_randomly,
+    yield_cv_sets,
+)
+from genome_spot.model_training.train_models import (
+    binned_rmse_by_value,
+    fit_with_cv,
+    predict_training_and_cv,
+    rmse_by_value,
+    train_model_for_each_condition,
+)
+
+
+FEATURES = [f"feature_{i}" for i in range(5)]
+
+
+def make_training_df(n_genomes=120, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(
+        rng.random((n_genomes, len(FEATURES))),
+        index=[f"GCA_{i:09d}" for i in range(n_genomes)],
+        columns=FEATURES,
+    )
+    df["ph_optimum"] = 5 + 4 * df["feature_0"] + rng.normal(0, 0.3, n_genomes)
+    df["ph_min"] = df["ph_optimum"] - 1 - df["feature_1"]
+    df["ph_max"] = df["ph_optimum"] + 1 + df["feature_2"]
+    df["oxygen"] = (df["feature_3"] + rng.normal(0, 0.2, n_genomes) > 0.5).astype(int)
+    df["use_ph"] = True
+    return df
+
+
+def masked_rmse_by_value(y_true, y_pred, interval):
+    rmse_arr = np.empty(y_true.shape)
+    for i, y in enumerate(y_pred):
+        mask = (y_pred > (y - interval / 2)) & (y_pred < (y + interval / 2))
+        rmse_arr[i] = np.sqrt(mean_squared_error(y_true[mask], y_pred[mask]))
+    return np.stack([y_pred, rmse_arr], axis=1)
+
+
+@pytest.mark.parametrize("interval", [0.5, 1, 10])
+def test_rmse_by_value_matches_masks(interval):
+    rng = np.random.default_rng(0)
+    y_true = rng.normal(7, 2, 500)
+    # rounded predictions place some values exactly on window bounds
+    y_pred = np.round(y_true + rng.normal(0, 1, 500), 1)
+    expected = masked_rmse_by_value(y_true, y_pred, interval)
+    error_arr = rmse_by_value(y_true, y_pred, interval)
+    assert np.array_equal(error_arr[:, 0], expected[:, 0])
+    np.testing.assert_allclose(error_arr[:, 1], expected[:, 1], rtol=1e-12)
+
+
+def test_binned_rmse_by_value():
+    rng = np.random.default_rng(1)
+    y_true = rng.normal(7, 2, 2000)
+    y_pred = y_true + rng.normal(0, 1, 2000)
+    binned = binned_rmse_by_value(y_true, y_pred, interval=1, bin_width=0.1)
+    assert len(binned) <= int(np.ptp(y_pred) / 0.1) + 2
+    assert binned[0, 0] == y_pred.min()
+    assert np.all(np.diff(binned[:, 0]) > 0)
+    # each bin holds the error of predictions around its value
+    for center, rmse in binned[::10]:
+        mask = (y_pred > center - 0.5) & (y_pred < center + 0.5)
+        assert rmse == pytest.approx(np.sqrt(mean_squared_error(y_true[mask], y_pred[mask])))
+    # and looks up close to the error of one row per genome
+    error_arr = rmse_by_value(y_true, y_pred, interval=1)
+    assert np.mean(np.abs(ErrorModel(binned).lookup(y_pred) - error_arr[:, 1])) < 0.01
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_fit_with_cv_matches_predict_training_and_cv(n_jobs):
+    df = make_training_df()
+    X_train = df[FEATURES].values
+    cv_sets = make_cv_sets_randomly(df.index.values, kfold=5)
+    targets = ["ph_optimum", "ph_min", "ph_max"]
+    pipeline = make_pipeline(StandardScaler(), Ridge(alpha=1.0))
+    fitted, y_valid_preds = fit_with_cv(
+        {target: pipeline for target in targets}, X_train, df[targets], cv_sets, n_jobs=n_jobs
+    )
+    for target in targets:
+        expected_pipeline, _, expected = predict_training_and_cv(
+            X_train, df[target], clone(pipeline), cv=yield_cv_sets(cv_sets)
+        )
+        np.testing.assert_allclose(y_valid_preds[target], expected)
+        np.testing.assert_allclose(fitted[target].predict(X_train), expected_pipeline.predict(X_train))
+
+    classifier = make_pipeline(StandardScaler(), LogisticRegression())
+    _, y_valid_preds = fit_with_cv({"oxygen": classifier}, X_train, df[["oxygen"]], cv_sets, method="predict_proba")
+    _, _, expected = predict_training_and_cv(
+        X_train, df["oxygen"], clone(classifier), cv=yield_cv_sets(cv_sets), method="predict_proba"
+    )
+    np.testing.assert_allclose(y_valid_preds["oxygen"], expected)
+
+
+def test_train_model_for_each_condition(tmp_path, monkeypatch):
+    df = make_training_df()
+    (tmp_path / "train_set_ph.txt").write_text("\n".join(df.index[:100]))
+    (tmp_path / "test_set_ph.txt").write_text("\n".join(df.index[100:]))
+    pipeline_filename = str(tmp_path / "pipeline.joblib")
+    joblib.dump(make_pipeline(StandardScaler(), Ridge(alpha=1.0)), pipeline_filename)
+    instructions = {"ph": {"pipeline_filename": pipeline_filename, "features": FEATURES}}
+
+    n_calls = []
+
+    def make_cv_sets(genomes, partition_rank, kfold):
+        n_calls.append(partition_rank)
+        return make_cv_sets_randomly(np.array(genomes), kfold=kfold)
+
+    monkeypatch.setattr(train_models, "make_cv_sets_by_phylogeny", make_cv_sets)
+    train_model_for_each_condition("ph", df, instructions, str(tmp_path), str(tmp_path), error_bins_per_interval=10)
+
+    assert n_calls == ["family"]
+    assert (tmp_path / "novelty_ph.joblib").exists()
+    for target in ["ph_optimum", "ph_min", "ph_max"]:
+        model = joblib.load(tmp_path / f"{target}.joblib")
+        assert model.predict(df[FEATURES].values).shape == (len(df),)
+        error_model = joblib.load(tmp_path / f"error_{target}.joblib")
+        assert error_model.shape[1] == 2 and len(error_model) < len(df)
+        with open(tmp_path / f"{target}.instructions.json") as fh:
+            assert json.load(fh)["features"] == FEATURES